@@ -12,7 +12,8 @@ chrome.runtime.onMessage.addListener((request, sender, sendResponse) => {
       body: JSON.stringify({
         tweetText: request.tweetText,
         images: request.images,
-        tone: request.tone
+        tone: request.tone,
+        noCache: !!request.noCache
       })
     })
     .then(response => response.json())
@@ -29,6 +30,21 @@ chrome.runtime.onMessage.addListener((request, sender, sendResponse) => {
     return true; // Keep channel open for async response
   }
 
+  if (request.action === 'prefetch') {
+    fetch(`${SERVER_URL}/prefetch`, {
+      method: 'POST',
+      headers: {
+        'Content-Type': 'application/json',
+      },
+      body: JSON.stringify({ items: request.items })
+    })
+      .then(r => r.json())
+      .then(data => sendResponse(data))
+      .catch(() => sendResponse({ success: false }));
+
+    return true;
+  }
+
   if (request.action === 'checkHealth') {
     fetch(`${SERVER_URL}/health`)
       .then(r => r.json())
@@ -162,6 +162,7 @@ function addToneSelector() {
   const selector = document.getElementById('ai-global-tone');
   selector.addEventListener('change', (e) => {
     currentTone = e.target.value;
+    schedulePrefetch();
   });
 }
 
@@ -178,12 +179,13 @@ function extractImages(tweet) {
   return images;
 }
 
-function generateReply(tweetText, images) {
+function generateReply(tweetText, images, noCache = false) {
   return safeRuntimeSendMessage({
     action: 'generateReply',
     tweetText: tweetText,
     images: images,
-    tone: currentTone
+    tone: currentTone,
+    noCache: noCache
   }).then((response) => {
     if (response && response.success) {
       return response.reply;
@@ -192,6 +194,42 @@ function generateReply(tweetText, images) {
   });
 }
 
+// Tell the server which tweets are on screen so it can prepare replies in the
+// background. Each call replaces the previous list, cancelling tweets scrolled away.
+// Sent 1.5s after scrolling and DOM changes settle, and at least every 5s while
+// they keep coming (an updating timeline never settles).
+const PREFETCH_DEBOUNCE_MS = 1500;
+const PREFETCH_MAX_WAIT_MS = 5000;
+let prefetchTimer = null;
+let prefetchPendingSince = null;
+
+function sendVisibleTweets() {
+  clearTimeout(prefetchTimer);
+  prefetchTimer = null;
+  prefetchPendingSince = null;
+
+  const items = [];
+  document.querySelectorAll('article[data-testid="tweet"]').forEach(tweet => {
+    const rect = tweet.getBoundingClientRect();
+    if (rect.bottom < 0 || rect.top > window.innerHeight) return;
+
+    const tweetText = tweet.querySelector('[data-testid="tweetText"]')?.innerText || '';
+    if (!tweetText) return;
+
+    items.push({ tweetText: tweetText, images: extractImages(tweet), tone: currentTone });
+  });
+
+  safeRuntimeSendMessage({ action: 'prefetch', items: items }).catch(() => {});
+}
+
+function schedulePrefetch() {
+  const now = Date.now();
+  if (prefetchPendingSince === null) prefetchPendingSince = now;
+  clearTimeout(prefetchTimer);
+  const delay = Math.min(PREFETCH_DEBOUNCE_MS, prefetchPendingSince + PREFETCH_MAX_WAIT_MS - now);
+  prefetchTimer = setTimeout(sendVisibleTweets, Math.max(0, delay));
+}
+
 function addGenerateButtons() {
   const tweets = document.querySelectorAll('article[data-testid="tweet"]');
 
@@ -262,7 +300,9 @@ function addGenerateButtons() {
         }
 
         btn.innerHTML = '🤖 AI thinking...';
-        const reply = await generateReply(tweetText, images);
+        // Clicking the same tweet again means "regenerate": skip the server cache
+        const reply = await generateReply(tweetText, images, btn.dataset.generated === '1');
+        btn.dataset.generated = '1';
 
         // Paste it
         await pasteIntoXEditor(replyBox, reply);
@@ -325,8 +365,11 @@ setTimeout(() => {
 const observer = new MutationObserver(() => {
   addToneSelector();
   addGenerateButtons();
+  schedulePrefetch();
 });
 
+window.addEventListener('scroll', schedulePrefetch, { passive: true });
+
 observer.observe(document.body, {
   childList: true,
   subtree: true
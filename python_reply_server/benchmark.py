@@ -0,0 +1,291 @@
+"""Load test python-server.py against the local mock LLM and track a JSON baseline.
+
+    python3 benchmark.py --concurrency 8 --requests 200
+    python3 benchmark.py --scenarios generate --latency-ms 800 --p429 0.1
+
+Starts mock_llm.py and python-server.py (unless --url points at a running server),
+drives each scenario at the given concurrency and prints p50/p95/p99 and RPS.
+Results are compared with the baseline file; the first run (or --update-baseline)
+writes it. Exits 1 when a p95 or RPS regression exceeds --tolerance.
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import requests
+
+from mock_llm import LatencyModel, MockLLMServer
+
+SERVER = Path(__file__).parent / "python-server.py"
+
+# Other providers would take part in routing; the benchmark only talks to the mock
+PROVIDER_ENV = ("GROQ_API_KEY", "GROQ_BASE_URL", "ANTHROPIC_API_KEY", "LOCAL_LLM_BASE_URL", "PROVIDERS")
+
+
+def percentile(samples, p):
+    """Nearest-rank percentile of sorted samples, p in [0, 1]"""
+    return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def scenario_requests(name, base_url):
+    """Returns make(i) -> (method, url, json body or None) for one scenario"""
+    run = uuid.uuid4().hex[:8]
+
+    def make(i):
+        if name == "generate":
+            # Unique tweets: every request reaches the upstream
+            return "POST", f"{base_url}/generate", {"tweetText": f"bench {run} tweet {i}: $BTC breaking out", "tone": "bullish"}
+        if name == "generate-cached":
+            return "POST", f"{base_url}/generate", {"tweetText": f"bench {run} cached tweet", "tone": "bullish"}
+        if name == "generate-stream":
+            return "POST", f"{base_url}/generate/stream", {"tweetText": f"bench {run} stream {i}", "tone": "bullish"}
+        if name == "config":
+            return "GET", f"{base_url}/config", None
+        if name == "health":
+            return "GET", f"{base_url}/health", None
+        raise ValueError(f"unknown scenario: {name}")
+
+    return make
+
+
+def run_scenario(name, base_url, concurrency, total, timeout):
+    make = scenario_requests(name, base_url)
+    counter = iter(range(total))
+    counter_lock = threading.Lock()
+    latencies = []
+    statuses = {}
+    errors = []
+    results_lock = threading.Lock()
+
+    def next_index():
+        with counter_lock:
+            return next(counter, None)
+
+    def worker():
+        # One keep-alive session per worker, like a real client
+        session = requests.Session()
+        while True:
+            i = next_index()
+            if i is None:
+                return
+            method, url, body = make(i)
+            started = time.perf_counter()
+            try:
+                r = session.request(method, url, json=body, timeout=timeout)
+                r.content
+                status = r.status_code
+            except requests.RequestException as e:
+                status = "error"
+                with results_lock:
+                    errors.append(str(e))
+            elapsed = (time.perf_counter() - started) * 1000
+            with results_lock:
+                statuses[str(status)] = statuses.get(str(status), 0) + 1
+                if status == 200:
+                    latencies.append(elapsed)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    duration = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        "requests": total,
+        "ok": len(latencies),
+        "statuses": statuses,
+        "duration_s": round(duration, 3),
+        "rps": round(len(latencies) / duration, 2) if duration else 0.0,
+    }
+    if latencies:
+        result.update({
+            "mean_ms": round(sum(latencies) / len(latencies), 2),
+            "p50_ms": round(percentile(latencies, 0.50), 2),
+            "p95_ms": round(percentile(latencies, 0.95), 2),
+            "p99_ms": round(percentile(latencies, 0.99), 2),
+            "max_ms": round(latencies[-1], 2),
+        })
+    if errors:
+        result["first_error"] = errors[0]
+    return result
+
+
+def wait_ready(base_url, timeout=15.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{base_url}/health", timeout=1).ok:
+                return
+        except requests.RequestException:
+            pass
+        time.sleep(0.1)
+    raise Exception(f"server at {base_url} did not become ready in {timeout:g}s")
+
+
+def start_server(mock_url, port, extra_env):
+    env = {k: v for k, v in os.environ.items() if k not in PROVIDER_ENV}
+    env.update({
+        "GROQ_API_KEY": "benchmark",
+        "GROQ_BASE_URL": mock_url,
+        "PORT": str(port),
+        "REPLY_CACHE_FILE": "",
+        "PREFETCH_REQUESTS_PER_MIN": "0",
+        # Benchmark tweets differ only in numbers; every one must reach the upstream
+        "NEAR_DUP_SIMILARITY": "0",
+        "PYTHONUNBUFFERED": "1",
+    })
+    env.update(extra_env)
+    # stderr goes to a temp file, not a pipe: nobody reads a pipe during the run, and
+    # a server logging tracebacks would block once it filled up
+    log = tempfile.TemporaryFile()
+    server = subprocess.Popen(
+        [sys.executable, str(SERVER)],
+        cwd=str(SERVER.parent),
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=log,
+    )
+    server.log = log
+    return server
+
+
+def server_errors(server):
+    """What a server from start_server wrote to stderr so far"""
+    server.log.seek(0)
+    return server.log.read().decode("utf-8", "replace")
+
+
+def compare(results, baseline, tolerance):
+    """Print deltas against the baseline; returns the list of regressions"""
+    regressions = []
+    for name, current in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before or "p95_ms" not in before or "p95_ms" not in current:
+            continue
+        p95_change = current["p95_ms"] / before["p95_ms"] - 1 if before["p95_ms"] else 0.0
+        rps_change = current["rps"] / before["rps"] - 1 if before["rps"] else 0.0
+        print(f"  {name:16} p95 {before['p95_ms']:>9.1f} -> {current['p95_ms']:>9.1f} ms ({p95_change:+.0%})"
+              f"   rps {before['rps']:>8.1f} -> {current['rps']:>8.1f} ({rps_change:+.0%})")
+        if p95_change > tolerance:
+            regressions.append(f"{name}: p95 {p95_change:+.0%}")
+        if rps_change < -tolerance:
+            regressions.append(f"{name}: rps {rps_change:+.0%}")
+    return regressions
+
+
+def parse_env(pairs):
+    env = {}
+    for pair in pairs:
+        key, sep, value = pair.partition("=")
+        if not sep:
+            raise SystemExit(f"--env expects KEY=VALUE, got {pair!r}")
+        env[key] = value
+    return env
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark python-server.py against a mock LLM")
+    parser.add_argument("--scenarios", default="generate,generate-cached,config,health",
+                        help="comma separated: generate, generate-cached, generate-stream, config, health")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=200, help="requests per scenario")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--url", help="benchmark an already running server instead of starting one")
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="mock median upstream latency")
+    parser.add_argument("--dist", choices=("fixed", "uniform", "lognormal"), default="lognormal")
+    parser.add_argument("--sigma", type=float, default=0.5)
+    parser.add_argument("--p429", type=float, default=0.0, help="mock 429 probability")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra server environment, e.g. --env MAX_INFLIGHT=8")
+    parser.add_argument("--baseline", default="benchmark-baseline.json")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed p95/RPS regression (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    # Measure the server, not the default upstream budget
+    server_env = {"RATE_LIMIT_RPM": "100000", "RATE_LIMIT_TPM": "100000000"}
+    server_env.update(parse_env(args.env))
+
+    mock = server = None
+    base_url = args.url.rstrip("/") if args.url else None
+    try:
+        if base_url is None:
+            mock = MockLLMServer(
+                latency=LatencyModel(args.latency_ms, args.dist, args.sigma),
+                p429=args.p429,
+                retry_after=args.retry_after,
+            )
+            mock.start()
+            port = free_port()
+            server = start_server(mock.url, port, server_env)
+            base_url = f"http://127.0.0.1:{port}"
+            try:
+                wait_ready(base_url)
+            except Exception:
+                server.kill()
+                sys.stderr.write(server_errors(server))
+                raise
+
+        results = {
+            "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "params": {
+                "concurrency": args.concurrency,
+                "requests": args.requests,
+                "mock": None if args.url else {
+                    "latency_ms": args.latency_ms, "dist": args.dist, "sigma": args.sigma, "p429": args.p429,
+                },
+                "server_env": server_env if not args.url else {},
+            },
+            "scenarios": {},
+        }
+        for name in (s.strip() for s in args.scenarios.split(",") if s.strip()):
+            result = run_scenario(name, base_url, args.concurrency, args.requests, args.timeout)
+            results["scenarios"][name] = result
+            print(f"{name:16} {result['ok']:>5}/{result['requests']} ok  "
+                  f"p50 {result.get('p50_ms', 0):>8.1f}  p95 {result.get('p95_ms', 0):>8.1f}  "
+                  f"p99 {result.get('p99_ms', 0):>8.1f} ms  {result['rps']:>8.1f} rps  {result['statuses']}")
+        if mock:
+            results["mock_stats"] = mock.stats()
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=5)
+            server.log.close()
+        if mock:
+            mock.stop()
+
+    baseline_path = Path(args.baseline)
+    regressions = []
+    if baseline_path.exists() and not args.update_baseline:
+        baseline = json.loads(baseline_path.read_text())
+        print(f"\nvs. baseline {baseline_path} ({baseline.get('created')}):")
+        regressions = compare(results, baseline, args.tolerance)
+    else:
+        baseline_path.write_text(json.dumps(results, indent=2) + "\n")
+        print(f"\nBaseline saved to {baseline_path}")
+
+    if regressions:
+        print("\nRegressions beyond tolerance: " + "; ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
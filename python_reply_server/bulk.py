@@ -0,0 +1,240 @@
+"""Offline bulk generation over a JSONL file of tweets.
+
+    python3 python-server.py bulk tweets.jsonl --out replies.jsonl
+    python3 python-server.py bulk tweets.jsonl --out replies.jsonl --concurrency 4 --tone bearish
+
+Each input line is an object with the tweet in "tweetText" (or "text", "tweet",
+"body") and optionally "id", "tone" and "images"; lines without an id are
+identified by their line number. Replies go through the same pipeline as
+POST /generate (prompt building, reply cache, rate limiter, providers) and are
+appended to --out as they complete (fsynced every --checkpoint-every results).
+The output file is the checkpoint: rerunning the same command skips every id that
+already has a successful line there and retries the failed ones.
+"""
+
+import argparse
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+TEXT_FIELDS = ("tweetText", "text", "tweet", "body")
+ID_FIELDS = ("id", "tweetId", "request_id")
+
+
+def read_items(path):
+    """Yield (id, {"tweetText", "tone", "images"}) per usable input line"""
+    with open(path, encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                data = json.loads(line)
+            except ValueError:
+                print(f"⚠️  {path}:{line_no}: not JSON, skipped")
+                continue
+            if not isinstance(data, dict):
+                continue
+            text = next((str(data[k]).strip() for k in TEXT_FIELDS if data.get(k)), "")
+            if not text:
+                continue
+            item_id = next((str(data[k]) for k in ID_FIELDS if data.get(k) not in (None, "")), str(line_no))
+            yield item_id, {"tweetText": text, "tone": data.get("tone"), "images": data.get("images") or []}
+
+
+def completed_ids(path):
+    """Ids with a successful line in an earlier run's output, plus the tokens they cost"""
+    done = set()
+    tokens = {"prompt": 0, "completion": 0}
+    if not os.path.exists(path):
+        return done, tokens
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # torn last line of an interrupted run
+            if result.get("success"):
+                done.add(str(result.get("id")))
+                usage = result.get("usage") or {}
+                tokens["prompt"] += usage.get("prompt_tokens", 0)
+                tokens["completion"] += usage.get("completion_tokens", 0)
+    return done, tokens
+
+
+class BulkRun:
+    """Feeds items to generate() with at most `concurrency` in flight and writes results in completion order"""
+
+    def __init__(self, generate, load_config, retryable, out, concurrency, tone, no_cache=False,
+                 max_attempts=5, checkpoint_every=20):
+        self._generate = generate
+        self._load_config = load_config
+        self._retryable = retryable
+        self._out = out
+        self.concurrency = max(1, concurrency)
+        self.tone = tone
+        self.no_cache = no_cache
+        self.max_attempts = max_attempts
+        self.checkpoint_every = max(1, checkpoint_every)
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self.ok = 0
+        self.failed = 0
+        self.cached = 0
+        self.retried = 0
+        self.tokens = {"prompt": 0, "completion": 0}
+
+    def _run_one(self, item_id, item, config):
+        tweet_text, images = item["tweetText"], item["images"]
+        tone = (item.get("tone") or self.tone).strip()
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                result = self._generate(tweet_text, images, tone, config, self.no_cache)
+                return {
+                    "id": item_id,
+                    "success": True,
+                    "tweetText": tweet_text,
+                    "tone": tone,
+                    "reply": result["reply"],
+                    "provider": result.get("provider"),
+                    "cached": result.get("cached", False),
+                    "usage": result.get("usage") or {},
+                }
+            except self._retryable as e:
+                # Out of rate budget, providers down or the gate full: wait as told and retry
+                if attempt >= self.max_attempts or self._stop.is_set():
+                    return {"id": item_id, "success": False, "tweetText": tweet_text, "error": str(e)}
+                with self._lock:
+                    self.retried += 1
+                self._stop.wait(max(0.5, getattr(e, "retry_after", 2.0)))
+            except Exception as e:
+                return {"id": item_id, "success": False, "tweetText": tweet_text, "error": str(e)}
+
+    def _write(self, result):
+        self._out.write(json.dumps(result, ensure_ascii=False) + "\n")
+        with self._lock:
+            if result["success"]:
+                self.ok += 1
+                self.cached += bool(result["cached"])
+                self.tokens["prompt"] += result["usage"].get("prompt_tokens", 0)
+                self.tokens["completion"] += result["usage"].get("completion_tokens", 0)
+            else:
+                self.failed += 1
+            written = self.ok + self.failed
+        if written % self.checkpoint_every == 0:
+            self._out.flush()
+            os.fsync(self._out.fileno())
+
+    def run(self, items, on_progress=None):
+        """Process (id, item) pairs until exhausted; one config snapshot for the whole run.
+
+        Returns False when interrupted with Ctrl+C; tweets already in flight are still
+        finished and written so the tokens spent on them are not lost. A second Ctrl+C
+        stops waiting for them. The output is fsynced however the run ends.
+        """
+        config = self._load_config()
+        pending = set()
+        completed = True
+        pool = ThreadPoolExecutor(max_workers=self.concurrency)
+        try:
+            try:
+                for item_id, item in items:
+                    if len(pending) >= self.concurrency:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            self._write(future.result())
+                        if on_progress:
+                            on_progress(self)
+                    pending.add(pool.submit(self._run_one, item_id, item, config))
+                self._drain(pending)
+            except KeyboardInterrupt:
+                print("\n🛑 Interrupted, finishing in-flight tweets; rerun the same command to resume")
+                self._stop.set()
+                completed = False
+                try:
+                    self._drain(pending)
+                except KeyboardInterrupt:
+                    print(f"\n🛑 Interrupted again, not waiting for {len(pending)} in-flight tweets")
+        finally:
+            pool.shutdown(wait=False, cancel_futures=True)
+            self._out.flush()
+            os.fsync(self._out.fileno())
+        return completed
+
+    def _drain(self, pending):
+        """Write the results of pending futures as they finish, removing them from the set"""
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                pending.discard(future)
+                self._write(future.result())
+
+
+def format_report(run, elapsed, skipped, previous_tokens, price_in, price_out):
+    total = run.ok + run.failed
+    lines = [
+        f"✅ {run.ok} replies ({run.cached} from cache), ❌ {run.failed} failed, ⏭️  {skipped} already done",
+        f"⏱️  {elapsed:.1f}s, {total / elapsed if elapsed else 0:.2f} items/s, {run.retried} retries after 429/503",
+        f"🔢 Tokens this run: {run.tokens['prompt']} prompt + {run.tokens['completion']} completion"
+        f" ({(run.tokens['prompt'] + run.tokens['completion']) / run.ok if run.ok else 0:.0f}/reply)",
+    ]
+    if skipped:
+        lines.append(f"🔢 Tokens incl. earlier runs: {run.tokens['prompt'] + previous_tokens['prompt']} prompt"
+                     f" + {run.tokens['completion'] + previous_tokens['completion']} completion")
+    if price_in or price_out:
+        cost = (run.tokens["prompt"] * price_in + run.tokens["completion"] * price_out) / 1_000_000
+        lines.append(f"💵 Cost this run: ${cost:.4f}")
+    return "\n".join(lines)
+
+
+def main(argv, generate, load_config, retryable, default_concurrency):
+    parser = argparse.ArgumentParser(prog="python-server.py bulk", description="Generate replies for a JSONL file of tweets")
+    parser.add_argument("input", help="JSONL file, one tweet object per line")
+    parser.add_argument("--out", help="output JSONL (default: <input>.replies.jsonl); also the resume checkpoint")
+    parser.add_argument("--concurrency", type=int, default=default_concurrency, help="generations in flight (default: MAX_INFLIGHT)")
+    parser.add_argument("--tone", default="bullish", help="tone for lines without one")
+    parser.add_argument("--no-cache", action="store_true", help="ignore cached replies")
+    parser.add_argument("--attempts", type=int, default=5, help="tries per tweet when rate limited or providers are down")
+    parser.add_argument("--checkpoint-every", type=int, default=20, help="fsync the output every N results")
+    parser.add_argument("--price-in", type=float, default=0.0, help="USD per 1M prompt tokens, for the cost line")
+    parser.add_argument("--price-out", type=float, default=0.0, help="USD per 1M completion tokens")
+    args = parser.parse_args(argv)
+
+    out_path = args.out or f"{os.path.splitext(args.input)[0]}.replies.jsonl"
+    done, previous_tokens = completed_ids(out_path)
+    skipped = 0
+
+    def remaining():
+        nonlocal skipped
+        for item_id, item in read_items(args.input):
+            if item_id in done:
+                skipped += 1
+                continue
+            yield item_id, item
+
+    if done:
+        print(f"↩️  Resuming: {len(done)} replies already in {out_path}")
+    print(f"📝 {args.input} -> {out_path}, {args.concurrency} in flight")
+
+    started = time.perf_counter()
+    last_progress = [started]
+
+    def progress(run):
+        now = time.perf_counter()
+        if now - last_progress[0] >= 5:
+            last_progress[0] = now
+            print(f"   {run.ok + run.failed} done ({run.failed} failed), {(run.ok + run.failed) / (now - started):.2f} items/s")
+
+    with open(out_path, "a", encoding="utf-8") as out:
+        run = BulkRun(generate, load_config, retryable, out, args.concurrency, args.tone, args.no_cache,
+                      args.attempts, args.checkpoint_every)
+        completed = False
+        try:
+            completed = run.run(remaining(), progress)
+        finally:
+            print(format_report(run, time.perf_counter() - started, skipped, previous_tokens, args.price_in, args.price_out))
+    return 0 if completed and not run.failed else 1
@@ -0,0 +1,81 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+
+
+class VersionedConfig(dict):
+    """Parsed config plus the version of the file it was read from; treat as read-only"""
+
+    def __init__(self, data, version):
+        super().__init__(data)
+        self.version = version
+
+
+def config_version(raw):
+    """Content-derived version, stable across restarts and worker processes"""
+    return hashlib.sha1(raw).hexdigest()[:12]
+
+
+class ConfigStore:
+    """Keeps config.json parsed in memory and re-reads it only when mtime or size change"""
+
+    def __init__(self, path, default):
+        self.path = path
+        self.default = default
+        self._lock = threading.Lock()
+        self._config = None
+        self._stamp = None
+        self.reloads = 0
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def load(self):
+        stamp = self._stat()
+        config = self._config
+        if config is not None and stamp == self._stamp:
+            return config
+
+        with self._lock:
+            stamp = self._stat()
+            if self._config is not None and stamp == self._stamp:
+                return self._config
+            if stamp is None:
+                raw = json.dumps(self.default, sort_keys=True).encode("utf-8")
+                data = self.default
+            else:
+                with open(self.path, "rb") as f:
+                    raw = f.read()
+                data = json.loads(raw.decode("utf-8"))
+            self._config = VersionedConfig(data, config_version(raw))
+            self._stamp = stamp
+            self.reloads += 1
+            return self._config
+
+    def save(self, config):
+        """Write to a temp file in the same directory and rename it over config.json"""
+        raw = json.dumps(config, indent=2, ensure_ascii=False).encode("utf-8")
+        directory = os.path.dirname(os.path.abspath(self.path))
+        with self._lock:
+            fd, tmp_path = tempfile.mkstemp(prefix=".config-", suffix=".tmp", dir=directory)
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(raw)
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.path)
+            except BaseException:
+                try:
+                    os.unlink(tmp_path)
+                except OSError:
+                    pass
+                raise
+            self._config = VersionedConfig(config, config_version(raw))
+            self._stamp = self._stat()
+            return self._config
@@ -0,0 +1,222 @@
+import selectors
+import socket
+import threading
+import time
+from contextlib import contextmanager
+
+
+class DeadlineExceeded(Exception):
+    """The request's time budget ran out; stage says where"""
+
+    def __init__(self, stage):
+        super().__init__(f"Deadline exceeded while waiting for {stage}")
+        self.stage = stage
+
+
+class Cancelled(Exception):
+    """Nobody is waiting for the result any more (the client disconnected)"""
+
+    def __init__(self, stage, reason="client disconnected"):
+        super().__init__(f"Cancelled during {stage}: {reason}")
+        self.stage = stage
+        self.reason = reason
+
+
+class Deadline:
+    """Time budget and cancellation for one request, passed down to the upstream call.
+
+    timeout_ms None means no time limit; cancel() fires the on_cancel callbacks once
+    (the upstream client uses one to abort a call already waiting on the network).
+    """
+
+    def __init__(self, timeout_ms=None):
+        self.expires_at = time.monotonic() + timeout_ms / 1000 if timeout_ms else None
+        self.reason = None
+        self._cancelled = threading.Event()
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def remaining(self):
+        """Seconds left, or None without a time limit"""
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.monotonic()
+
+    def expired(self):
+        remaining = self.remaining()
+        return remaining is not None and remaining <= 0
+
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self, reason="client disconnected"):
+        with self._lock:
+            if self._cancelled.is_set():
+                return
+            self.reason = reason
+            self._cancelled.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    def add_callback(self, callback):
+        """Call back on cancel (right away if already cancelled)"""
+        with self._lock:
+            fire = self._cancelled.is_set()
+            if not fire:
+                self._callbacks.append(callback)
+        if fire:
+            callback()
+
+    @contextmanager
+    def on_cancel(self, callback):
+        """Run callback if cancelled while the block is running"""
+        self.add_callback(callback)
+        try:
+            yield
+        finally:
+            with self._lock:
+                if callback in self._callbacks:
+                    self._callbacks.remove(callback)
+
+    def check(self, stage):
+        if self.cancelled():
+            raise Cancelled(stage, self.reason)
+        if self.expired():
+            raise DeadlineExceeded(stage)
+
+    def timeout(self, default):
+        """default capped by the time left (never below 10 ms, so the call fails as a timeout)"""
+        remaining = self.remaining()
+        return default if remaining is None else max(0.01, min(default, remaining))
+
+    def wait(self, seconds):
+        """Sleep up to seconds, waking early on cancel"""
+        self._cancelled.wait(seconds)
+
+
+class ChildDeadline(Deadline):
+    """Part of a request (one hedged attempt) that can be cancelled on its own.
+
+    It has the parent's time limit and is cancelled along with the parent.
+    """
+
+    def __init__(self, parent):
+        super().__init__()
+        self.parent = parent
+        parent.add_callback(lambda: self.cancel(parent.reason))
+
+    def remaining(self):
+        return self.parent.remaining()
+
+
+class FlightDeadline(Deadline):
+    """The deadline of a single-flight upstream call shared by several requests.
+
+    It lasts as long as the longest-lived member and is cancelled only once every
+    member is cancelled or expired, so one impatient client does not abort a reply
+    others are still waiting for.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._members = []
+
+    def add(self, member):
+        with self._lock:
+            self._members.append(member)
+        member.add_callback(self._member_gone)
+
+    def _alive(self):
+        with self._lock:
+            members = list(self._members)
+        return [m for m in members if not m.cancelled() and not m.expired()]
+
+    def _member_gone(self):
+        if not self._alive():
+            self.cancel("every waiting client disconnected")
+
+    def remaining(self):
+        with self._lock:
+            members = list(self._members)
+        remainders = [m.remaining() for m in members if not m.cancelled()]
+        if not remainders or None in remainders:
+            return None if remainders else 0.0
+        return max(remainders)
+
+    def leave(self):
+        """A member stopped waiting because its own time ran out"""
+        self._member_gone()
+
+
+class DisconnectWatcher:
+    """Notices clients that hang up while their request is still being worked on.
+
+    One thread polls the sockets of in-flight requests; a socket that turns readable
+    with nothing to read (EOF) or an error means the client is gone, and its Deadline
+    is cancelled. A client that sends more data (a pipelined request) is simply no
+    longer watched.
+    """
+
+    def __init__(self, interval=0.1):
+        self.interval = interval
+        self._selector = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.watched = 0
+        self.disconnects = 0
+
+    @contextmanager
+    def watch(self, sock, deadline):
+        with self._lock:
+            try:
+                self._selector.register(sock, selectors.EVENT_READ, deadline)
+            except (KeyError, ValueError, OSError):
+                sock = None
+            else:
+                self.watched += 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="disconnect-watcher", daemon=True)
+                self._thread.start()
+        try:
+            yield
+        finally:
+            if sock is not None:
+                self._forget(sock)
+
+    def _forget(self, sock):
+        with self._lock:
+            try:
+                self._selector.unregister(sock)
+            except (KeyError, ValueError, OSError):
+                pass
+
+    def _run(self):
+        while True:
+            with self._lock:
+                empty = not self._selector.get_map()
+            if empty:
+                time.sleep(self.interval)
+                continue
+            try:
+                events = self._selector.select(self.interval)
+            except OSError:
+                time.sleep(self.interval)
+                continue
+            for key, _ in events:
+                sock, deadline = key.fileobj, key.data
+                try:
+                    data = sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT)
+                except (BlockingIOError, InterruptedError):
+                    continue
+                except OSError:
+                    data = b""
+                self._forget(sock)
+                if not data:
+                    with self._lock:
+                        self.disconnects += 1
+                    deadline.cancel("client disconnected")
+
+    def stats(self):
+        with self._lock:
+            return {"watching": len(self._selector.get_map()), "watched": self.watched, "disconnects": self.disconnects}
@@ -0,0 +1,187 @@
+import heapq
+import math
+import re
+import threading
+import time
+import zlib
+from collections import Counter
+
+from config_store import ConfigStore
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+_WORD = re.compile(r"[\w$#@']+")
+
+
+def features(text, dims):
+    """Hashed word unigrams plus character trigrams of each word, with counts"""
+    counts = Counter()
+    for word in _WORD.findall(text.lower()):
+        counts[zlib.crc32(b"w:" + word.encode("utf-8")) % dims] += 1
+        padded = f"<{word}>"
+        for i in range(len(padded) - 2):
+            counts[zlib.crc32(padded[i:i + 3].encode("utf-8")) % dims] += 1
+    return counts
+
+
+class ExampleIndex:
+    """TF-IDF over hashed n-grams of the example tweets, stored as posting lists.
+
+    Scoring a query touches only the postings of its own features, so lookups stay in the
+    low milliseconds for thousands of examples. Features present in more than max_df of the
+    examples are dropped at build time: they add little signal and have the longest postings.
+    Queries visit their rarest features first and stop after max_postings entries, which
+    bounds lookup time however large or repetitive the library gets.
+    """
+
+    def __init__(self, examples, dims=1 << 20, max_df=0.5, max_postings=5000):
+        self.examples = examples
+        self.dims = dims
+        self.max_postings = max_postings
+        started = time.perf_counter()
+
+        docs = [features(ex.get("tweet", ""), dims) for ex in examples]
+        df = Counter()
+        for doc in docs:
+            df.update(doc.keys())
+        n = len(docs)
+        limit = max_df * n if n >= 20 else n
+        self.idf = {f: math.log((1 + n) / (1 + c)) + 1 for f, c in df.items() if c <= limit}
+
+        postings = {}
+        for row, doc in enumerate(docs):
+            weights = {f: (1 + math.log(c)) * self.idf[f] for f, c in doc.items() if f in self.idf}
+            norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+            for f, w in weights.items():
+                postings.setdefault(f, []).append((row, w / norm))
+
+        if np is not None:
+            # One flat array of rows/weights; each feature maps to its slice
+            self._spans = {}
+            rows, values = [], []
+            for f, entries in postings.items():
+                self._spans[f] = (len(rows), len(rows) + len(entries))
+                for row, w in entries:
+                    rows.append(row)
+                    values.append(w)
+            self._rows = np.asarray(rows, dtype=np.int32)
+            self._values = np.asarray(values, dtype=np.float32)
+        else:
+            self._postings = postings
+        self.build_ms = (time.perf_counter() - started) * 1000
+
+    def _query(self, text):
+        """[(feature, weight)] rarest first, cut off at the postings budget"""
+        weights = {f: (1 + math.log(c)) * self.idf[f] for f, c in features(text, self.dims).items() if f in self.idf}
+        norm = math.sqrt(sum(w * w for w in weights.values())) or 1.0
+        query = []
+        budget = self.max_postings
+        for f in sorted(weights, key=self.idf.__getitem__, reverse=True):
+            budget -= self._postings_len(f)
+            if budget < 0 and query:
+                break
+            query.append((f, weights[f] / norm))
+        return query
+
+    def _postings_len(self, f):
+        if np is not None:
+            start, end = self._spans[f]
+            return end - start
+        return len(self._postings[f])
+
+    def top(self, text, k):
+        """Up to k (score, example) pairs, most similar first; examples sharing nothing are skipped"""
+        query = self._query(text)
+        if not query or k <= 0:
+            return []
+
+        if np is not None:
+            spans = [(self._spans[f], w) for f, w in query]
+            rows = np.concatenate([self._rows[a:b] for (a, b), _ in spans])
+            values = np.concatenate([self._values[a:b] * w for (a, b), w in spans])
+            scores = np.bincount(rows, weights=values, minlength=len(self.examples))
+            k = min(k, len(scores))
+            best = np.argpartition(-scores, k - 1)[:k]
+            ranked = sorted(((float(scores[i]), int(i)) for i in best), reverse=True)
+        else:
+            scores = {}
+            get = scores.get
+            for f, w in query:
+                for row, value in self._postings[f]:
+                    scores[row] = get(row, 0.0) + value * w
+            ranked = heapq.nlargest(k, ((s, row) for row, s in scores.items()))
+        return [(score, self.examples[row]) for score, row in ranked if score > 0]
+
+
+class ExampleStore:
+    """Tweet/reply example library kept in its own JSON file, indexed when it is saved or loaded"""
+
+    def __init__(self, path):
+        self._file = ConfigStore(path, {"examples": []})
+        self._lock = threading.Lock()
+        self._index = None
+        self._version = None
+        self.lookups = 0
+        self.lookup_ms = 0.0
+
+    def _current(self):
+        data = self._file.load()
+        if data.version != self._version:
+            with self._lock:
+                if data.version != self._version:
+                    self._index = ExampleIndex(clean_examples(data.get("examples")))
+                    self._version = data.version
+        return self._index, self._version
+
+    @property
+    def version(self):
+        return self._current()[1]
+
+    def __len__(self):
+        return len(self._current()[0].examples)
+
+    def examples(self):
+        return self._current()[0].examples
+
+    def save(self, examples):
+        """Replace the library; the index is rebuilt here, not on the next request"""
+        self._file.save({"examples": clean_examples(examples)})
+        return self._current()[1]
+
+    def select(self, text, k):
+        """Top-k examples most similar to text"""
+        index, _ = self._current()
+        started = time.perf_counter()
+        found = [example for _, example in index.top(text, k)]
+        with self._lock:
+            self.lookups += 1
+            self.lookup_ms += (time.perf_counter() - started) * 1000
+        return found
+
+    def stats(self):
+        index, version = self._current()
+        with self._lock:
+            return {
+                "examples": len(index.examples),
+                "version": version,
+                "backend": "numpy" if np is not None else "python",
+                "build_ms": round(index.build_ms, 1),
+                "lookups": self.lookups,
+                "avg_lookup_ms": round(self.lookup_ms / self.lookups, 3) if self.lookups else None,
+            }
+
+
+def clean_examples(examples):
+    """Keep {"tweet", "reply"} pairs with both fields non-empty"""
+    cleaned = []
+    for ex in examples or []:
+        if not isinstance(ex, dict):
+            continue
+        tweet = str(ex.get("tweet") or "").strip()
+        reply = str(ex.get("reply") or "").strip()
+        if tweet and reply:
+            cleaned.append({"tweet": tweet, "reply": reply})
+    return cleaned
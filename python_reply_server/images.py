@@ -0,0 +1,334 @@
+import base64
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
+from urllib.parse import parse_qsl, urlencode, urljoin, urlsplit, urlunsplit
+
+from deadline import Deadline
+from singleflight import SingleFlight
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+# data is the base64 payload the providers send, encoded once per image
+TweetImage = namedtuple("TweetImage", ["digest", "media_type", "data"])
+
+MAGIC = (
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+)
+EXTENSIONS = {"image/jpeg": ".jpg", "image/png": ".png", "image/gif": ".gif", "image/webp": ".webp"}
+# Sizes pbs.twimg.com serves through the name= parameter (longest side)
+TWIMG_SIZES = ((680, "small"), (1200, "medium"), (2048, "large"))
+MAX_REDIRECTS = 3
+# Providers refuse larger base64 images (Groq 4 MB, Anthropic 5 MB)
+MAX_IMAGE_BYTES = 3 * 1024 * 1024
+
+
+def sniff(data):
+    """Media type from the file signature, or None if it is not an image we can send"""
+    for magic, media_type in MAGIC:
+        if data.startswith(magic):
+            return media_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return None
+
+
+def twimg_url(url, max_px):
+    """pbs.twimg.com URL asking for the smallest size that is still at least max_px"""
+    parts = urlsplit(url)
+    if parts.hostname != "pbs.twimg.com" or not parts.query:
+        return url
+    name = next((name for size, name in TWIMG_SIZES if size >= max_px), "large")
+    query = [(k, v) for k, v in parse_qsl(parts.query) if k != "name"] + [("name", name)]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+class ImageStore:
+    """Content-addressed image cache on disk, least recently used files evicted past max_bytes.
+
+        <directory>/<ab>/<digest><ext>   processed image; digest hashes the downloaded bytes
+                                         and the processing settings
+        <directory>/urls/<sha256(url)>   the digest an image URL resolved to
+
+    Every hit refreshes the file's mtime, which is the LRU order; that also makes the
+    cache survive restarts and work for several worker processes sharing the directory.
+    The last few images are kept in memory, base64 encoded.
+    """
+
+    def __init__(self, directory, max_bytes, memory_items=64):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.evicted = 0
+        os.makedirs(os.path.join(directory, "urls"), exist_ok=True)
+        self.bytes = sum(size for _, size, _ in self._files())
+
+    def _files(self):
+        """(mtime, size, path) of every cached file"""
+        for root, _, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield st.st_mtime, st.st_size, path
+
+    def _image_path(self, digest, media_type):
+        return os.path.join(self.directory, digest[:2], digest + EXTENSIONS[media_type])
+
+    def _url_path(self, url):
+        return os.path.join(self.directory, "urls", hashlib.sha256(url.encode("utf-8")).hexdigest())
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path)
+            return True
+        except OSError:
+            return False
+
+    def _write(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        try:
+            replaced = os.path.getsize(path)
+        except OSError:
+            replaced = 0
+        os.replace(tmp, path)
+        with self._lock:
+            self.bytes += len(data) - replaced
+        if self.bytes > self.max_bytes:
+            self._evict()
+
+    def lookup_url(self, url):
+        """(digest, media_type) a URL was stored under, or None"""
+        path = self._url_path(url)
+        try:
+            with open(path, encoding="utf-8") as f:
+                digest, media_type = f.read().split()
+        except (OSError, ValueError):
+            return None
+        self._touch(path)
+        return digest, media_type
+
+    def remember_url(self, url, digest, media_type):
+        self._write(self._url_path(url), f"{digest} {media_type}".encode("utf-8"))
+
+    def load(self, digest, media_type):
+        """The stored image as a TweetImage, or None"""
+        with self._lock:
+            image = self._memory.get(digest)
+            if image is not None:
+                self._memory.move_to_end(digest)
+        path = self._image_path(digest, media_type)
+        if image is not None:
+            self._touch(path)
+            return image
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        self._touch(path)
+        return self._remember(TweetImage(digest, media_type, base64.b64encode(data).decode("ascii")))
+
+    def save(self, digest, media_type, data):
+        self._write(self._image_path(digest, media_type), data)
+        return self._remember(TweetImage(digest, media_type, base64.b64encode(data).decode("ascii")))
+
+    def _remember(self, image):
+        with self._lock:
+            self._memory[image.digest] = image
+            self._memory.move_to_end(image.digest)
+            while len(self._memory) > self.memory_items:
+                self._memory.popitem(last=False)
+        return image
+
+    def _evict(self):
+        """Delete least recently used files until the cache is back under 90% of max_bytes"""
+        files = sorted(self._files())
+        total = sum(size for _, size, _ in files)
+        target = self.max_bytes * 0.9
+        removed = 0
+        for _, size, path in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            removed += 1
+        with self._lock:
+            self.bytes = total
+            self.evicted += removed
+            self._memory.clear()
+
+    def stats(self):
+        with self._lock:
+            return {"bytes": self.bytes, "max_bytes": self.max_bytes, "in_memory": len(self._memory), "evicted": self.evicted}
+
+
+class ImageFetcher:
+    """Downloads tweet images through a bounded pool in front of an ImageStore.
+
+    Images already seen, by URL or by content under another URL (reposted memes and
+    charts), are neither downloaded nor re-encoded again. With Pillow installed they
+    are downscaled to max_px and re-encoded as JPEG once; without it pbs.twimg.com
+    URLs ask the CDN for the size closest to max_px and the bytes are sent as is.
+
+    Concurrent requests for the same URL share one download, and different URLs
+    with the same bytes share one encode (both through SingleFlight). Only hosts in
+    allowed_hosts are fetched ("*" allows any), so clients cannot point the server
+    at arbitrary addresses.
+    """
+
+    def __init__(self, store, client, max_px=768, quality=80, concurrency=4, timeout=3.0,
+                 allowed_hosts=("pbs.twimg.com",), max_download_bytes=10 * 1024 * 1024):
+        self.store = store
+        self.client = client
+        self.timeout = timeout
+        self.max_px = max_px
+        self.quality = quality
+        self.allowed_hosts = set(allowed_hosts)
+        self.max_download_bytes = max_download_bytes
+        self._pool = ThreadPoolExecutor(max_workers=max(1, concurrency), thread_name_prefix="images")
+        self._downloads = SingleFlight()
+        self._encodes = SingleFlight()
+        # Digest input: processing settings, so changing them re-processes images
+        self._settings = f"{max_px}:{quality}:{Image is not None}".encode("ascii")
+        self.url_hits = 0
+        self.content_hits = 0
+        self.downloads = 0
+        self.downloaded_bytes = 0
+        self.encoded = 0
+        self.failed = 0
+        self.rejected = 0
+        self.late = 0
+
+    def allowed(self, url):
+        if not isinstance(url, str) or not url.startswith(("http://", "https://")):
+            return False
+        return "*" in self.allowed_hosts or urlsplit(url).hostname in self.allowed_hosts
+
+    def fetch(self, urls, deadline=None):
+        """TweetImages for urls, in order. Images that fail, are not allowed or are not ready
+        within timeout (or the deadline) are left out; an unfinished download still fills the cache"""
+        deadline = deadline or Deadline()
+        deadline.check("images")
+        wanted = []
+        for url in urls:
+            if not self.allowed(url):
+                self.rejected += 1
+            elif url not in wanted:
+                wanted.append(url)
+        if not wanted:
+            return []
+        futures = [self._pool.submit(self._one, url) for url in wanted]
+        done, _ = wait(futures, timeout=deadline.timeout(self.timeout))
+        deadline.check("images")
+        images = []
+        for future in futures:
+            if future not in done:
+                self.late += 1
+                continue
+            if future.exception() is not None:
+                self.failed += 1
+                print(f"⚠️  Image skipped: {future.exception()}")
+                continue
+            image = future.result()
+            if image.digest not in {i.digest for i in images}:
+                images.append(image)
+        return images
+
+    def _one(self, url):
+        # Keyed by the URL as fetched, so every size variant of a twimg image is one entry
+        url = twimg_url(url, self.max_px)
+        found = self.store.lookup_url(url)
+        if found is not None:
+            image = self.store.load(*found)
+            if image is not None:
+                self.url_hits += 1
+                return image
+        image, _ = self._downloads.do(url, lambda flight: self._download(url))
+        return image
+
+    def _get(self, url):
+        """Streamed GET following redirects only to allowed hosts"""
+        target = url
+        for _ in range(MAX_REDIRECTS + 1):
+            r = self.client.get(target, stream=True, allow_redirects=False)
+            if not r.is_redirect:
+                return r
+            r.close()
+            target = urljoin(target, r.headers["Location"])
+            if not self.allowed(target):
+                raise Exception(f"{url}: redirected to {urlsplit(target).hostname}, which is not an allowed image host")
+        raise Exception(f"{url}: more than {MAX_REDIRECTS} redirects")
+
+    def _download(self, url):
+        with self._get(url) as r:
+            if r.status_code != 200:
+                raise Exception(f"{url}: HTTP {r.status_code}")
+            data = bytearray()
+            for chunk in r.iter_content(64 * 1024):
+                data += chunk
+                if len(data) > self.max_download_bytes:
+                    raise Exception(f"{url}: larger than {self.max_download_bytes} bytes")
+        data = bytes(data)
+        self.downloads += 1
+        self.downloaded_bytes += len(data)
+        media_type = sniff(data)
+        if media_type is None:
+            raise Exception(f"{url}: not a JPEG, PNG, GIF or WebP image")
+
+        digest = hashlib.sha256(self._settings + b"\0" + data).hexdigest()
+        stored_type = "image/jpeg" if Image is not None else media_type
+        image = self.store.load(digest, stored_type)
+        if image is None:
+            image, _ = self._encodes.do(digest, lambda flight: self._encode(digest, media_type, data))
+        else:
+            self.content_hits += 1
+        self.store.remember_url(url, image.digest, image.media_type)
+        return image
+
+    def _encode(self, digest, media_type, data):
+        if Image is not None:
+            with Image.open(io.BytesIO(data)) as img:
+                img.thumbnail((self.max_px, self.max_px))  # first frame of a GIF
+                out = io.BytesIO()
+                img.convert("RGB").save(out, "JPEG", quality=self.quality, optimize=True)
+            data, media_type = out.getvalue(), "image/jpeg"
+        if len(data) > MAX_IMAGE_BYTES:
+            raise Exception(f"image is {len(data)} bytes, over the {MAX_IMAGE_BYTES} providers accept")
+        self.encoded += 1
+        return self.store.save(digest, media_type, data)
+
+    def stats(self):
+        return {
+            "downscale": Image is not None,
+            "max_px": self.max_px,
+            "url_hits": self.url_hits,
+            "content_hits": self.content_hits,
+            "downloads": self.downloads,
+            "downloaded_bytes": self.downloaded_bytes,
+            "encoded": self.encoded,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "late": self.late,
+            "store": self.store.stats(),
+        }
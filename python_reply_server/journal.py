@@ -0,0 +1,166 @@
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from collections import deque
+from pathlib import Path
+
+from prompts import prompt_images, prompt_parts
+
+
+def prompt_hash(prompt):
+    """Short stable hash of the system + user messages (and attached images), for grouping journal entries by prompt"""
+    system, user = prompt_parts(prompt)
+    digest = hashlib.sha256()
+    digest.update((system or "").encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(user.encode("utf-8"))
+    for image in prompt_images(prompt):
+        digest.update(b"\0" + image.digest.encode("ascii"))
+    return digest.hexdigest()[:16]
+
+
+class Journal:
+    """Append-only JSONL log of /generate calls, written by a background thread.
+
+    record() only appends to an in-memory buffer, so the request path never waits on
+    the disk. The writer flushes every flush_interval seconds (or once max_batch entries
+    are waiting) and rotates the file when it passes max_bytes or gets older than
+    max_age seconds; rotated files are named <stem>-YYYYmmdd-HHMMSS<suffix> and
+    gzipped when compress is set. Past max_pending buffered entries new ones are dropped
+    and counted rather than blocking.
+    """
+
+    def __init__(self, path, max_bytes=50_000_000, max_age=86400.0, compress=True,
+                 flush_interval=1.0, max_batch=500, max_pending=10000):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.compress = compress
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._file = None
+        self._size = 0
+        self._opened_at = None
+        self.written = 0
+        self.dropped = 0
+        self.rotations = 0
+        self.errors = 0
+        self._thread = threading.Thread(target=self._run, name="journal", daemon=True)
+        self._thread.start()
+
+    def record(self, entry):
+        with self._cond:
+            if self._closed or len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending.append(entry)
+            if len(self._pending) >= self.max_batch:
+                self._cond.notify()
+
+    def close(self, timeout=5.0):
+        """Flush what is buffered and stop the writer"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._closed and len(self._pending) < self.max_batch:
+                    self._cond.wait(self.flush_interval)
+                batch = list(self._pending)
+                self._pending.clear()
+                closed = self._closed
+            try:
+                if batch:
+                    self._write(batch)
+                elif self._file is not None and self._due_for_rotation():
+                    self._rotate()
+            except OSError as e:
+                self.errors += 1
+                print(f"⚠️  Journal write failed: {e}")
+            if closed:
+                if self._file is not None:
+                    self._file.close()
+                    self._file = None
+                return
+
+    def _open(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, "ab")
+        self._size = self._file.tell()
+        self._opened_at = self._first_timestamp() if self._size else time.time()
+
+    def _first_timestamp(self):
+        """When an existing journal was started, from its first entry"""
+        try:
+            with open(self.path, "rb") as f:
+                return float(json.loads(f.readline())["ts"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return time.time()
+
+    def _due_for_rotation(self):
+        return self._size >= self.max_bytes or (self.max_age > 0 and time.time() - self._opened_at >= self.max_age)
+
+    def _write(self, batch):
+        if self._file is None:
+            self._open()
+        elif self._size and self._due_for_rotation():
+            self._rotate()
+            self._open()
+        data = b"".join(json.dumps(entry, ensure_ascii=False).encode("utf-8") + b"\n" for entry in batch)
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data)
+        self.written += len(batch)
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self._opened_at))
+        target = self.path.with_name(f"{self.path.stem}-{stamp}{self.path.suffix}")
+        n = 1
+        while target.exists() or target.with_name(target.name + ".gz").exists():
+            target = self.path.with_name(f"{self.path.stem}-{stamp}-{n}{self.path.suffix}")
+            n += 1
+        os.replace(self.path, target)
+        self.rotations += 1
+        if self.compress:
+            with open(target, "rb") as src, gzip.open(f"{target}.gz", "wb", compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(target)
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending)
+        return {
+            "path": str(self.path),
+            "pending": pending,
+            "written": self.written,
+            "dropped": self.dropped,
+            "rotations": self.rotations,
+            "errors": self.errors,
+        }
+
+
+def read_journal(path):
+    """Yield the entries of a journal file, plain or gzipped; a torn last line is skipped"""
+    opener = gzip.open if str(path).endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue
@@ -0,0 +1,294 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from contextlib import contextmanager
+
+
+class LatencyWindow:
+    """Rolling window of recent latencies in milliseconds"""
+
+    def __init__(self, size=500):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def record(self, ms):
+        with self._lock:
+            self._samples.append(ms)
+            self.count += 1
+
+    def percentile(self, p):
+        """p in [0, 1]; None until the first sample"""
+        with self._lock:
+            samples = sorted(self._samples)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+    def snapshot(self):
+        with self._lock:
+            samples = sorted(self._samples)
+            count = self.count
+        if not samples:
+            return {"count": count}
+
+        def pct(p):
+            return round(samples[min(len(samples) - 1, int(p * len(samples)))], 1)
+
+        return {
+            "count": count,
+            "avg_ms": round(sum(samples) / len(samples), 1),
+            "p50_ms": pct(0.50),
+            "p95_ms": pct(0.95),
+            "max_ms": round(samples[-1], 1),
+        }
+
+
+# Prometheus text exposition (https://prometheus.io/docs/instrumenting/exposition_formats/)
+
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count, optionally split by labels"""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def values(self):
+        """{label values: count}"""
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield self.name, _labels(self.labels, label_values), value
+
+
+class Gauge:
+    """Current value, either set/inc'd directly or read from a callback at scrape time"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, fn=None):
+        self.name = name
+        self.help = help
+        self.fn = fn
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    @contextmanager
+    def track(self):
+        self.inc()
+        try:
+            yield
+        finally:
+            self.dec()
+
+    def samples(self):
+        yield self.name, "", self.fn() if self.fn else self.value
+
+
+class Callback:
+    """Counters or gauges kept elsewhere (stats() fields); fn returns a number or {label_value: number}"""
+
+    def __init__(self, name, kind, help, fn, label=None):
+        self.name = name
+        self.kind = kind
+        self.help = help
+        self.fn = fn
+        self.label = label
+
+    def samples(self):
+        value = self.fn()
+        if isinstance(value, dict):
+            for label_value, v in sorted(value.items()):
+                yield self.name, _labels((self.label,), (label_value,)), v
+        else:
+            yield self.name, "", value
+
+
+class Histogram:
+    """Cumulative-bucket histogram of durations in seconds, optionally split by labels"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                # per-bucket counts (+Inf last), sum
+                series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][i] += 1
+            series[1] += value
+
+    @contextmanager
+    def time(self, *label_values):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *label_values)
+
+    def samples(self):
+        with self._lock:
+            series = sorted((k, (list(v[0]), v[1])) for k, v in self._series.items())
+        for label_values, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                yield self.name + "_bucket", _labels(self.labels, label_values, [("le", _number(bound))]), cumulative
+            yield self.name + "_sum", _labels(self.labels, label_values), total
+            yield self.name + "_count", _labels(self.labels, label_values), cumulative
+
+
+class Registry:
+    """Collects metrics and renders them for GET /metrics"""
+
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name, help, fn=None):
+        return self.register(Gauge(name, help, fn))
+
+    def histogram(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def callback(self, name, kind, help, fn, label=None):
+        return self.register(Callback(name, kind, help, fn, label))
+
+    def snapshot(self):
+        """{"name{labels}": value} for every current sample"""
+        return {name + labels: value for metric in self._metrics for name, labels, value in metric.samples()}
+
+    def render(self, others=()):
+        """others: snapshots from other worker processes, added sample by sample"""
+        extra = {}
+        for snapshot in others:
+            for series, value in snapshot.items():
+                extra[series] = extra.get(series, 0) + value
+        families = {}
+        for series in extra:
+            families.setdefault(series.split("{", 1)[0], []).append(series)
+
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            seen = set()
+            for name, labels, value in metric.samples():
+                seen.add(name + labels)
+                lines.append(f"{name}{labels} {_number(value + extra.get(name + labels, 0))}")
+            # Label sets only other workers have seen so far
+            for suffix in ("", "_bucket", "_sum", "_count"):
+                for series in sorted(families.get(metric.name + suffix, ())):
+                    if series not in seen:
+                        lines.append(f"{series} {_number(extra[series])}")
+        return "\n".join(lines) + "\n"
+
+
+class SharedMetrics:
+    """Merges the registries of several worker processes through a SQLite table.
+
+    Each worker publishes its snapshot every interval seconds (and on every scrape);
+    render() adds the other workers' latest snapshots to this worker's live values, so
+    whichever worker answers GET /metrics reports totals. Snapshots of workers gone
+    for more than stale_after seconds are left out.
+    """
+
+    def __init__(self, path, worker, registry, interval=5.0, stale_after=60.0):
+        self.worker = str(worker)
+        self.registry = registry
+        self.interval = interval
+        self.stale_after = stale_after
+        self._db = sqlite3.connect(str(path), timeout=10, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS worker_metrics ("
+            "worker TEXT PRIMARY KEY, pid INTEGER NOT NULL, samples TEXT NOT NULL, updated REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="metrics-share", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.publish()
+            except sqlite3.Error as e:
+                print(f"⚠️  Metrics publish failed: {e}")
+
+    def publish(self):
+        samples = json.dumps(self.registry.snapshot())
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO worker_metrics VALUES (?, ?, ?, ?)",
+                (self.worker, os.getpid(), samples, time.time()),
+            )
+
+    def stop(self):
+        """Stop publishing (a draining worker leaves its slot to its replacement)"""
+        self._stop.set()
+
+    def render(self):
+        self.publish()
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT samples FROM worker_metrics WHERE worker != ? AND updated > ?",
+                (self.worker, time.time() - self.stale_after),
+            ).fetchall()
+        return self.registry.render([json.loads(samples) for samples, in rows])
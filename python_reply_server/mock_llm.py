@@ -0,0 +1,243 @@
+"""Local stand-in for an OpenAI-compatible /chat/completions API, for benchmarks.
+
+    python3 mock_llm.py --port 9100 --latency-ms 400 --dist lognormal --p429 0.05
+
+then start the server with GROQ_BASE_URL=http://127.0.0.1:9100 and any GROQ_API_KEY.
+
+It also stands in for the tweet image CDN: GET /images/<name>.png?size=N returns an
+N x N PNG whose color depends on the name (or on &color=rrggbb, to serve the same
+image under several names), for testing VISION_MODE with IMAGE_HOSTS=127.0.0.1.
+Image parts received in chat messages are counted.
+"""
+
+import argparse
+import json
+import math
+import random
+import struct
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+REPLY_WORDS = "wagmi ser this chart is the most bullish thing I have seen all week".split()
+
+
+class LatencyModel:
+    """Upstream response time: fixed, uniform in [0, 2*median] or lognormal around the median"""
+
+    def __init__(self, median_ms=300.0, dist="lognormal", sigma=0.5):
+        if dist not in ("fixed", "uniform", "lognormal"):
+            raise ValueError(f"unknown latency distribution: {dist}")
+        self.median_ms = median_ms
+        self.dist = dist
+        self.sigma = sigma
+
+    def sample(self):
+        """Seconds"""
+        if self.dist == "fixed":
+            ms = self.median_ms
+        elif self.dist == "uniform":
+            ms = random.uniform(0, 2 * self.median_ms)
+        else:
+            ms = random.lognormvariate(math.log(max(self.median_ms, 0.001)), self.sigma)
+        return ms / 1000
+
+
+def make_png(color, size):
+    """Solid-color size x size RGB PNG; color is 3 bytes"""
+    rows = b"".join(b"\0" + color * size for _ in range(size))
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b"")
+
+
+def message_text(content):
+    """Text of a message whose content is a string or a list of parts (vision requests)"""
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if part.get("type") == "text")
+    return content or ""
+
+
+def message_images(content):
+    if isinstance(content, list):
+        return sum(1 for part in content if part.get("type") in ("image_url", "image"))
+    return 0
+
+
+class MockLLMServer:
+    """Threaded mock server; start() returns its base URL"""
+
+    def __init__(self, port=0, latency=None, p429=0.0, retry_after=1.0, reply_tokens=12, host="127.0.0.1"):
+        self.latency = latency or LatencyModel()
+        self.p429 = p429
+        self.retry_after = retry_after
+        self.reply_tokens = reply_tokens
+        self.requests = 0
+        self.throttled = 0
+        self.image_requests = 0
+        self.images_received = 0
+        self._lock = threading.Lock()
+        self._httpd = ThreadingHTTPServer((host, port), self._handler())
+        self._httpd.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="mock-llm", daemon=True)
+        self._thread.start()
+        return self.url
+
+    def stop(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def serve_forever(self):
+        self._httpd.serve_forever()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "throttled": self.throttled,
+                "image_requests": self.image_requests,
+                "images_received": self.images_received,
+            }
+
+    def _count(self, throttled):
+        with self._lock:
+            self.requests += 1
+            if throttled:
+                self.throttled += 1
+
+    def _reply(self):
+        return " ".join(random.choice(REPLY_WORDS) for _ in range(self.reply_tokens))
+
+    def _handler(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def _send(self, status, body, headers=None):
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                url = urlsplit(self.path)
+                if not (url.path.startswith("/images/") and url.path.endswith(".png")):
+                    self._send(404, b'{"error": "not found"}')
+                    return
+                query = parse_qs(url.query)
+                size = int(query.get("size", ["64"])[0])
+                color = query.get("color", [""])[0]
+                color = bytes.fromhex(color) if len(color) == 6 else zlib.crc32(url.path.encode("utf-8")).to_bytes(4, "big")[:3]
+                body = make_png(color, max(1, min(size, 4096)))
+                with mock._lock:
+                    mock.image_requests += 1
+                self.send_response(200)
+                self.send_header("Content-Type", "image/png")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                if not self.path.endswith("/chat/completions"):
+                    self._send(404, b'{"error": "not found"}')
+                    return
+                payload = json.loads(body or b"{}")
+                messages = payload.get("messages", [])
+                prompt_tokens = sum(len(message_text(m.get("content"))) for m in messages) // 4
+                images = sum(message_images(m.get("content")) for m in messages)
+                if images:
+                    with mock._lock:
+                        mock.images_received += images
+
+                throttled = random.random() < mock.p429
+                mock._count(throttled)
+                if throttled:
+                    self._send(429, b'{"error": {"message": "Rate limit reached (mock)"}}', {
+                        "retry-after": f"{mock.retry_after:g}",
+                        "x-ratelimit-remaining-requests": "0",
+                        "x-ratelimit-reset-requests": f"{mock.retry_after:g}s",
+                    })
+                    return
+
+                delay = mock.latency.sample()
+                reply = mock._reply()
+                if payload.get("stream"):
+                    self.stream(reply, delay)
+                    return
+                time.sleep(delay)
+                self._send(200, json.dumps({
+                    "choices": [{"message": {"role": "assistant", "content": reply}}],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": mock.reply_tokens,
+                        "total_tokens": prompt_tokens + mock.reply_tokens,
+                    },
+                }).encode("utf-8"))
+
+            def stream(self, reply, delay):
+                """SSE deltas spread evenly over the sampled latency"""
+                words = reply.split(" ")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for i, word in enumerate(words):
+                    time.sleep(delay / (len(words) + 1))
+                    delta = {"choices": [{"delta": {"content": word if i == 0 else " " + word}}]}
+                    self._chunk(f"data: {json.dumps(delta)}\n\n".encode("utf-8"))
+                self._chunk(b"data: [DONE]\n\n")
+                self.wfile.write(b"0\r\n\r\n")
+
+            def _chunk(self, data):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def log_message(self, format, *args):
+                return
+
+        return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock /chat/completions server")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=300.0, help="median upstream latency")
+    parser.add_argument("--dist", choices=("fixed", "uniform", "lognormal"), default="lognormal")
+    parser.add_argument("--sigma", type=float, default=0.5, help="lognormal spread")
+    parser.add_argument("--p429", type=float, default=0.0, help="probability of answering 429")
+    parser.add_argument("--retry-after", type=float, default=1.0)
+    args = parser.parse_args()
+
+    mock = MockLLMServer(
+        args.port,
+        LatencyModel(args.latency_ms, args.dist, args.sigma),
+        p429=args.p429,
+        retry_after=args.retry_after,
+    )
+    print(f"Mock LLM on {mock.url}/chat/completions ({args.dist}, median {args.latency_ms:g} ms, 429 p={args.p429:g})")
+    try:
+        mock.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
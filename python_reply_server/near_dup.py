@@ -0,0 +1,164 @@
+import hashlib
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from reply_cache import normalize_tweet
+
+BITS = 64
+_TOKEN = re.compile(r"[\w$#@']+")
+_DIGITS = re.compile(r"\d+(?:[.,]\d+)*")
+
+
+def _hash64(feature):
+    return int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+# Byte -> its 8 bits spread into 16-bit lanes, so summing spread hashes counts set bits per position
+_SPREAD = [sum(((v >> j) & 1) << (16 * j) for j in range(8)) for v in range(256)]
+
+
+def simhash(text):
+    """64-bit SimHash of the distinct words; numbers are masked so "$98k" and "$100k" agree"""
+    words = set(_TOKEN.findall(_DIGITS.sub("0", normalize_tweet(text))))
+    if not words:
+        return 0
+    total = 0
+    for h in map(_hash64, words):
+        for i in range(8):
+            total += _SPREAD[(h >> (8 * i)) & 0xFF] << (128 * i)
+    fingerprint = 0
+    for bit in range(BITS):
+        if 2 * ((total >> (16 * bit)) & 0xFFFF) > len(words):
+            fingerprint |= 1 << bit
+    return fingerprint
+
+
+def distance(a, b):
+    return (a ^ b).bit_count()
+
+
+def similarity(a, b):
+    return 1 - distance(a, b) / BITS
+
+
+def _flips(width, radius):
+    """Every width-bit mask with at most radius bits set"""
+    masks = [0]
+    for _ in range(radius):
+        masks = sorted({m | (1 << b) for m in masks for b in range(width)} | set(masks))
+    return masks
+
+
+def _probe_count(width, radius):
+    count, term = 1, 1
+    for r in range(1, radius + 1):
+        term = term * (width - r + 1) // r
+        count += term
+    return count
+
+
+def _widths(blocks):
+    return [BITS // blocks + (1 if i < BITS % blocks else 0) for i in range(blocks)]
+
+
+def _pick_blocks(max_distance, capacity):
+    """Block count with the fewest expected dict probes plus candidate comparisons"""
+    def cost(blocks):
+        radius = max_distance // blocks
+        return sum(_probe_count(w, radius) * (1 + capacity / 2 ** w) for w in _widths(blocks))
+    return min(range(2, 9), key=cost)
+
+
+class NearDuplicateIndex:
+    """Recently seen tweets by SimHash, answering "which earlier tweets are within max_distance bits?".
+
+    Multi-index hashing: fingerprints are split into B blocks with one table each. Two
+    fingerprints within max_distance bits have some block within max_distance // B bits, so a
+    lookup probes only those block values instead of comparing against every tweet. B is chosen
+    for the capacity and threshold; at the default 8 bits and 100k tweets that is three
+    21-22 bit blocks and about 0.5 ms per lookup, hashing included. Cost climbs past ~10 bits.
+    The oldest tweets are dropped past capacity.
+    """
+
+    def __init__(self, capacity=100000, min_similarity=0.875):
+        self.capacity = max(1, capacity)
+        self.max_distance = max(0, min(15, int(round((1 - min_similarity) * BITS))))
+        blocks = _pick_blocks(self.max_distance, self.capacity)
+        widths = _widths(blocks)
+        # (shift, mask, probe masks) per block
+        self._blocks = [
+            (sum(widths[:i]), (1 << w) - 1, _flips(w, self.max_distance // blocks)) for i, w in enumerate(widths)
+        ]
+        self._tables = [{} for _ in self._blocks]
+        self._tweets = OrderedDict()  # fingerprint -> normalized tweet text
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.matches = 0
+        self.lookup_ms = 0.0
+
+    def _bands(self, fingerprint):
+        return [(fingerprint >> shift) & mask for shift, mask, _ in self._blocks]
+
+    def add(self, tweet_text):
+        fingerprint = simhash(tweet_text)
+        tweet = normalize_tweet(tweet_text)
+        with self._lock:
+            if fingerprint in self._tweets:
+                self._tweets[fingerprint] = tweet
+                self._tweets.move_to_end(fingerprint)
+                return
+            self._tweets[fingerprint] = tweet
+            for table, band in zip(self._tables, self._bands(fingerprint)):
+                table.setdefault(band, set()).add(fingerprint)
+            while len(self._tweets) > self.capacity:
+                self._remove(next(iter(self._tweets)))
+
+    def _remove(self, fingerprint):
+        del self._tweets[fingerprint]
+        for table, band in zip(self._tables, self._bands(fingerprint)):
+            bucket = table.get(band)
+            if bucket is not None:
+                bucket.discard(fingerprint)
+                if not bucket:
+                    del table[band]
+
+    def find(self, tweet_text, limit=3):
+        """Up to limit (similarity, earlier tweet) pairs within the threshold, closest first"""
+        started = time.perf_counter()
+        fingerprint = simhash(tweet_text)
+        tweet = normalize_tweet(tweet_text)
+        seen = set()
+        found = {}
+        with self._lock:
+            for table, (shift, mask, probes) in zip(self._tables, self._blocks):
+                band = (fingerprint >> shift) & mask
+                for flip in probes:
+                    for candidate in table.get(band ^ flip, ()):
+                        if candidate in seen:
+                            continue
+                        seen.add(candidate)
+                        d = distance(fingerprint, candidate)
+                        if d <= self.max_distance and self._tweets[candidate] != tweet:
+                            found[candidate] = d
+            matches = [(1 - d / BITS, self._tweets[c]) for c, d in sorted(found.items(), key=lambda item: item[1])]
+            self.lookups += 1
+            self.lookup_ms += (time.perf_counter() - started) * 1000
+        return matches[:limit]
+
+    def record_match(self):
+        with self._lock:
+            self.matches += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": len(self._tweets),
+                "capacity": self.capacity,
+                "max_distance": self.max_distance,
+                "blocks": len(self._blocks),
+                "lookups": self.lookups,
+                "reused": self.matches,
+                "avg_lookup_ms": round(self.lookup_ms / self.lookups, 3) if self.lookups else None,
+            }
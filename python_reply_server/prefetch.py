@@ -0,0 +1,108 @@
+import threading
+import time
+from collections import OrderedDict, deque
+
+
+class PrefetchQueue:
+    """Low-priority background generation for tweets currently visible in the timeline.
+
+    fetch(item) generates one reply and returns the tokens it spent; is_busy() returns
+    True while user requests need the upstream, which pauses prefetching entirely.
+    """
+
+    def __init__(self, fetch, is_busy, max_pending=50, max_requests_per_min=10, max_tokens_per_min=10000):
+        self._fetch = fetch
+        self._is_busy = is_busy
+        self.max_pending = max_pending
+        self.max_requests_per_min = max_requests_per_min
+        self.max_tokens_per_min = max_tokens_per_min
+        self._pending = OrderedDict()  # key -> item, oldest first
+        self._spent = deque()  # (timestamp, tokens) for the last minute
+        self._cond = threading.Condition()
+        self._thread = None
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.tokens = 0
+
+    @property
+    def enabled(self):
+        return self.max_requests_per_min > 0 and self.max_pending > 0
+
+    def replace(self, entries):
+        """Make entries [(key, item), ...] the whole pending queue; dropped keys are cancelled"""
+        entries = entries[:self.max_pending]
+        wanted = {key for key, _ in entries}
+        with self._cond:
+            for key in list(self._pending):
+                if key not in wanted:
+                    del self._pending[key]
+                    self.cancelled += 1
+            for key, item in entries:
+                if key not in self._pending:
+                    self._pending[key] = item
+            queued = len(self._pending)
+            self._cond.notify()
+        self._ensure_worker()
+        return queued
+
+    def _ensure_worker(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+            self._thread.start()
+
+    def _budget_wait(self):
+        """Seconds until the per-minute request and token budget allows another call"""
+        now = time.monotonic()
+        while self._spent and now - self._spent[0][0] >= 60:
+            self._spent.popleft()
+        tokens = sum(t for _, t in self._spent)
+        if len(self._spent) < self.max_requests_per_min and tokens < self.max_tokens_per_min:
+            return 0.0
+        return 60 - (now - self._spent[0][0])
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+            # User clicks always go first: idle while any user generation is active
+            if self._is_busy():
+                time.sleep(0.2)
+                continue
+            with self._cond:
+                wait = self._budget_wait()
+            if wait > 0:
+                time.sleep(min(wait, 1.0))
+                continue
+            with self._cond:
+                if not self._pending:
+                    continue
+                _, item = self._pending.popitem(last=False)
+            try:
+                spent = self._fetch(item)
+            except Exception:
+                self.failed += 1
+                continue
+            if spent is None:
+                continue  # already cached, nothing spent
+            with self._cond:
+                self._spent.append((time.monotonic(), spent))
+                self.tokens += spent
+                self.completed += 1
+
+    def stats(self):
+        with self._cond:
+            pending = len(self._pending)
+            wait = self._budget_wait() if self._spent else 0.0
+        return {
+            "enabled": self.enabled,
+            "pending": pending,
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "tokens": self.tokens,
+            "budget_wait_s": round(wait, 1),
+            "max_requests_per_min": self.max_requests_per_min,
+            "max_tokens_per_min": self.max_tokens_per_min,
+        }
@@ -0,0 +1,131 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+class SamplingProfiler:
+    """Wall-clock sampling profiler for the threads handling requests.
+
+    cProfile only sees the thread that enables it, so instead a background thread
+    reads every request thread's stack (sys._current_frames) each interval for a
+    fixed window. Time blocked on the network or a lock shows up too, which is
+    what matters for reply latency. At the end of the window the stacks are
+    written to out_dir as profile-YYYYmmdd-HHMMSS.folded (one "a;b;c count" line
+    per stack, the input format of flamegraph.pl and speedscope) and summarized.
+    """
+
+    def __init__(self, out_dir, max_seconds=300.0):
+        self.out_dir = out_dir
+        self.max_seconds = max_seconds
+        self._threads = set()  # idents of threads inside sampled()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._until = None
+        self.runs = 0
+        self.last = None
+
+    @contextmanager
+    def sampled(self):
+        """Mark the calling thread as one to profile while the block runs"""
+        ident = threading.get_ident()
+        with self._lock:
+            self._threads.add(ident)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._threads.discard(ident)
+
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, seconds, interval=0.005):
+        """Profile for seconds (capped at max_seconds); False if a window is already open"""
+        seconds = max(0.1, min(float(seconds), self.max_seconds))
+        interval = max(0.001, float(interval))
+        with self._lock:
+            if self.running():
+                return False
+            self._stop.clear()
+            self._until = time.time() + seconds
+            self._thread = threading.Thread(target=self._run, args=(seconds, interval), name="profiler", daemon=True)
+            self._thread.start()
+        return True
+
+    def stop(self):
+        """End the current window early; its profile is still written"""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=5)
+
+    def _run(self, seconds, interval):
+        started = time.time()
+        stacks = Counter()
+        ticks = 0
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline and not self._stop.wait(interval):
+            ticks += 1
+            frames = sys._current_frames()
+            with self._lock:
+                idents = list(self._threads)
+            for ident in idents:
+                frame = frames.get(ident)
+                if frame is not None:
+                    stacks[_stack(frame)] += 1
+        self.runs += 1
+        self.last = self._write(stacks, ticks, started, time.time() - started)
+
+    def _write(self, stacks, ticks, started, elapsed):
+        path = os.path.join(self.out_dir, time.strftime("profile-%Y%m%d-%H%M%S.folded", time.localtime(started)))
+        try:
+            os.makedirs(self.out_dir, exist_ok=True)
+            with open(path, "w", encoding="utf-8") as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        except OSError as e:
+            print(f"⚠️  Could not write profile {path}: {e}")
+            path = None
+        samples = sum(stacks.values())
+        own = Counter()
+        inclusive = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(";")
+            own[frames[-1]] += count
+            for name in set(frames):
+                inclusive[name] += count
+
+        def top(counter):
+            return [[name, round(100.0 * count / samples, 1)] for name, count in counter.most_common(15)] if samples else []
+
+        return {
+            "file": path,
+            "started": round(started, 3),
+            "seconds": round(elapsed, 1),
+            "ticks": ticks,
+            "samples": samples,
+            "top_self_pct": top(own),
+            "top_total_pct": top(inclusive),
+        }
+
+    def stats(self):
+        return {
+            "running": self.running(),
+            "until": round(self._until, 3) if self.running() else None,
+            "runs": self.runs,
+            "last_file": self.last["file"] if self.last else None,
+        }
+
+
+def _stack(frame):
+    """Root-first "file:function" frames joined with ';'"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
@@ -0,0 +1,230 @@
+import re
+import threading
+from collections import OrderedDict, namedtuple
+
+# system: instructions, tone, style guide and examples (identical across tweets);
+# user: the tweet-specific part appended per request;
+# estimated_tokens/trimmed: set by PromptCompiler.build (sections cut to fit the budget);
+# images: TweetImages sent with the user message in vision mode (see attach_images)
+Prompt = namedtuple("Prompt", ["system", "user", "estimated_tokens", "trimmed", "images"], defaults=(None, (), ()))
+
+# Latin letter runs, other letter runs, digit runs and single other characters;
+# whitespace is folded into the next piece
+_PIECE = re.compile(r"[A-Za-z]+|[^\W\d_]+|\d+|[^\s\w]|_")
+MESSAGE_OVERHEAD_TOKENS = 4
+# Trimming never cuts the tweet below this many tokens
+MIN_TWEET_TOKENS = 64
+TRIM_MARK = " […]"
+# Input tokens one downscaled image costs (Claude: width * height / 750; Llama 4 tiles similarly)
+IMAGE_TOKENS = 800
+
+
+def prompt_parts(prompt):
+    """(system or None, user) for a Prompt or a plain single-message string"""
+    if isinstance(prompt, Prompt):
+        return prompt.system, prompt.user
+    return None, prompt
+
+
+def prompt_images(prompt):
+    """Images attached to a Prompt; none for a plain string"""
+    return prompt.images if isinstance(prompt, Prompt) else ()
+
+
+def attach_images(prompt, images, tokens_per_image=IMAGE_TOKENS):
+    """prompt with images attached and their tokens added to the estimate"""
+    if not images:
+        return prompt
+    estimated = estimate_prompt_tokens(prompt) + tokens_per_image * len(images)
+    return prompt._replace(images=tuple(images), estimated_tokens=estimated)
+
+
+def _piece_tokens(piece):
+    if piece[0].isascii() and piece[0].isalpha():
+        return (len(piece) + 4) // 5  # BPE vocabularies hold most English words whole or in two
+    if piece[0].isalpha():
+        return (len(piece) + 2) // 3  # Cyrillic, Greek, ...: fewer merges
+    if piece[0].isdigit():
+        return (len(piece) + 2) // 3
+    return 1  # punctuation, emoji
+
+
+def estimate_tokens(text):
+    """Fast local token estimate for BPE tokenizers (Llama 3, GPT, Claude), usually within ~15%"""
+    return sum(_piece_tokens(piece) for piece in _PIECE.findall(text or ""))
+
+
+def estimate_prompt_tokens(prompt):
+    """Estimated input tokens of a Prompt (as computed by build) or a plain string"""
+    if isinstance(prompt, Prompt) and prompt.estimated_tokens is not None:
+        return prompt.estimated_tokens
+    system, user = prompt_parts(prompt)
+    messages = 2 if system else 1
+    return estimate_tokens(system) + estimate_tokens(user) + MESSAGE_OVERHEAD_TOKENS * messages
+
+
+def truncate_tokens(text, max_tokens):
+    """text cut after about max_tokens estimated tokens (at a piece boundary), marked as cut"""
+    if max_tokens <= 0:
+        return ""
+    total = 0
+    for match in _PIECE.finditer(text):
+        total += _piece_tokens(match.group())
+        if total > max_tokens:
+            return text[:match.start()].rstrip() + TRIM_MARK
+    return text
+
+
+def render_examples(examples, heading):
+    parts = [heading]
+    for ex in examples:
+        parts.append(f"Tweet: \"{ex.get('tweet', '')}\"\nReply: \"{ex.get('reply', '')}\"\n\n")
+    return "".join(parts)
+
+
+def render_system(tone, config, max_examples=3, candidates=1, guide_tokens=None):
+    """max_examples: config examples.good to include; guide_tokens caps the style guide"""
+    custom_prompt = config.get("custom_prompt", "")
+    if guide_tokens is not None:
+        custom_prompt = truncate_tokens(custom_prompt, guide_tokens)
+    parts = [
+        "You are an expert at crafting viral X (Twitter) replies for crypto and Polymarket content.",
+        f"\n\nTONE: {tone}\n\n",
+    ]
+
+    # Add user's custom prompt if exists
+    if custom_prompt:
+        parts.append(f"USER'S STYLE GUIDELINES:\n{custom_prompt}\n\n")
+
+    # Add examples if provided (unless similar ones are picked per tweet)
+    examples = config.get("examples", {}).get("good", [])[:max_examples]  # Limit to 3 examples
+    if examples:
+        parts.append(render_examples(examples, "EXAMPLES OF GOOD REPLIES:\n"))
+
+    if candidates > 1:
+        parts.append(
+            f"The user sends the tweet to reply to. Generate {candidates} different replies following "
+            f"the style guidelines above, one per line, numbered 1. to {candidates}. "
+            "Return ONLY the replies, nothing else."
+        )
+    else:
+        parts.append(
+            "The user sends the tweet to reply to. Generate ONE perfect reply following the style "
+            "guidelines above. Return ONLY the reply text, nothing else."
+        )
+    return "".join(parts)
+
+
+def render_user(tweet_text, images, examples=None):
+    user = f"TWEET TO REPLY TO:\n\"{tweet_text}\""
+    if examples:
+        user = render_examples(examples, "EXAMPLES OF GOOD REPLIES TO SIMILAR TWEETS:\n") + user
+    if images:
+        user += f"\n\nThe tweet contains {len(images)} image(s). Consider visual context."
+    return user
+
+
+class PromptCompiler:
+    """Renders the system message once per (config version, tone) and reuses it.
+
+    A byte-identical system message also lets providers with prompt caching reuse the prefix.
+
+    With budget > 0, prompts estimated above budget input tokens are cut down in a
+    fixed order until they fit: examples first (least similar / last ones first),
+    then the tail of a long tweet (never below MIN_TWEET_TOKENS), then the tail of
+    the style guide. The same inputs always give the same prompt.
+    """
+
+    def __init__(self, max_entries=64, budget=0):
+        self.max_entries = max_entries
+        self.budget = budget
+        self._compiled = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.compiled = 0
+        self.trimmed = {}  # section -> prompts cut there
+        self._estimates = 0
+        self._estimated_sum = 0
+        self._actual_sum = 0
+
+    def system(self, tone, config, max_examples=3, candidates=1, guide_tokens=None):
+        key = (config.version, tone, max_examples, candidates, guide_tokens)
+        with self._lock:
+            system = self._compiled.get(key)
+            if system is not None:
+                self._compiled.move_to_end(key)
+                self.hits += 1
+                return system
+
+        system = render_system(tone, config, max_examples, candidates, guide_tokens)
+        with self._lock:
+            self._compiled[key] = system
+            self._compiled.move_to_end(key)
+            self.compiled += 1
+            while len(self._compiled) > self.max_entries:
+                self._compiled.popitem(last=False)
+        return system
+
+    def build(self, tweet_text, images, tone, config, examples=None, candidates=1):
+        """examples: per-tweet picks that replace config examples.good (None keeps those in the system message);
+        candidates > 1 asks for that many numbered alternatives"""
+        kept = len(examples) if examples is not None else 3
+        guide_tokens = None
+        trimmed = []
+
+        def render():
+            system = self.system(tone, config, 0 if examples is not None else kept, candidates, guide_tokens)
+            user = render_user(tweet_text, images, examples[:kept] if examples is not None else None)
+            return Prompt(system, user, estimate_prompt_tokens(Prompt(system, user)))
+
+        prompt = render()
+        if self.budget <= 0 or prompt.estimated_tokens <= self.budget:
+            return prompt
+
+        config_examples = len(config.get("examples", {}).get("good", [])[:3]) if examples is None else len(examples)
+        kept = config_examples
+        while prompt.estimated_tokens > self.budget and kept > 0:
+            kept -= 1
+            prompt = render()
+        if kept < config_examples:
+            trimmed.append("examples")
+
+        over = prompt.estimated_tokens - self.budget
+        tweet_tokens = estimate_tokens(tweet_text)
+        if over > 0 and tweet_tokens > MIN_TWEET_TOKENS:
+            tweet_text = truncate_tokens(tweet_text, max(MIN_TWEET_TOKENS, tweet_tokens - over - estimate_tokens(TRIM_MARK)))
+            trimmed.append("tweet")
+            prompt = render()
+
+        over = prompt.estimated_tokens - self.budget
+        custom_prompt = config.get("custom_prompt", "")
+        if over > 0 and custom_prompt:
+            guide_tokens = max(0, estimate_tokens(custom_prompt) - over - estimate_tokens(TRIM_MARK))
+            trimmed.append("style_guide")
+            prompt = render()
+
+        with self._lock:
+            for section in trimmed:
+                self.trimmed[section] = self.trimmed.get(section, 0) + 1
+        return prompt._replace(trimmed=tuple(trimmed))
+
+    def record_usage(self, estimated, actual):
+        """Compare an estimate with the prompt_tokens the provider reported"""
+        if not estimated or not actual:
+            return
+        with self._lock:
+            self._estimates += 1
+            self._estimated_sum += estimated
+            self._actual_sum += actual
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._compiled),
+                "compiled": self.compiled,
+                "hits": self.hits,
+                "budget": self.budget or None,
+                "trimmed": dict(self.trimmed),
+                # actual / estimated prompt tokens over all calls with usage; 1.0 is a perfect estimator
+                "actual_to_estimated": round(self._actual_sum / self._estimated_sum, 3) if self._estimated_sum else None,
+            }
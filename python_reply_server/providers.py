@@ -0,0 +1,568 @@
+import json
+import os
+import statistics
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager, nullcontext
+
+from breaker import CircuitBreaker, CircuitOpen
+from deadline import Cancelled, ChildDeadline, Deadline, DeadlineExceeded
+from metrics import LatencyWindow
+from prompts import IMAGE_TOKENS, estimate_prompt_tokens, prompt_images, prompt_parts
+from ratelimit import RateLimited, RateLimiter, parse_duration
+from tracing import bind, span
+
+Completion = namedtuple("Completion", ["text", "usage", "provider"])
+
+
+class ProviderHealth:
+    """Rolling latency and error rate for one provider"""
+
+    def __init__(self, window=50):
+        self.latency = LatencyWindow(window)
+        self.ewma_ms = None
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def record(self, ok, ms):
+        with self._lock:
+            self._outcomes.append(ok)
+            if ok:
+                self.ewma_ms = ms if self.ewma_ms is None else 0.8 * self.ewma_ms + 0.2 * ms
+        if ok:
+            self.latency.record(ms)
+
+    def error_rate(self):
+        with self._lock:
+            if not self._outcomes:
+                return 0.0
+            return 1 - sum(self._outcomes) / len(self._outcomes)
+
+    def stats(self):
+        return {
+            "error_rate": round(self.error_rate(), 3),
+            "ewma_ms": round(self.ewma_ms, 1) if self.ewma_ms is not None else None,
+            "latency": self.latency.snapshot(),
+        }
+
+
+class Provider:
+    """One chat-completion backend; subclasses build the request and parse the response"""
+
+    label = "Provider"
+
+    def __init__(self, name, model, client, limiter=None, breaker_failures=5, breaker_reset=30.0, vision_model=None):
+        self.name = name
+        self.model = model
+        self.vision_model = vision_model
+        self.client = client
+        self.limiter = limiter
+        self.health = ProviderHealth()
+        self.breaker = CircuitBreaker(name, breaker_failures, breaker_reset)
+        self.retries = 0
+        self.throttled = 0
+        self.vision_calls = 0
+
+    def _model_for(self, prompt):
+        """(model, images to send): the vision model when the prompt carries images and one
+        is configured; otherwise the text model, which only gets the image count in the text"""
+        images = prompt_images(prompt)
+        if images and self.vision_model:
+            self.vision_calls += 1
+            return self.vision_model, images
+        return self.model, ()
+
+    @staticmethod
+    def _estimate(prompt, images, max_tokens):
+        """Tokens the call will count against the rate budget; the prompt estimate includes
+        its images, which are left out when this provider does not send them"""
+        dropped = len(prompt_images(prompt)) - len(images)
+        return estimate_prompt_tokens(prompt) - IMAGE_TOKENS * dropped + max_tokens
+
+    def _settle(self, prompt, max_tokens, usage):
+        """Credit the limiter with the tokens reserved for a finished call but not used"""
+        used = usage.get("total_tokens")
+        if self.limiter is None or not used:
+            return
+        images = prompt_images(prompt) if self.vision_model else ()
+        self.limiter.credit(self._estimate(prompt, images, max_tokens) - used)
+
+    @contextmanager
+    def _cancellable(self, deadline):
+        """Abort the upstream call when deadline is cancelled, and report errors caused by
+        the abort or by running out of time as Cancelled/DeadlineExceeded"""
+        try:
+            with self.client.cancellable(deadline):
+                yield
+        except (Cancelled, DeadlineExceeded):
+            raise
+        except Exception as e:
+            if deadline.cancelled():
+                raise Cancelled("upstream", deadline.reason) from e
+            if deadline.expired():
+                raise DeadlineExceeded("upstream") from e
+            raise
+
+    def _post(self, url, headers, payload, estimated_tokens, stream=False, deadline=None):
+        """POST with up to 3 attempts on 429/529; returns the 200 response.
+
+        Timeouts and retry waits are capped by the deadline: a retry that could not
+        finish in time is not started.
+        """
+        deadline = deadline or Deadline()
+        last_text = None
+        for attempt in range(3):
+            deadline.check("upstream")
+            # The limiter waits no longer than the deadline allows
+            remaining = deadline.remaining()
+            capped = self.limiter is not None and remaining is not None and remaining < self.limiter.max_wait
+            slot = self.limiter.slot(estimated_tokens, max(0.0, remaining) if capped else None, deadline) if self.limiter else nullcontext()
+            try:
+                with slot:
+                    deadline.check("upstream")
+                    timeout = (deadline.timeout(self.client.connect_timeout), deadline.timeout(self.client.read_timeout))
+                    with span("http", provider=self.name, attempt=attempt + 1) as attrs:
+                        r = self.client.post(url, headers=headers, json=payload, stream=stream, timeout=timeout)
+                        attrs["status"] = r.status_code
+                    if self.limiter:
+                        self.limiter.observe(r.status_code, r.headers)
+            except RateLimited:
+                if capped:
+                    raise DeadlineExceeded("rate_limit") from None
+                raise
+            if r.status_code == 200:
+                return r
+
+            last_text = r.text
+            if r.status_code in (429, 529):
+                self.throttled += 1
+                if attempt < 2:
+                    self.retries += 1
+                if self.limiter is None:
+                    retry_after = parse_duration(r.headers.get("retry-after"))
+                    delay = RateLimiter.backoff(attempt + 1, retry_after)
+                    remaining = deadline.remaining()
+                    if remaining is not None and delay >= remaining:
+                        raise DeadlineExceeded("rate_limit")
+                    with span("backoff", status=r.status_code):
+                        deadline.wait(delay)
+                # with a limiter, the next slot() waits out retry-after
+                continue
+
+            raise Exception(f"{self.label} API Error: {r.status_code} - {r.text}")
+
+        raise Exception(f"{self.label} API Error: 429 - {last_text}")
+
+    def complete(self, prompt, max_tokens, temperature, top_p, deadline=None):
+        """Returns (text, usage) with usage in prompt/completion/total_tokens form"""
+        raise NotImplementedError
+
+    def stream(self, prompt, max_tokens, temperature, top_p, deadline=None):
+        """Yields text deltas"""
+        raise NotImplementedError
+
+
+class OpenAICompatibleProvider(Provider):
+    """Groq, OpenAI and local servers (llama.cpp, vLLM, Ollama) speaking /chat/completions"""
+
+    def __init__(self, name, base_url, api_key, model, client, limiter=None, label=None, vision_model=None, **breaker):
+        super().__init__(name, model, client, limiter, vision_model=vision_model, **breaker)
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.label = label or name
+
+    def _request(self, prompt, max_tokens, temperature, top_p, stream, deadline):
+        headers = {"Content-Type": "application/json"}
+        if self.api_key:
+            headers["Authorization"] = f"Bearer {self.api_key}"
+        system, user = prompt_parts(prompt)
+        model, images = self._model_for(prompt)
+        # The system message comes first so its prefix is shared across requests
+        messages = [{"role": "system", "content": system}] if system else []
+        if images:
+            content = [{"type": "text", "text": user}] + [
+                {"type": "image_url", "image_url": {"url": f"data:{image.media_type};base64,{image.data}"}}
+                for image in images
+            ]
+            messages.append({"role": "user", "content": content})
+        else:
+            messages.append({"role": "user", "content": user})
+        payload = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+            "top_p": top_p,
+        }
+        if stream:
+            payload["stream"] = True
+        # Local estimate; rate-limit response headers correct the budget
+        estimated_tokens = self._estimate(prompt, images, max_tokens)
+        return self._post(f"{self.base_url}/chat/completions", headers, payload, estimated_tokens, stream, deadline)
+
+    def complete(self, prompt, max_tokens, temperature, top_p, deadline=None):
+        deadline = deadline or Deadline()
+        with self._cancellable(deadline):
+            j = self._request(prompt, max_tokens, temperature, top_p, False, deadline).json()
+        usage = j.get("usage") or {}
+        self._settle(prompt, max_tokens, usage)
+        return j["choices"][0]["message"]["content"] or "", usage
+
+    def stream(self, prompt, max_tokens, temperature, top_p, deadline=None):
+        deadline = deadline or Deadline()
+        with self._cancellable(deadline), self._request(prompt, max_tokens, temperature, top_p, True, deadline) as r:
+            for line in r.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[5:].strip()
+                if data == "[DONE]":
+                    break
+                choices = json.loads(data).get("choices") or [{}]
+                delta = (choices[0].get("delta") or {}).get("content")
+                if delta:
+                    yield delta
+
+
+class AnthropicProvider(Provider):
+    """Anthropic messages API"""
+
+    label = "Anthropic"
+
+    def __init__(self, api_key, model, client, base_url="https://api.anthropic.com/v1", limiter=None, vision_model=None,
+                 **breaker):
+        super().__init__("anthropic", model, client, limiter, vision_model=vision_model, **breaker)
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+
+    def _request(self, prompt, max_tokens, temperature, top_p, stream, deadline):
+        headers = {
+            "Content-Type": "application/json",
+            "x-api-key": self.api_key,
+            "anthropic-version": "2023-06-01",
+        }
+        system, user = prompt_parts(prompt)
+        model, images = self._model_for(prompt)
+        content = user
+        if images:
+            # Images before the text, as the API docs recommend
+            content = [
+                {"type": "image", "source": {"type": "base64", "media_type": image.media_type, "data": image.data}}
+                for image in images
+            ] + [{"type": "text", "text": user}]
+        payload = {
+            "model": model,
+            "max_tokens": max_tokens,
+            "temperature": temperature,
+            "messages": [{"role": "user", "content": content}],
+        }
+        if system:
+            # Marked cacheable; the API ignores the marker below its minimum prefix length
+            payload["system"] = [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]
+        if stream:
+            payload["stream"] = True
+        estimated_tokens = self._estimate(prompt, images, max_tokens)
+        return self._post(f"{self.base_url}/messages", headers, payload, estimated_tokens, stream, deadline)
+
+    def complete(self, prompt, max_tokens, temperature, top_p, deadline=None):
+        deadline = deadline or Deadline()
+        with self._cancellable(deadline):
+            j = self._request(prompt, max_tokens, temperature, top_p, False, deadline).json()
+        text = "".join(block.get("text", "") for block in j.get("content", []) if block.get("type") == "text")
+        usage = j.get("usage") or {}
+        prompt_tokens = usage.get("input_tokens", 0)
+        completion_tokens = usage.get("output_tokens", 0)
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        self._settle(prompt, max_tokens, usage)
+        return text, usage
+
+    def stream(self, prompt, max_tokens, temperature, top_p, deadline=None):
+        deadline = deadline or Deadline()
+        with self._cancellable(deadline), self._request(prompt, max_tokens, temperature, top_p, True, deadline) as r:
+            for line in r.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                event = json.loads(line[5:].strip())
+                if event.get("type") == "content_block_delta":
+                    delta = (event.get("delta") or {}).get("text")
+                    if delta:
+                        yield delta
+                elif event.get("type") == "message_stop":
+                    break
+
+
+class Router:
+    """Sends each completion to the fastest provider whose breaker is closed, failing over on errors.
+
+    When every breaker is open, calls fail fast with CircuitOpen instead of waiting on timeouts.
+
+    With hedge=True, a second provider is started when the first has not answered
+    by its own p95 latency; whichever succeeds first wins.
+    """
+
+    def __init__(self, providers, hedge=False, hedge_workers=8):
+        self.providers = list(providers)
+        self.hedge = hedge and len(self.providers) > 1
+        self._pool = ThreadPoolExecutor(max_workers=hedge_workers, thread_name_prefix="hedge") if self.hedge else None
+        self.hedges = 0
+        self.hedge_wins = 0
+        self.failovers = 0
+        self.fast_failed = 0
+
+    @property
+    def model_tag(self):
+        """Identifies the set of models that may answer, for cache keys"""
+        return "+".join(sorted(f"{p.name}:{p.model}" for p in self.providers))
+
+    @property
+    def vision_tag(self):
+        """Identifies the models that may look at a tweet's images, for cache keys"""
+        return "+".join(sorted(f"{p.name}:{p.vision_model}" for p in self.providers if p.vision_model))
+
+    def ranked(self):
+        """Providers accepting calls, cheapest first (recently failing last).
+
+        The cost is the latency EWMA scaled by 1 / (1 - error rate), the expected time
+        until a call succeeds; untried providers get the median of the measured EWMAs,
+        so one slow sample does not sink a provider below the ones nobody has tried.
+        """
+        measured = [p.health.ewma_ms for p in self.providers if p.health.ewma_ms is not None]
+        prior = statistics.median(measured) if measured else 0.0
+
+        def cost(p):
+            ewma = p.health.ewma_ms if p.health.ewma_ms is not None else prior
+            return (p.breaker.failures > 0, ewma / (1 - min(p.health.error_rate(), 0.9)))
+        return sorted((p for p in self.providers if p.breaker.available()), key=cost)
+
+    def _candidates(self):
+        if not self.providers:
+            raise Exception("No model provider configured")
+        candidates = self.ranked()
+        if not candidates:
+            self.fast_failed += 1
+            retry_after = min(p.breaker.retry_after() for p in self.providers)
+            raise CircuitOpen(
+                f"All providers unavailable (circuit open), retry in {max(1.0, retry_after):.0f}s",
+                max(1.0, retry_after),
+            )
+        return candidates
+
+    @staticmethod
+    def _record(provider, ok, started, error=None):
+        if isinstance(error, (RateLimited, Cancelled, DeadlineExceeded)):
+            # Local pacing or a caller that stopped waiting says nothing about the provider
+            provider.breaker.release()
+            return
+        provider.health.record(ok, (time.perf_counter() - started) * 1000)
+        if ok:
+            provider.breaker.record_success()
+        else:
+            provider.breaker.record_failure()
+
+    def _call(self, provider, prompt, max_tokens, temperature, top_p, deadline):
+        provider.breaker.before_call()
+        started = time.perf_counter()
+        try:
+            text, usage = provider.complete(prompt, max_tokens, temperature, top_p, deadline)
+        except Exception as e:
+            self._record(provider, False, started, e)
+            raise
+        self._record(provider, True, started)
+        return Completion(text, usage, provider.name)
+
+    def complete(self, prompt, max_tokens=120, temperature=0.9, top_p=0.95, deadline=None):
+        deadline = deadline or Deadline()
+        candidates = self._candidates()
+        if self.hedge and len(candidates) > 1:
+            return self._hedged(candidates, prompt, max_tokens, temperature, top_p, deadline)
+
+        last_error = None
+        for attempt, provider in enumerate(candidates[:2]):
+            if attempt:
+                # Fail over only while the caller is still waiting
+                deadline.check("failover")
+                self.failovers += 1
+            try:
+                return self._call(provider, prompt, max_tokens, temperature, top_p, deadline)
+            except (Cancelled, DeadlineExceeded):
+                raise
+            except Exception as e:
+                last_error = e
+        raise last_error
+
+    def _hedged(self, candidates, prompt, max_tokens, temperature, top_p, deadline):
+        primary, backup = candidates[0], candidates[1]
+        attempts = {}  # future -> its own deadline, cancelled when the other attempt wins
+
+        def submit(provider):
+            attempt = ChildDeadline(deadline)
+            # bind() keeps the pool threads' spans in the caller's trace
+            future = self._pool.submit(bind(self._call), provider, prompt, max_tokens, temperature, top_p, attempt)
+            attempts[future] = attempt
+            return future
+
+        first = submit(primary)
+        delay = primary.health.latency.percentile(0.95)
+        if delay is not None:
+            done, _ = wait([first], timeout=delay / 1000)
+            if done and first.exception() is None:
+                return first.result()
+        else:
+            # No latency history yet: let the primary run to completion
+            try:
+                return first.result()
+            except (Cancelled, DeadlineExceeded):
+                raise
+            except Exception:
+                pass
+
+        hedged = not (first.done() and first.exception() is not None)
+        if first.done() and isinstance(first.exception(), (Cancelled, DeadlineExceeded)):
+            raise first.exception()
+        deadline.check("failover")
+        if hedged:
+            self.hedges += 1
+        else:
+            self.failovers += 1
+        second = submit(backup)
+        pending = {first, second}
+        last_error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if hedged and future is second:
+                        self.hedge_wins += 1
+                    # Abort the losing attempt: it holds a connection and a rate-limit slot
+                    for loser in pending:
+                        attempts[loser].cancel("hedge lost")
+                    return future.result()
+                last_error = future.exception()
+        raise last_error
+
+    def stream(self, prompt, max_tokens=120, temperature=0.9, top_p=0.95, deadline=None):
+        """Stream from the best provider, failing over if it errors before the first delta.
+
+        Returns a delta iterator; nothing is sent upstream until it is first advanced.
+        The deadline is checked between deltas as well as by the upstream call.
+        """
+        deadline = deadline or Deadline()
+        candidates = self._candidates()[:2]
+
+        def deltas():
+            for attempt, provider in enumerate(candidates):
+                if attempt:
+                    deadline.check("failover")
+                    self.failovers += 1
+                started = time.perf_counter()
+                produced = False
+                try:
+                    provider.breaker.before_call()
+                    for delta in provider.stream(prompt, max_tokens, temperature, top_p, deadline):
+                        produced = True
+                        yield delta
+                        deadline.check("stream")
+                except CircuitOpen:
+                    if attempt == len(candidates) - 1:
+                        raise
+                    continue
+                except GeneratorExit:
+                    # Consumer stopped early; the upstream was fine as far as we know
+                    provider.breaker.release()
+                    raise
+                except Exception as e:
+                    self._record(provider, False, started, e)
+                    if produced or attempt == len(candidates) - 1 or isinstance(e, (Cancelled, DeadlineExceeded)):
+                        raise
+                    continue
+                self._record(provider, True, started)
+                return
+
+        return deltas()
+
+    def stats(self):
+        return {
+            "hedge": self.hedge,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "failovers": self.failovers,
+            "available": len(self.ranked()),
+            "fast_failed": self.fast_failed,
+            "providers": {
+                p.name: dict(
+                    model=p.model,
+                    vision_model=p.vision_model,
+                    vision_calls=p.vision_calls,
+                    breaker=p.breaker.stats(),
+                    retries=p.retries,
+                    throttled=p.throttled,
+                    **p.health.stats(),
+                )
+                for p in self.providers
+            },
+        }
+
+
+def providers_from_env(client, groq_limiter=None, env=None):
+    """Build the configured providers: Groq, Anthropic and/or a local OpenAI-compatible server.
+
+    PROVIDERS (comma separated names) restricts and orders the set; by default every
+    provider with credentials or a base URL is used. BREAKER_FAILURES consecutive
+    failures open a provider's circuit for BREAKER_RESET_TIMEOUT seconds.
+    """
+    env = os.environ if env is None else env
+    breaker = {
+        "breaker_failures": int(env.get("BREAKER_FAILURES", "5")),
+        "breaker_reset": float(env.get("BREAKER_RESET_TIMEOUT", "30")),
+    }
+    available = {}
+
+    groq_key = env.get("GROQ_API_KEY", "").strip()
+    if groq_key:
+        available["groq"] = OpenAICompatibleProvider(
+            "groq",
+            env.get("GROQ_BASE_URL", "https://api.groq.com/openai/v1").strip(),
+            groq_key,
+            env.get("GROQ_MODEL", "llama-3.1-8b-instant").strip(),
+            client,
+            limiter=groq_limiter,
+            label="Groq",
+            vision_model=env.get("GROQ_VISION_MODEL", "meta-llama/llama-4-scout-17b-16e-instruct").strip() or None,
+            **breaker,
+        )
+
+    anthropic_key = env.get("ANTHROPIC_API_KEY", "").strip()
+    if anthropic_key:
+        anthropic_model = env.get("ANTHROPIC_MODEL", "claude-sonnet-4-20250514").strip()
+        available["anthropic"] = AnthropicProvider(
+            anthropic_key,
+            anthropic_model,
+            client,
+            base_url=env.get("ANTHROPIC_BASE_URL", "https://api.anthropic.com/v1").strip(),
+            # Claude models read images themselves; set to use a different one for tweets with images
+            vision_model=env.get("ANTHROPIC_VISION_MODEL", "").strip() or anthropic_model,
+            **breaker,
+        )
+
+    local_url = env.get("LOCAL_LLM_BASE_URL", "").strip()
+    if local_url:
+        available["local"] = OpenAICompatibleProvider(
+            "local",
+            local_url,
+            env.get("LOCAL_LLM_API_KEY", "").strip(),
+            env.get("LOCAL_LLM_MODEL", "local").strip(),
+            client,
+            label="Local LLM",
+            vision_model=env.get("LOCAL_LLM_VISION_MODEL", "").strip() or None,
+            **breaker,
+        )
+
+    wanted = [name.strip() for name in env.get("PROVIDERS", "").split(",") if name.strip()]
+    if wanted:
+        return [available[name] for name in wanted if name in available]
+    return list(available.values())
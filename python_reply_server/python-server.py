@@ -1,193 +1,1124 @@
-from http.server import HTTPServer, BaseHTTPRequestHandler
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+import gzip
 import json
+import math
 import os
+import signal
+import socket
+import sys
+import threading
 import time
-import requests
 from pathlib import Path
+import bulk
+from breaker import CircuitOpen
+from config_store import ConfigStore
+from deadline import Cancelled, Deadline, DeadlineExceeded, DisconnectWatcher
+from example_store import ExampleStore
+from images import ImageFetcher, ImageStore
+from journal import Journal, prompt_hash
+from metrics import LatencyWindow, Registry, SharedMetrics
+from near_dup import NearDuplicateIndex
+from prefetch import PrefetchQueue
+from profiler import SamplingProfiler
+from prompts import PromptCompiler, attach_images
+from providers import Router, providers_from_env
+from ratelimit import RateLimited, RateLimiter, SharedBudget
+from reply_cache import CandidatePool, ReplyCache, cache_key
+from reply_rules import compile_rules, split_candidates
+from singleflight import SingleFlight
+from tracing import SlowRequestLog, Trace, activate, bind, current_trace, span
+from upstream import UpstreamClient
+from workers import run_supervisor
 
-GROQ_API_KEY = os.getenv("GROQ_API_KEY", "").strip()
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Groq settings (GROQ_API_KEY, GROQ_BASE_URL) are read by providers_from_env
 GROQ_MODEL = os.getenv("GROQ_MODEL", "llama-3.1-8b-instant").strip()
-GROQ_BASE_URL = os.getenv("GROQ_BASE_URL", "https://api.groq.com/openai/v1").strip()
 
 PORT = int(os.getenv("PORT", "8765"))
+
+# WORKERS > 1 runs that many server processes on PORT (SO_REUSEPORT) under a supervisor;
+# they share the reply cache, rate budget and metrics through SHARED_STATE_FILE (SQLite WAL).
+# SIGHUP restarts them one at a time; SIGTERM drains in-flight requests for up to DRAIN_TIMEOUT
+WORKERS = max(1, int(os.getenv("WORKERS", "1")))
+WORKER_ID = os.getenv("WORKER_ID")
+SHARED_STATE_FILE = os.getenv("SHARED_STATE_FILE", "").strip() or str(Path(__file__).parent / "shared_state.db")
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "30"))
 CONFIG_FILE = Path(__file__).parent / "config.json"
 
+# Example library (POST /examples); the EXAMPLES_TOP_K most similar ones go into each prompt
+EXAMPLES_FILE = os.getenv("EXAMPLES_FILE", "").strip() or str(Path(__file__).parent / "examples.json")
+EXAMPLES_TOP_K = int(os.getenv("EXAMPLES_TOP_K", "3"))
+
+# Extra providers: ANTHROPIC_API_KEY, LOCAL_LLM_BASE_URL (see providers.py);
+# HEDGE_REQUESTS=1 races a second provider when the first is slower than its p95
+HEDGE_REQUESTS = os.getenv("HEDGE_REQUESTS", "0").strip() == "1"
+
+# Circuit breaker (BREAKER_FAILURES, BREAKER_RESET_TIMEOUT are read by providers_from_env);
+# OUTAGE_SERVE_CACHED=1 answers with the closest cached reply while every provider is down
+OUTAGE_SERVE_CACHED = os.getenv("OUTAGE_SERVE_CACHED", "0").strip() == "1"
+
+# Concurrency limits for generation work (health/config are never gated)
+MAX_INFLIGHT = int(os.getenv("MAX_INFLIGHT", "4"))
+MAX_QUEUE = int(os.getenv("MAX_QUEUE", "16"))
+
+# Shared keep-alive connection pool for upstream API calls
+UPSTREAM_POOL_SIZE = int(os.getenv("UPSTREAM_POOL_SIZE", "10"))
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv("UPSTREAM_CONNECT_TIMEOUT", "5"))
+UPSTREAM_READ_TIMEOUT = float(os.getenv("UPSTREAM_READ_TIMEOUT", "30"))
+
+# Default time budget per /generate call in ms (0 = none); clients override it with the
+# X-Deadline-Ms header or "deadlineMs" in the body. Calls whose client disconnects are aborted
+REQUEST_DEADLINE_MS = float(os.getenv("REQUEST_DEADLINE_MS", "0"))
+
+# HTTP/1.1 keep-alive idle timeout and minimum body size worth compressing
+KEEPALIVE_TIMEOUT = float(os.getenv("KEEPALIVE_TIMEOUT", "15"))
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "512"))
+
+# Upstream budget; x-ratelimit-* response headers refine it at runtime
+RATE_LIMIT_RPM = int(os.getenv("RATE_LIMIT_RPM", "30"))
+RATE_LIMIT_TPM = int(os.getenv("RATE_LIMIT_TPM", "6000"))
+RATE_LIMIT_MAX_WAIT = float(os.getenv("RATE_LIMIT_MAX_WAIT", "15"))
+
+# Reply cache (REPLY_CACHE_FILE enables persistence across restarts)
+REPLY_CACHE_SIZE = int(os.getenv("REPLY_CACHE_SIZE", "1000"))
+REPLY_CACHE_TTL = float(os.getenv("REPLY_CACHE_TTL", "3600"))
+REPLY_CACHE_FILE = os.getenv("REPLY_CACHE_FILE", "").strip()
+
+# Input token budget per prompt (0 = unlimited); over it, examples are dropped first,
+# then the tail of a long tweet, then the tail of the style guide (see prompts.py)
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "1500"))
+
+# VISION_MODE=1 downloads tweet images (IMAGE_HOSTS only, "*" for any) and sends up to
+# VISION_MAX_IMAGES of them, downscaled to VISION_MAX_PX, to the providers' vision models;
+# processed images are kept by content in IMAGE_CACHE_DIR (LRU past IMAGE_CACHE_MAX_MB)
+VISION_MODE = os.getenv("VISION_MODE", "0").strip() == "1"
+VISION_MAX_IMAGES = int(os.getenv("VISION_MAX_IMAGES", "4"))
+VISION_MAX_PX = int(os.getenv("VISION_MAX_PX", "768"))
+IMAGE_HOSTS = [h.strip() for h in os.getenv("IMAGE_HOSTS", "pbs.twimg.com").split(",") if h.strip()]
+IMAGE_FETCH_CONCURRENCY = int(os.getenv("IMAGE_FETCH_CONCURRENCY", "4"))
+IMAGE_FETCH_TIMEOUT = float(os.getenv("IMAGE_FETCH_TIMEOUT", "3"))
+IMAGE_CACHE_DIR = os.getenv("IMAGE_CACHE_DIR", "").strip() or str(Path(__file__).parent / "image_cache")
+IMAGE_CACHE_MAX_MB = float(os.getenv("IMAGE_CACHE_MAX_MB", "200"))
+
+# Replies requested per upstream call; the best by custom_prompt's rules is returned,
+# the rest wait in a per-tweet pool for regenerate clicks; opt-in (1 disables), as each
+# candidate adds 120 max_tokens to the call's rate budget reservation
+REPLY_CANDIDATES = max(1, int(os.getenv("REPLY_CANDIDATES", "1")))
+
+# Near-duplicate tweets reuse a cached reply; opt-in (NEAR_DUP_SIMILARITY > 0 enables it)
+NEAR_DUP_SIMILARITY = float(os.getenv("NEAR_DUP_SIMILARITY", "0"))
+NEAR_DUP_SIZE = int(os.getenv("NEAR_DUP_SIZE", "100000"))
+
+# JSONL journal of /generate calls (JOURNAL_FILE empty disables it); see journal.py
+JOURNAL_FILE = os.getenv("JOURNAL_FILE", "").strip()
+JOURNAL_MAX_BYTES = int(os.getenv("JOURNAL_MAX_BYTES", str(50 * 1024 * 1024)))
+JOURNAL_MAX_AGE = float(os.getenv("JOURNAL_MAX_AGE", "86400"))
+JOURNAL_COMPRESS = os.getenv("JOURNAL_COMPRESS", "1").strip() == "1"
+JOURNAL_FLUSH_INTERVAL = float(os.getenv("JOURNAL_FLUSH_INTERVAL", "1"))
+
+# Requests slower than SLOW_REQUEST_MS are logged with their span breakdown (0 disables it);
+# PROFILING=1 enables POST /debug/profile, a sampling profiler writing to PROFILE_DIR
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "3000"))
+PROFILING = os.getenv("PROFILING", "0").strip() == "1"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "").strip() or str(Path(__file__).parent / "profiles")
+
+# POST /generate/batch limits
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "50"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", str(MAX_INFLIGHT)))
+
+# Background prefetch for visible tweets; opt-in (PREFETCH_REQUESTS_PER_MIN > 0 enables it)
+PREFETCH_MAX_PENDING = int(os.getenv("PREFETCH_MAX_PENDING", "30"))
+PREFETCH_REQUESTS_PER_MIN = int(os.getenv("PREFETCH_REQUESTS_PER_MIN", "0"))
+PREFETCH_TOKENS_PER_MIN = int(os.getenv("PREFETCH_TOKENS_PER_MIN", "10000"))
+
+CONFIG_STORE = ConfigStore(CONFIG_FILE, {"custom_prompt": "", "base_rules": {}, "examples": {}})
+
 def load_config():
-    """Load user configuration from config.json"""
-    if CONFIG_FILE.exists():
-        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    return {"custom_prompt": "", "base_rules": {}, "examples": {}}
+    """Load user configuration from config.json (cached; .version identifies the content)"""
+    return CONFIG_STORE.load()
 
 def save_config(config):
-    """Save user configuration to config.json"""
-    with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-        json.dump(config, f, indent=2, ensure_ascii=False)
+    """Save user configuration to config.json atomically"""
+    return CONFIG_STORE.save(config)
+
+class ServerBusy(Exception):
+    """Raised when the generation queue is full"""
+
+class BadRequest(ValueError):
+    """Invalid client input; answered with 400"""
+
+class GenerationGate:
+    """Bounds concurrent upstream calls and the number of requests waiting for one"""
+
+    def __init__(self, max_inflight, max_queue):
+        self.max_inflight = max(1, max_inflight)
+        self.max_queue = max(0, max_queue)
+        self._slots = threading.BoundedSemaphore(self.max_inflight)
+        self._lock = threading.Lock()
+        self._admitted = 0
+        self.rejected = 0
+
+    @contextmanager
+    def slot(self, deadline=None):
+        """Hold an upstream slot; waiting in the queue stops when the deadline passes or is cancelled"""
+        with self._lock:
+            if self._admitted >= self.max_inflight + self.max_queue:
+                self.rejected += 1
+                raise ServerBusy(f"Server busy: {self._admitted} generation requests in progress, try again shortly")
+            self._admitted += 1
+        try:
+            with span("queue"):
+                if deadline is None:
+                    self._slots.acquire()
+                else:
+                    while not self._slots.acquire(timeout=deadline.timeout(0.1)):
+                        deadline.check("queue")
+            try:
+                yield
+            finally:
+                self._slots.release()
+        finally:
+            with self._lock:
+                self._admitted -= 1
+
+    def stats(self):
+        with self._lock:
+            admitted = self._admitted
+        inflight = min(admitted, self.max_inflight)
+        return {
+            "inflight": inflight,
+            "queued": admitted - inflight,
+            "max_inflight": self.max_inflight,
+            "max_queue": self.max_queue,
+            "rejected": self.rejected,
+        }
+
+    def active(self):
+        """Generation requests currently running or waiting"""
+        with self._lock:
+            return self._admitted
+
+GATE = GenerationGate(MAX_INFLIGHT, MAX_QUEUE)
+UPSTREAM = UpstreamClient(UPSTREAM_POOL_SIZE, UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT)
+SHARED = WORKERS > 1
+RATE_LIMITER = RateLimiter(
+    RATE_LIMIT_RPM, RATE_LIMIT_TPM, MAX_INFLIGHT, RATE_LIMIT_MAX_WAIT,
+    SharedBudget(SHARED_STATE_FILE, RATE_LIMIT_RPM, RATE_LIMIT_TPM) if SHARED else None,
+)
+PROVIDERS = providers_from_env(UPSTREAM, groq_limiter=RATE_LIMITER)
+ROUTER = Router(PROVIDERS, hedge=HEDGE_REQUESTS, hedge_workers=2 * MAX_INFLIGHT)
+REPLY_CACHE = ReplyCache(
+    REPLY_CACHE_SIZE, REPLY_CACHE_TTL, REPLY_CACHE_FILE or (SHARED_STATE_FILE if SHARED else None), shared=SHARED
+)
+CANDIDATES = CandidatePool(REPLY_CACHE_SIZE, REPLY_CACHE_TTL)
+# Identical /generate calls already in flight wait for the same upstream reply
+IN_FLIGHT = SingleFlight()
+NEAR_DUPS = NearDuplicateIndex(NEAR_DUP_SIZE, NEAR_DUP_SIMILARITY) if NEAR_DUP_SIMILARITY > 0 else None
+PROMPTS = PromptCompiler(budget=PROMPT_TOKEN_BUDGET)
+# Image downloads get their own pool so they never hold connections the providers need
+IMAGES = ImageFetcher(
+    ImageStore(IMAGE_CACHE_DIR, int(IMAGE_CACHE_MAX_MB * 1024 * 1024)),
+    UpstreamClient(IMAGE_FETCH_CONCURRENCY, IMAGE_FETCH_TIMEOUT, IMAGE_FETCH_TIMEOUT),
+    max_px=VISION_MAX_PX,
+    concurrency=IMAGE_FETCH_CONCURRENCY,
+    timeout=IMAGE_FETCH_TIMEOUT,
+    allowed_hosts=IMAGE_HOSTS,
+) if VISION_MODE else None
+EXAMPLES = ExampleStore(EXAMPLES_FILE)
+if JOURNAL_FILE and WORKER_ID is not None:
+    # One file per worker: journal.jsonl -> journal.w0.jsonl (replay.py merges them by time)
+    JOURNAL_FILE = str(Path(JOURNAL_FILE).with_suffix(f".w{WORKER_ID}{Path(JOURNAL_FILE).suffix}"))
+JOURNAL = Journal(
+    JOURNAL_FILE, JOURNAL_MAX_BYTES, JOURNAL_MAX_AGE, JOURNAL_COMPRESS, JOURNAL_FLUSH_INTERVAL
+) if JOURNAL_FILE else None
+# Set once SIGTERM arrives: no new connections, responses close keep-alive ones
+DRAINING = threading.Event()
+# Cancels the deadline of a /generate call whose client hangs up
+DISCONNECTS = DisconnectWatcher()
+SLOW_REQUESTS = SlowRequestLog(SLOW_REQUEST_MS)
+PROFILER = SamplingProfiler(PROFILE_DIR if WORKER_ID is None else str(Path(PROFILE_DIR) / f"w{WORKER_ID}"))
+
+# Upstream latency: blocking calls (first token == full reply) vs. streamed ones
+LATENCY = {
+    "blocking_total": LatencyWindow(),
+    "stream_first_token": LatencyWindow(),
+    "stream_total": LatencyWindow(),
+}
+
+# GET /metrics (Prometheus text format); counters kept elsewhere are read at scrape time
+METRICS = Registry()
+HTTP_REQUESTS = METRICS.counter("reply_http_requests_total", "HTTP responses by path and status", ("path", "status"))
+HTTP_IN_FLIGHT = METRICS.gauge("reply_http_requests_in_flight", "HTTP requests being handled")
+STAGE_SECONDS = METRICS.histogram(
+    "reply_generate_stage_seconds",
+    "Generation time by stage: parse, config, examples, prompt, images, upstream, write",
+    ("stage",),
+)
+UPSTREAM_TOKENS = METRICS.counter(
+    "reply_upstream_tokens_total", "Tokens from the upstream usage field", ("provider", "kind")
+)
+METRICS.callback(
+    "reply_upstream_retries_total", "counter", "Upstream calls retried after 429/529",
+    lambda: {p.name: p.retries for p in PROVIDERS}, "provider",
+)
+METRICS.callback(
+    "reply_upstream_throttled_total", "counter", "Upstream 429/529 responses",
+    lambda: {p.name: p.throttled for p in PROVIDERS}, "provider",
+)
+METRICS.callback(
+    "reply_upstream_circuit_open", "gauge", "1 while the provider's circuit breaker is not closed",
+    lambda: {p.name: int(p.breaker.state != "closed") for p in PROVIDERS}, "provider",
+)
+METRICS.callback(
+    "reply_rate_limit_rejected_total", "counter", "Calls refused by the local rate limiter",
+    lambda: RATE_LIMITER.rejected,
+)
+METRICS.callback("reply_generation_in_flight", "gauge", "Generations holding an upstream slot", lambda: GATE.stats()["inflight"])
+METRICS.callback("reply_generation_queued", "gauge", "Generations waiting for an upstream slot", lambda: GATE.stats()["queued"])
+METRICS.callback("reply_generation_rejected_total", "counter", "Generations refused with 503", lambda: GATE.rejected)
+METRICS.callback("reply_cache_hits_total", "counter", "Reply cache hits", lambda: REPLY_CACHE.stats()["hits"])
+METRICS.callback("reply_cache_misses_total", "counter", "Reply cache misses", lambda: REPLY_CACHE.stats()["misses"])
+METRICS.callback("reply_candidates_served_total", "counter", "Regenerates answered from the candidate pool", lambda: CANDIDATES.served)
+DEADLINE_EXCEEDED = METRICS.counter(
+    "reply_deadline_exceeded_total", "Generations that ran out of time, by stage", ("stage",)
+)
+CANCELLED = METRICS.counter(
+    "reply_requests_cancelled_total", "Generations abandoned because the client disconnected, by stage", ("stage",)
+)
+METRICS.callback(
+    "reply_upstream_aborted_total", "counter", "Upstream calls aborted for cancelled requests", lambda: UPSTREAM.aborted
+)
+METRICS.callback(
+    "reply_prompt_trimmed_total", "counter", "Prompts cut to fit PROMPT_TOKEN_BUDGET, by section",
+    lambda: PROMPTS.stats()["trimmed"], "section",
+)
+METRICS.callback(
+    "reply_images_total", "counter", "Tweet images by outcome (url_hit, content_hit, downloaded, failed)",
+    lambda: {
+        "url_hit": IMAGES.url_hits, "content_hit": IMAGES.content_hits,
+        "downloaded": IMAGES.downloads, "failed": IMAGES.failed,
+    } if IMAGES is not None else {},
+    "outcome",
+)
+METRICS.callback(
+    "reply_slow_requests_total", "counter", "Requests slower than SLOW_REQUEST_MS", lambda: SLOW_REQUESTS.slow
+)
+METRICS.callback(
+    "reply_journal_dropped_total", "counter", "Journal entries dropped because the writer fell behind",
+    lambda: JOURNAL.dropped if JOURNAL is not None else 0,
+)
+METRICS_SHARE = SharedMetrics(SHARED_STATE_FILE, WORKER_ID, METRICS) if SHARED and WORKER_ID is not None else None
+METRICS_PATHS = {
+    "/", "/status", "/health", "/config", "/examples", "/metrics", "/generate", "/generate/stream",
+    "/generate/batch", "/prefetch", "/debug/slow", "/debug/profile",
+}
+
+@contextmanager
+def stage(name):
+    """Time a /generate stage for the stage histogram and the request's trace"""
+    with STAGE_SECONDS.time(name), span(name):
+        yield
+
+def pick_examples(tweet_text):
+    """Library examples most similar to the tweet, or None to use config examples.good"""
+    if not len(EXAMPLES):
+        return None
+    with stage("examples"):
+        return EXAMPLES.select(tweet_text, EXAMPLES_TOP_K) or None
+
+def build_prompt(tweet_text, images, tone, config, candidates=1):
+    """Precompiled system message for (config version, tone) plus the tweet as the user message"""
+    return PROMPTS.build(tweet_text, images, tone, config, pick_examples(tweet_text), candidates)
+
+def reply_key(tweet_text, images, tone, config):
+    """Cache key; replies depend on the config and the example library they were built from,
+    and in VISION_MODE on which images the model saw"""
+    image_tag = len(images)
+    if IMAGES is not None and images:
+        image_tag = "\x1e".join([ROUTER.vision_tag] + [str(url) for url in images[:VISION_MAX_IMAGES]])
+    return cache_key(tweet_text, tone, image_tag, ROUTER.model_tag, f"{config.version}.{EXAMPLES.version}")
+
+def load_images(images, deadline=None):
+    """The tweet's images for the model in VISION_MODE (from the image cache or downloaded), else ()"""
+    if IMAGES is None or not images:
+        return ()
+    with stage("images"):
+        return tuple(IMAGES.fetch(images[:VISION_MAX_IMAGES], deadline))
+
+def clean_reply(text):
+    """Strip whitespace and wrapping quotes the model likes to add"""
+    return (text or "").strip().strip('"').strip("'").strip()
+
+def request_reply(prompt, max_tokens=120, deadline=None):
+    """Blocking completion through the provider router; returns a Completion with the cleaned reply"""
+    started = time.perf_counter()
+    with span("upstream"):
+        completion = ROUTER.complete(prompt, max_tokens=max_tokens, temperature=0.9, top_p=0.95, deadline=deadline)
+    elapsed = time.perf_counter() - started
+    LATENCY["blocking_total"].record(elapsed * 1000)
+    STAGE_SECONDS.observe(elapsed, "upstream")
+    for kind in ("prompt", "completion"):
+        tokens = completion.usage.get(f"{kind}_tokens")
+        if tokens:
+            UPSTREAM_TOKENS.inc(completion.provider, kind, amount=tokens)
+    return completion._replace(text=clean_reply(completion.text))
+
+def stream_reply(prompt, deadline=None):
+    """Yield reply text deltas from the best provider's streaming API"""
+    started = time.perf_counter()
+    first = None
+    for delta in ROUTER.stream(prompt, max_tokens=120, temperature=0.9, top_p=0.95, deadline=deadline):
+        if first is None:
+            first = time.perf_counter()
+            LATENCY["stream_first_token"].record((first - started) * 1000)
+        yield delta
+    LATENCY["stream_total"].record((time.perf_counter() - started) * 1000)
+
+def parse_generate_request(data):
+    """Normalize a /generate body (or one batch item) to (tweet_text, images, tone, no_cache)"""
+    tweet_text = (data.get("tweetText") or "").strip()
+    images = data.get("images") or []
+    tone = (data.get("tone") or "bullish").strip()
+    no_cache = bool(data.get("noCache"))
+    return tweet_text, images, tone, no_cache
+
+def request_deadline(headers, data):
+    """Deadline from the X-Deadline-Ms header or the body's deadlineMs, else REQUEST_DEADLINE_MS"""
+    value = headers.get("X-Deadline-Ms") or data.get("deadlineMs") or REQUEST_DEADLINE_MS
+    try:
+        timeout_ms = float(value)
+    except (TypeError, ValueError):
+        raise BadRequest(f"deadlineMs must be a number of milliseconds, got {value!r}")
+    return Deadline(timeout_ms if timeout_ms > 0 else None)
+
+def count_abandoned(error):
+    """Count a DeadlineExceeded or Cancelled by the stage it happened in"""
+    counter = DEADLINE_EXCEEDED if isinstance(error, DeadlineExceeded) else CANCELLED
+    counter.inc(error.stage)
+
+def check_generate_request(tweet_text):
+    if not PROVIDERS:
+        raise Exception("GROQ_API_KEY is not set. Run: export GROQ_API_KEY='...' (or ANTHROPIC_API_KEY / LOCAL_LLM_BASE_URL) and restart server.")
+    if not tweet_text:
+        raise Exception("tweetText is empty")
+
+def fetch_reply(key, tweet_text, images, tone, config, deadline=None, tweet_images=None):
+    """Call the upstream for REPLY_CANDIDATES replies, cache the best and pool the rest;
+    returns (Completion with the best reply as its text, the Prompt sent).
+
+    tweet_images: from load_images, when the caller fetched them already"""
+    if tweet_images is None:
+        tweet_images = load_images(images, deadline)
+    with stage("prompt"):
+        prompt = attach_images(build_prompt(tweet_text, images, tone, config, REPLY_CANDIDATES), tweet_images)
+    completion = request_reply(prompt, max_tokens=min(400, 120 * REPLY_CANDIDATES), deadline=deadline)
+    PROMPTS.record_usage(prompt.estimated_tokens, completion.usage.get("prompt_tokens"))
+    if REPLY_CANDIDATES > 1:
+        ranked = compile_rules(config.get("custom_prompt", "")).rank(split_candidates(completion.text, clean_reply))
+        completion = completion._replace(text=ranked[0] if ranked else "")
+        CANDIDATES.put(key, ranked[1:])
+    remember_reply(key, completion.text, tweet_text)
+    return completion, prompt
+
+def remember_reply(key, reply, tweet_text):
+    REPLY_CACHE.put(key, reply, tweet_text)
+    if NEAR_DUPS is not None:
+        NEAR_DUPS.add(tweet_text)
+
+def cached_reply(key, tweet_text, images, tone, config):
+    """(reply, similarity) from the cache for this tweet or a near-duplicate of it, else (None, None)"""
+    reply = REPLY_CACHE.get(key)
+    if reply is not None or NEAR_DUPS is None:
+        return reply, None
+    for score, earlier in NEAR_DUPS.find(tweet_text):
+        similar_key = reply_key(earlier, images, tone, config)
+        if REPLY_CACHE.contains(similar_key):
+            reply = REPLY_CACHE.get(similar_key)
+            if reply is not None:
+                NEAR_DUPS.record_match()
+                return reply, score
+    return None, None
+
+def degraded_reply(tweet_text):
+    """Closest cached reply for this tweet while the providers are down, or None"""
+    return REPLY_CACHE.closest(tweet_text) if OUTAGE_SERVE_CACHED else None
+
+def generate(tweet_text, images, tone, config=None, no_cache=False, deadline=None):
+    """The /generate pipeline; returns {"reply", "cached", "shared", "usage", "provider"}
+    (plus "pooled" for a spare candidate from an earlier call, "similarity" when a
+    near-duplicate tweet's reply was reused, "degraded" when a stale reply stood
+    in during an outage, and "prompt_hash"/"fetch_ms"/"tokens"/"trimmed"/"images" when it went
+    upstream; images counts those the model was sent).
+
+    deadline bounds the wait for a slot and the upstream call; raises DeadlineExceeded
+    or Cancelled when it passes or the client goes away"""
+    check_generate_request(tweet_text)
+
+    # Load user's custom configuration (batch callers pass one snapshot for all items)
+    if config is None:
+        with stage("config"):
+            config = load_config()
+
+    # Cached replies skip the queue entirely; noCache (regenerate) takes the next pooled
+    # candidate if there is one and only then goes upstream
+    key = reply_key(tweet_text, images, tone, config)
+    if no_cache:
+        reply = CANDIDATES.pop(key)
+        if reply is not None:
+            remember_reply(key, reply, tweet_text)
+            return {"reply": reply, "cached": False, "pooled": True, "shared": False, "usage": {}, "provider": None}
+    else:
+        with span("cache"):
+            reply, similarity = cached_reply(key, tweet_text, images, tone, config)
+        if reply is not None:
+            result = {"reply": reply, "cached": True, "shared": False, "usage": {}, "provider": None}
+            if similarity is not None:
+                result["similarity"] = round(similarity, 3)
+            return result
+
+    def gated_fetch(flight):
+        # Images are fetched before taking a slot, so downloads never hold one
+        tweet_images = load_images(images, flight)
+        with GATE.slot(flight):
+            return fetch_reply(key, tweet_text, images, tone, config, flight, tweet_images)
+
+    started = time.perf_counter()
+    try:
+        (completion, prompt), shared = IN_FLIGHT.do(key, gated_fetch, deadline)
+    except CircuitOpen:
+        reply = degraded_reply(tweet_text)
+        if reply is None:
+            raise
+        return {"reply": reply, "cached": True, "degraded": True, "shared": False, "usage": {}, "provider": None}
+    return {
+        "reply": completion.text,
+        "cached": False,
+        "shared": shared,
+        "usage": {} if shared else completion.usage,
+        "provider": completion.provider,
+        "prompt_hash": prompt_hash(prompt),
+        "fetch_ms": round((time.perf_counter() - started) * 1000, 1),
+        # Actual counts are those of the upstream call, also when it was shared
+        "tokens": token_counts(prompt, completion.usage),
+        "trimmed": list(prompt.trimmed),
+        "images": len(prompt.images),
+    }
+
+def token_counts(prompt, usage=None):
+    """Estimated and (when the provider reported them) actual token counts of one call"""
+    usage = usage or {}
+    return {
+        "estimated": prompt.estimated_tokens,
+        "prompt": usage.get("prompt_tokens"),
+        "completion": usage.get("completion_tokens"),
+    }
+
+def prefetch_key(item, config):
+    tweet_text, images, tone, _ = parse_generate_request(item)
+    return reply_key(tweet_text, images, tone, config)
+
+def prefetch_reply(item):
+    """Fill the reply cache for one visible tweet; returns tokens spent, None if nothing to do.
+
+    Runs outside the generation gate so it never takes a slot from a user click;
+    a click on the same tweet joins this call through single-flight instead.
+    """
+    tweet_text, images, tone, _ = parse_generate_request(item)
+    config = load_config()
+    key = prefetch_key(item, config)
+    if REPLY_CACHE.contains(key):
+        return None
+    (completion, _), shared = IN_FLIGHT.do(key, lambda flight: fetch_reply(key, tweet_text, images, tone, config, flight))
+    if shared:
+        return None
+    usage = completion.usage
+    return usage.get("total_tokens") or (usage.get("prompt_tokens", 0) + usage.get("completion_tokens", 0))
+
+PREFETCH = PrefetchQueue(
+    prefetch_reply,
+    lambda: GATE.active() > 0,
+    PREFETCH_MAX_PENDING,
+    PREFETCH_REQUESTS_PER_MIN,
+    PREFETCH_TOKENS_PER_MIN,
+)
+
+def journal_call(endpoint, request, started, status, result=None, error=None):
+    """Queue one /generate call for the journal; a no-op unless JOURNAL_FILE is set"""
+    if JOURNAL is None:
+        return
+    tweet_text, images, tone, no_cache = request
+    entry = {
+        "ts": round(time.time(), 3),
+        "endpoint": endpoint,
+        "tweetText": tweet_text,
+        "images": images,
+        "tone": tone,
+        "noCache": no_cache,
+        "status": status,
+        "total_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+    trace = current_trace()
+    if trace is not None:
+        entry["trace_id"] = trace.trace_id
+        entry["stages"] = trace.breakdown()
+    if result is not None:
+        entry.update({
+            "reply": result.get("reply"),
+            "provider": result.get("provider"),
+            "prompt_hash": result.get("prompt_hash"),
+            "fetch_ms": result.get("fetch_ms"),
+            "usage": result.get("usage") or {},
+            "estimated_tokens": (result.get("tokens") or {}).get("estimated"),
+            "trimmed": result.get("trimmed") or [],
+            "images_sent": result.get("images") or 0,
+            "cached": bool(result.get("cached")),
+            "pooled": bool(result.get("pooled")),
+            "shared": bool(result.get("shared")),
+        })
+    if error is not None:
+        entry["error"] = str(error)
+    JOURNAL.record(entry)
+
+def error_status(error):
+    """The status /generate answers a failure with, for journaling calls that have none"""
+    if isinstance(error, DeadlineExceeded):
+        return 504
+    if isinstance(error, Cancelled):
+        return 499
+    if isinstance(error, (ServerBusy, RateLimited, CircuitOpen)):
+        return 503
+    if isinstance(error, BadRequest):
+        return 400
+    return 500
+
+def generate_batch(items, on_result):
+    """Generate replies for items against one config snapshot with bounded fan-out.
+
+    on_result(result) is called from the caller's thread as each item completes;
+    a failing item yields {"success": False, "error": ...} instead of failing the batch.
+    An exception from on_result itself (the client went away) cancels the items not
+    started yet and is raised once the running ones finish.
+    Every item is journaled as a /generate/batch call under the batch's trace.
+    """
+    config = load_config()
+
+    def run(item):
+        started = time.perf_counter()
+        request = ("", [], "", False)
+        try:
+            if not isinstance(item, dict):
+                raise BadRequest("batch item must be an object")
+            request = tweet_text, images, tone, no_cache = parse_generate_request(item)
+            result = generate(tweet_text, images, tone, config, no_cache)
+        except Exception as e:
+            journal_call("/generate/batch", request, started, error_status(e), error=e)
+            raise
+        journal_call("/generate/batch", request, started, 200, result)
+        return result["reply"]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(BATCH_CONCURRENCY, len(items)))) as pool:
+        futures = {pool.submit(bind(run), item): index for index, item in enumerate(items)}
+        for future in as_completed(futures):
+            index = futures[future]
+            try:
+                result = {"index": index, "success": True, "reply": future.result()}
+            except Exception as e:
+                result = {"index": index, "success": False, "error": str(e)}
+            try:
+                on_result(result)
+            except BaseException:
+                for pending in futures:
+                    pending.cancel()
+                raise
+
+def pick_encoding(accept_encoding):
+    """Choose the best response encoding the client accepts: br, gzip or None"""
+    accepted = set()
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        accepted.add(name.strip().lower())
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+def compress_body(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=5)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=6)
+    return body
 
 class ReplyGeneratorHandler(BaseHTTPRequestHandler):
+    # Keep-alive: every response carries Content-Length, idle sockets close after KEEPALIVE_TIMEOUT
+    protocol_version = "HTTP/1.1"
+    timeout = KEEPALIVE_TIMEOUT
+    # Headers and body go out in separate writes; with Nagle on, keep-alive
+    # clients wait out a delayed ACK (~40 ms) on every small response
+    disable_nagle_algorithm = True
+
     def _set_cors_headers(self):
         self.send_header("Access-Control-Allow-Origin", "*")
         self.send_header("Access-Control-Allow-Methods", "GET, POST, OPTIONS, PUT")
-        self.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization")
-        self.send_header("Access-Control-Max-Age", "3600")
+        self.send_header("Access-Control-Allow-Headers", "Content-Type, Authorization, X-Deadline-Ms, X-Trace-Id")
+        self.send_header("Access-Control-Expose-Headers", "X-Trace-Id, Server-Timing")
+        # Chrome caps preflight caching at 2 hours
+        self.send_header("Access-Control-Max-Age", "7200")
 
-    def do_OPTIONS(self):
+    def _read_body(self):
+        content_length = int(self.headers.get("Content-Length", 0))
+        return self.rfile.read(content_length) if content_length > 0 else b""
+
+    def _send_body(self, status, body, content_type=None, headers=None):
+        encoding = None
+        if content_type and len(body) >= COMPRESS_MIN_BYTES:
+            encoding = pick_encoding(self.headers.get("Accept-Encoding"))
+            if encoding:
+                body = compress_body(body, encoding)
+
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+            self.send_header("Vary", "Accept-Encoding")
+        if encoding:
+            self.send_header("Content-Encoding", encoding)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self._set_cors_headers()
+        self.end_headers()
+        if body:
+            self.wfile.write(body)
+
+    def _send_json(self, status, obj, headers=None):
+        self._send_body(status, json.dumps(obj).encode("utf-8"), "application/json", headers)
+
+    def _send_busy(self, error):
+        retry_after = math.ceil(getattr(error, "retry_after", 2))
+        self._send_json(503, {"success": False, "error": str(error)}, {"Retry-After": str(retry_after)})
+
+    def _start_chunked(self, content_type):
+        # HTTP/1.0 clients cannot decode chunked bodies; they get one ended by closing the connection
+        self._chunked = self.request_version != "HTTP/1.0"
         self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Cache-Control", "no-cache")
+        if self._chunked:
+            self.send_header("Transfer-Encoding", "chunked")
+        else:
+            if not DRAINING.is_set():
+                self.send_header("Connection", "close")
+            self.close_connection = True
         self._set_cors_headers()
         self.end_headers()
 
+    def _write_chunk(self, data):
+        if self._chunked:
+            data = b"%x\r\n%s\r\n" % (len(data), data)
+        self.wfile.write(data)
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        if self._chunked:
+            self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    def do_OPTIONS(self):
+        self._send_body(200, b"")
+
+    def send_response(self, code, message=None):
+        path = getattr(self, "path", "").split("?", 1)[0]
+        HTTP_REQUESTS.inc(path if path in METRICS_PATHS else "other", str(code))
+        super().send_response(code, message)
+        if DRAINING.is_set():
+            self.send_header("Connection", "close")
+        trace = current_trace()
+        if trace is not None:
+            self.send_header("X-Trace-Id", trace.trace_id)
+            timing = trace.server_timing()
+            if timing:
+                self.send_header("Server-Timing", timing)
+
     def do_GET(self):
+        with HTTP_IN_FLIGHT.track():
+            self.handle_get()
+
+    def do_POST(self):
+        # Every POST is traced (X-Trace-Id from the client is kept) and sampled while profiling
+        trace = Trace(self.headers.get("X-Trace-Id"), f"POST {self.path}")
+        with HTTP_IN_FLIGHT.track(), PROFILER.sampled(), activate(trace):
+            self.handle_post()
+        SLOW_REQUESTS.observe(trace)
+
+    def handle_get(self):
         if self.path in ("/", "/status"):
-            self.send_response(200)
-            self.send_header("Content-Type", "text/html; charset=utf-8")
-            self._set_cors_headers()
-            self.end_headers()
-            self.wfile.write(self.get_settings_page().encode("utf-8"))
+            self._send_body(200, self.get_settings_page().encode("utf-8"), "text/html; charset=utf-8")
             return
 
         if self.path == "/health":
-            ok = bool(GROQ_API_KEY)
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self._set_cors_headers()
-            self.end_headers()
-            self.wfile.write(json.dumps({
+            ok = bool(PROVIDERS)
+            self._send_json(200, {
                 "status": "ok" if ok else "error",
                 "message": "Server is running",
-                "provider": "groq",
-                "model": GROQ_MODEL,
-                "api_key": "set" if ok else "missing"
-            }).encode("utf-8"))
+                "provider": ",".join(p.name for p in PROVIDERS) or "none",
+                "model": ",".join(p.model for p in PROVIDERS) or GROQ_MODEL,
+                "api_key": "set" if ok else "missing",
+                "router": ROUTER.stats(),
+                "generation": GATE.stats(),
+                "upstream": UPSTREAM.stats(),
+                "cache": REPLY_CACHE.stats(),
+                "single_flight": IN_FLIGHT.stats(),
+                "prompts": PROMPTS.stats(),
+                "images": dict(max_images=VISION_MAX_IMAGES, **IMAGES.stats()) if IMAGES is not None else None,
+                "examples": EXAMPLES.stats(),
+                "near_duplicates": NEAR_DUPS.stats() if NEAR_DUPS is not None else None,
+                "candidates": dict(per_call=REPLY_CANDIDATES, **CANDIDATES.stats()),
+                "latency": {name: window.snapshot() for name, window in LATENCY.items()},
+                "prefetch": PREFETCH.stats(),
+                "rate_limit": RATE_LIMITER.stats(),
+                "journal": JOURNAL.stats() if JOURNAL is not None else None,
+                "tracing": dict(profiling=PROFILING, profiler=PROFILER.stats(), **SLOW_REQUESTS.stats()),
+                "deadlines": {
+                    "default_ms": REQUEST_DEADLINE_MS or None,
+                    "exceeded": {stage: n for (stage,), n in DEADLINE_EXCEEDED.values().items()},
+                    "cancelled": {stage: n for (stage,), n in CANCELLED.values().items()},
+                    "disconnects": DISCONNECTS.stats(),
+                },
+                "worker": {"id": WORKER_ID, "pid": os.getpid(), "workers": WORKERS, "draining": DRAINING.is_set()},
+            })
+            return
+
+        if self.path == "/metrics":
+            rendered = METRICS_SHARE.render() if METRICS_SHARE is not None else METRICS.render()
+            self._send_body(200, rendered.encode("utf-8"), "text/plain; version=0.0.4; charset=utf-8")
+            return
+
+        if self.path == "/examples":
+            self._send_json(200, {"examples": EXAMPLES.examples(), "version": EXAMPLES.version})
+            return
+
+        if self.path == "/debug/slow":
+            self._send_json(200, dict(recent=SLOW_REQUESTS.recent(), **SLOW_REQUESTS.stats()))
+            return
+
+        if self.path == "/debug/profile" and PROFILING:
+            self._send_json(200, dict(last=PROFILER.last, **PROFILER.stats()))
             return
 
         if self.path == "/config":
             # Get current config
             config = load_config()
-            self.send_response(200)
-            self.send_header("Content-Type", "application/json")
-            self._set_cors_headers()
-            self.end_headers()
-            self.wfile.write(json.dumps(config).encode("utf-8"))
+            self._send_json(200, config, {"X-Config-Version": config.version})
             return
 
-        self.send_response(404)
-        self._set_cors_headers()
-        self.end_headers()
+        self._send_body(404, b"")
 
-    def do_POST(self):
+    def handle_post(self):
         if self.path == "/generate":
+            started = time.perf_counter()
+            request = ("", [], "", False)
             try:
-                content_length = int(self.headers.get("Content-Length", 0))
-                data = json.loads(self.rfile.read(content_length).decode("utf-8"))
-
-                tweet_text = (data.get("tweetText") or "").strip()
-                images = data.get("images") or []
-                tone = (data.get("tone") or "bullish").strip()
+                with stage("parse"):
+                    data = json.loads(self._read_body().decode("utf-8"))
+                    request = tweet_text, images, tone, no_cache = parse_generate_request(data)
+                    deadline = request_deadline(self.headers, data)
 
-                reply = self.generate_reply(tweet_text, images, tone)
+                with DISCONNECTS.watch(self.connection, deadline):
+                    result = generate(tweet_text, images, tone, no_cache=no_cache, deadline=deadline)
+                if deadline.cancelled():
+                    # Served by a call other clients were still waiting for
+                    raise Cancelled("write", deadline.reason)
 
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self._set_cors_headers()
-                self.end_headers()
-                self.wfile.write(json.dumps({"success": True, "reply": reply}).encode("utf-8"))
+                response = {"success": True, "reply": result["reply"], "cached": result["cached"]}
+                if result.get("pooled"):
+                    response["pooled"] = True
+                if "similarity" in result:
+                    response["nearDuplicate"] = result["similarity"]
+                if result.get("degraded"):
+                    response["degraded"] = True
+                if "tokens" in result:
+                    response["tokens"] = result["tokens"]
+                if result.get("trimmed"):
+                    response["trimmed"] = result["trimmed"]
+                if result.get("images"):
+                    response["images"] = result["images"]
+                with stage("write"):
+                    self._send_json(200, response)
+                journal_call("/generate", request, started, 200, result)
+            except DeadlineExceeded as e:
+                count_abandoned(e)
+                self._send_json(504, {"success": False, "error": str(e)})
+                journal_call("/generate", request, started, 504, error=e)
+            except Cancelled as e:
+                # Nobody to answer; 499 (client closed request) in the journal
+                count_abandoned(e)
+                self.close_connection = True
+                journal_call("/generate", request, started, 499, error=e)
+            except (ServerBusy, RateLimited, CircuitOpen) as e:
+                self._send_busy(e)
+                journal_call("/generate", request, started, 503, error=e)
+            except BadRequest as e:
+                self._send_json(400, {"success": False, "error": str(e)})
+                journal_call("/generate", request, started, 400, error=e)
             except Exception as e:
-                self.send_response(500)
-                self.send_header("Content-Type", "application/json")
-                self._set_cors_headers()
-                self.end_headers()
-                self.wfile.write(json.dumps({"success": False, "error": str(e)}).encode("utf-8"))
+                self._send_json(500, {"success": False, "error": str(e)})
+                journal_call("/generate", request, started, 500, error=e)
             return
 
-        if self.path == "/config":
-            # Update config
+        if self.path == "/generate/stream":
+            self.handle_generate_stream()
+            return
+
+        if self.path == "/generate/batch":
             try:
-                content_length = int(self.headers.get("Content-Length", 0))
-                new_config = json.loads(self.rfile.read(content_length).decode("utf-8"))
-                
-                save_config(new_config)
-                
-                self.send_response(200)
-                self.send_header("Content-Type", "application/json")
-                self._set_cors_headers()
-                self.end_headers()
-                self.wfile.write(json.dumps({"success": True, "message": "Config saved"}).encode("utf-8"))
+                data = json.loads(self._read_body().decode("utf-8"))
+                items = data.get("items")
+                if not isinstance(items, list) or not items:
+                    raise ValueError("items must be a non-empty list")
+                if len(items) > BATCH_MAX_ITEMS:
+                    raise ValueError(f"too many items: {len(items)} > {BATCH_MAX_ITEMS}")
             except Exception as e:
-                self.send_response(500)
-                self.send_header("Content-Type", "application/json")
-                self._set_cors_headers()
-                self.end_headers()
-                self.wfile.write(json.dumps({"success": False, "error": str(e)}).encode("utf-8"))
+                self._send_json(400, {"success": False, "error": str(e)})
+                return
+
+            if data.get("stream"):
+                # One JSON line per item, in completion order
+                self._start_chunked("application/x-ndjson")
+                try:
+                    generate_batch(items, lambda result: self._write_chunk(json.dumps(result).encode("utf-8") + b"\n"))
+                    self._end_chunked()
+                except (BrokenPipeError, ConnectionResetError):
+                    # The client went away; items not started yet were dropped
+                    self.close_connection = True
+                return
+
+            results = [None] * len(items)
+            def collect(result):
+                results[result["index"]] = result
+            generate_batch(items, collect)
+            self._send_json(200, {"success": True, "results": results})
             return
 
-        self.send_response(404)
-        self._set_cors_headers()
-        self.end_headers()
+        if self.path == "/prefetch":
+            # Replaces the pending queue: tweets missing from this list scrolled away
+            try:
+                data = json.loads(self._read_body().decode("utf-8"))
+                items = data.get("items")
+                if not isinstance(items, list):
+                    raise ValueError("items must be a list")
+            except Exception as e:
+                self._send_json(400, {"success": False, "error": str(e)})
+                return
 
-    def generate_reply(self, tweet_text, images, tone):
-        if not GROQ_API_KEY:
-            raise Exception("GROQ_API_KEY is not set. Run: export GROQ_API_KEY='...' and restart server.")
-        if not tweet_text:
-            raise Exception("tweetText is empty")
+            if not PREFETCH.enabled or not PROVIDERS:
+                self._send_json(200, {"success": True, "queued": 0, "cached": 0})
+                return
 
-        # Load user's custom configuration
-        config = load_config()
-        custom_prompt = config.get("custom_prompt", "")
+            config = load_config()
+            entries = []
+            cached = 0
+            for item in items:
+                if not isinstance(item, dict) or not (item.get("tweetText") or "").strip():
+                    continue
+                key = prefetch_key(item, config)
+                if REPLY_CACHE.contains(key):
+                    cached += 1
+                else:
+                    entries.append((key, item))
+            queued = PREFETCH.replace(entries)
+            self._send_json(200, {"success": True, "queued": queued, "cached": cached})
+            return
+
+        if self.path == "/debug/profile" and PROFILING:
+            # {"seconds": 30, "intervalMs": 5} opens a profiling window; {"stop": true} ends it early
+            try:
+                data = json.loads(self._read_body().decode("utf-8") or "{}")
+                seconds = float(data.get("seconds", 30))
+                interval = float(data.get("intervalMs", 5)) / 1000
+            except Exception as e:
+                self._send_json(400, {"success": False, "error": str(e)})
+                return
+            if data.get("stop"):
+                PROFILER.stop()
+                self._send_json(200, dict(success=True, last=PROFILER.last, **PROFILER.stats()))
+            elif PROFILER.start(seconds, interval):
+                self._send_json(202, dict(success=True, **PROFILER.stats()))
+            else:
+                self._send_json(409, dict(success=False, error="A profile is already running", **PROFILER.stats()))
+            return
 
-        # Build the prompt with user's custom instructions
-        prompt = f"""You are an expert at crafting viral X (Twitter) replies for crypto and Polymarket content.
+        if self.path == "/examples":
+            # Replace the library (or extend it with "append": true); indexing happens here
+            try:
+                data = json.loads(self._read_body().decode("utf-8"))
+                examples = data.get("examples")
+                if not isinstance(examples, list):
+                    raise ValueError("examples must be a list")
+            except Exception as e:
+                self._send_json(400, {"success": False, "error": str(e)})
+                return
+            try:
+                if data.get("append"):
+                    examples = EXAMPLES.examples() + examples
+                version = EXAMPLES.save(examples)
+                self._send_json(200, {"success": True, "count": len(EXAMPLES), "version": version})
+            except Exception as e:
+                self._send_json(500, {"success": False, "error": str(e)})
+            return
 
-TWEET TO REPLY TO:
-"{tweet_text}"
-"""
-        if images:
-            prompt += f"\nThe tweet contains {len(images)} image(s). Consider visual context."
+        if self.path == "/config":
+            # Update config
+            try:
+                new_config = json.loads(self._read_body().decode("utf-8"))
 
-        prompt += f"\n\nTONE: {tone}\n\n"
+                saved = save_config(new_config)
 
-        # Add user's custom prompt if exists
-        if custom_prompt:
-            prompt += f"USER'S STYLE GUIDELINES:\n{custom_prompt}\n\n"
+                self._send_json(200, {"success": True, "message": "Config saved", "version": saved.version})
+            except Exception as e:
+                self._send_json(500, {"success": False, "error": str(e)})
+            return
 
-        # Add examples if provided
-        examples = config.get("examples", {}).get("good", [])
-        if examples:
-            prompt += "EXAMPLES OF GOOD REPLIES:\n"
-            for ex in examples[:3]:  # Limit to 3 examples
-                prompt += f"Tweet: \"{ex.get('tweet', '')}\"\nReply: \"{ex.get('reply', '')}\"\n\n"
+        # Drain the body so the connection stays usable for the next request
+        self._read_body()
+        self._send_body(404, b"")
 
-        prompt += "Generate ONE perfect reply following the style guidelines above. Return ONLY the reply text, nothing else."
+    def _send_event(self, event, obj):
+        self._write_chunk(f"event: {event}\ndata: {json.dumps(obj)}\n\n".encode("utf-8"))
 
-        url = f"{GROQ_BASE_URL}/chat/completions"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Bearer {GROQ_API_KEY}",
-        }
-        payload = {
-            "model": GROQ_MODEL,
-            "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.9,
-            "max_tokens": 120,
-            "top_p": 0.95,
-        }
+    def handle_generate_stream(self):
+        """/generate as Server-Sent Events: token events, then done with the cleaned reply"""
+        started = time.perf_counter()
+        outcome = {"request": ("", [], "", False), "status": 500}
+        try:
+            self._generate_stream(started, outcome)
+        finally:
+            journal_call("/generate/stream", outcome.pop("request"), started, **outcome)
 
-        # Simple retry for 429 rate limits
-        last_text = None
-        for attempt in range(3):
-            r = requests.post(url, headers=headers, json=payload, timeout=30)
-            last_text = r.text
-            if r.status_code == 200:
-                j = r.json()
-                reply = (j["choices"][0]["message"]["content"] or "").strip()
-                return reply.strip('"').strip("'").strip()
-
-            if r.status_code == 429:
-                time.sleep(2.0 * (attempt + 1))
-                continue
+    def _generate_stream(self, started, outcome):
+        """outcome collects the request, status and result or error for the journal"""
+        try:
+            with stage("parse"):
+                data = json.loads(self._read_body().decode("utf-8"))
+                outcome["request"] = tweet_text, images, tone, no_cache = parse_generate_request(data)
+                deadline = request_deadline(self.headers, data)
+            check_generate_request(tweet_text)
 
-            raise Exception(f"Groq API Error: {r.status_code} - {r.text}")
+            with stage("config"):
+                config = load_config()
+            key = reply_key(tweet_text, images, tone, config)
+            if no_cache:
+                reply, similarity = CANDIDATES.pop(key), None
+                if reply is not None:
+                    remember_reply(key, reply, tweet_text)
+            else:
+                with span("cache"):
+                    reply, similarity = cached_reply(key, tweet_text, images, tone, config)
+            if reply is not None:
+                done = {"success": True, "reply": reply, "cached": not no_cache}
+                if no_cache:
+                    done["pooled"] = True
+                if similarity is not None:
+                    done["nearDuplicate"] = round(similarity, 3)
+                self._start_chunked("text/event-stream")
+                self._send_event("token", {"text": reply})
+                self._send_event("done", done)
+                self._end_chunked()
+                outcome.update(status=200, result=done)
+                return
 
-        raise Exception(f"Groq API Error: 429 - {last_text}")
+            tweet_images = load_images(images, deadline)
+            with DISCONNECTS.watch(self.connection, deadline), GATE.slot(deadline):
+                # Errors before the first token still get a plain JSON error response
+                with stage("prompt"):
+                    prompt = attach_images(build_prompt(tweet_text, images, tone, config), tweet_images)
+                deltas = stream_reply(prompt, deadline)
+                with span("first_token"):
+                    first = next(deltas, "")
+                self._start_chunked("text/event-stream")
+                outcome["status"] = 200
+                try:
+                    parts = [first]
+                    if first:
+                        self._send_event("token", {"text": first})
+                    with span("stream"):
+                        for delta in deltas:
+                            parts.append(delta)
+                            self._send_event("token", {"text": delta})
+                    reply = clean_reply("".join(parts))
+                    remember_reply(key, reply, tweet_text)
+                    total_ms = round((time.perf_counter() - started) * 1000, 1)
+                    # Streams carry no usage, so only the estimate is known
+                    tokens = token_counts(prompt)
+                    done = {"success": True, "reply": reply, "cached": False, "total_ms": total_ms, "tokens": tokens}
+                    if prompt.trimmed:
+                        done["trimmed"] = list(prompt.trimmed)
+                    if prompt.images:
+                        done["images"] = len(prompt.images)
+                    self._send_event("done", done)
+                    outcome["result"] = {
+                        "reply": reply,
+                        "prompt_hash": prompt_hash(prompt),
+                        "fetch_ms": total_ms,
+                        "tokens": tokens,
+                        "trimmed": list(prompt.trimmed),
+                        "images": len(prompt.images),
+                    }
+                except (BrokenPipeError, ConnectionResetError):
+                    outcome["error"] = "client disconnected"
+                    return
+                except Cancelled as e:
+                    count_abandoned(e)
+                    outcome.update(status=499, error=e)
+                    self.close_connection = True
+                    return
+                except Exception as e:
+                    if isinstance(e, DeadlineExceeded):
+                        count_abandoned(e)
+                    outcome["error"] = e
+                    self._send_event("error", {"success": False, "error": str(e)})
+                self._end_chunked()
+        except CircuitOpen as e:
+            reply = degraded_reply(tweet_text)
+            if reply is None:
+                self._send_busy(e)
+                outcome.update(status=503, error=e)
+                return
+            self._start_chunked("text/event-stream")
+            self._send_event("token", {"text": reply})
+            self._send_event("done", {"success": True, "reply": reply, "cached": True, "degraded": True})
+            self._end_chunked()
+            outcome.update(status=200, result={"reply": reply, "cached": True})
+        except DeadlineExceeded as e:
+            count_abandoned(e)
+            self._send_json(504, {"success": False, "error": str(e)})
+            outcome.update(status=504, error=e)
+        except Cancelled as e:
+            count_abandoned(e)
+            self.close_connection = True
+            outcome.update(status=499, error=e)
+        except (ServerBusy, RateLimited) as e:
+            self._send_busy(e)
+            outcome.update(status=503, error=e)
+        except BadRequest as e:
+            self._send_json(400, {"success": False, "error": str(e)})
+            outcome.update(status=400, error=e)
+        except Exception as e:
+            self._send_json(500, {"success": False, "error": str(e)})
+            outcome["error"] = e
 
     def get_settings_page(self):
         config = load_config()
@@ -376,10 +1307,10 @@ TWEET TO REPLY TO:
         <div class="card">
             <h2>📊 Статус Сервера</h2>
             <div style="background: rgba(255,255,255,0.05); padding: 15px; border-radius: 10px;">
-                <p><strong>Провайдер:</strong> Groq</p>
-                <p><strong>Модель:</strong> {GROQ_MODEL}</p>
+                <p><strong>Провайдер:</strong> {", ".join(p.label for p in PROVIDERS) or "—"}</p>
+                <p><strong>Модель:</strong> {", ".join(p.model for p in PROVIDERS) or GROQ_MODEL}</p>
                 <p><strong>URL:</strong> http://localhost:{PORT}</p>
-                <p><strong>API Key:</strong> {"✅ Установлен" if GROQ_API_KEY else "❌ Не установлен"}</p>
+                <p><strong>API Key:</strong> {"✅ Установлен" if PROVIDERS else "❌ Не установлен"}</p>
             </div>
         </div>
     </div>
@@ -431,17 +1362,82 @@ TWEET TO REPLY TO:
     def log_message(self, format, *args):
         return
 
-def run_server():
+class ReplyHTTPServer(ThreadingHTTPServer):
+    """ThreadingHTTPServer that can share its port with other worker processes"""
+
+    reuse_port = False
+
+    def server_bind(self):
+        if self.reuse_port:
+            self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        super().server_bind()
+
+def print_banner():
     print("=" * 60)
     print("✨ X Reply Generator Server")
     print("=" * 60)
     print(f"\n🚀 Server: http://localhost:{PORT}")
     print(f"⚙️  Settings: http://localhost:{PORT}/")
-    print(f"🤖 Model: {GROQ_MODEL}")
+    for provider in PROVIDERS:
+        print(f"🤖 Model: {provider.model} ({provider.label})")
+    if not PROVIDERS:
+        print("⚠️  No provider configured: export GROQ_API_KEY='...'")
+    print(f"🧵 Generation: {GATE.max_inflight} in flight, {GATE.max_queue} queued")
+    if WORKERS > 1:
+        print(f"👷 Workers: {WORKERS}, shared state in {SHARED_STATE_FILE}")
+    if JOURNAL is not None:
+        print(f"📓 Journal: {JOURNAL.path}")
     print(f"\n💡 Открой http://localhost:{PORT} чтобы настроить свой стиль!")
     print(f"🛑 Press Ctrl+C to stop\n")
     print("=" * 60)
-    HTTPServer(("", PORT), ReplyGeneratorHandler).serve_forever()
+
+def drain(server):
+    """Stop accepting, then wait up to DRAIN_TIMEOUT for requests already being handled"""
+    DRAINING.set()
+    if METRICS_SHARE is not None:
+        METRICS_SHARE.stop()
+    server.shutdown()
+    server.server_close()
+    deadline = time.monotonic() + DRAIN_TIMEOUT
+    while HTTP_IN_FLIGHT.value > 0 and time.monotonic() < deadline:
+        time.sleep(0.05)
+    if HTTP_IN_FLIGHT.value > 0:
+        print(f"⚠️  Drain timeout: {HTTP_IN_FLIGHT.value} requests still running")
+
+def run_server():
+    if WORKER_ID is None:
+        print_banner()
+    else:
+        print(f"👷 Worker {WORKER_ID} (pid {os.getpid()}) serving on :{PORT}")
+    server = ReplyHTTPServer(("", PORT), ReplyGeneratorHandler, bind_and_activate=False)
+    server.reuse_port = WORKER_ID is not None
+    server.server_bind()
+    server.server_activate()
+    # shutdown() blocks until serve_forever() returns, so it cannot run in the signal handler's thread
+    drainer = threading.Thread(target=drain, args=(server,), name="drain")
+
+    def start_drain(*_):
+        if drainer.ident is None:
+            drainer.start()
+
+    signal.signal(signal.SIGTERM, start_drain)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        start_drain()
+    finally:
+        if drainer.ident is not None:
+            drainer.join()
+        if JOURNAL is not None:
+            JOURNAL.close()
 
 if __name__ == "__main__":
+    if sys.argv[1:2] == ["bulk"]:
+        # python3 python-server.py bulk tweets.jsonl --out replies.jsonl (see bulk.py)
+        sys.exit(bulk.main(
+            sys.argv[2:], generate, load_config, (ServerBusy, RateLimited, CircuitOpen), GATE.max_inflight
+        ))
+    if WORKERS > 1 and WORKER_ID is None:
+        print_banner()
+        sys.exit(run_supervisor(__file__, WORKERS, DRAIN_TIMEOUT))
     run_server()
\ No newline at end of file
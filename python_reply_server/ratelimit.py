@@ -0,0 +1,335 @@
+import random
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+from tracing import span
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+
+
+class RateLimited(Exception):
+    """Raised when the upstream budget will not allow a call within the caller's wait limit"""
+
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def parse_duration(value):
+    """Parse rate-limit reset values like '7.66s', '2m59.56s', '120ms' or '30' (seconds)"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    total = 0.0
+    matched = False
+    for number, unit in _DURATION_PART.findall(value):
+        matched = True
+        total += float(number) * {"h": 3600, "m": 60, "s": 1, "ms": 0.001}[unit]
+    return total if matched else None
+
+
+def _header_int(headers, name):
+    try:
+        return int(float(headers.get(name)))
+    except (TypeError, ValueError):
+        return None
+
+
+class _Bucket:
+    """Per-minute token bucket whose level the provider's headers can lower"""
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+        self.empty_until = 0.0
+
+    @property
+    def rate(self):
+        return self.capacity / 60.0
+
+    def refill(self, now):
+        if now >= self.empty_until:
+            self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_for(self, amount, now):
+        if now < self.empty_until:
+            return self.empty_until - now
+        missing = min(amount, self.capacity) - self.level
+        return 0.0 if missing <= 0 else missing / self.rate
+
+    def observe(self, remaining, reset, now, limit=None):
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None:
+            self.level = min(self.level, float(remaining))
+            if remaining <= 0 and reset:
+                self.empty_until = max(self.empty_until, now + reset)
+
+
+class SharedBudget:
+    """The request/token buckets kept in SQLite so every worker process spends one budget.
+
+    Each take() is a single BEGIN IMMEDIATE transaction: refill, check and spend both
+    buckets atomically across processes. Times are wall-clock since monotonic clocks
+    are per process.
+    """
+
+    def __init__(self, path, requests_per_min, tokens_per_min):
+        self._db = sqlite3.connect(str(path), timeout=10, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS rate_budget ("
+            "name TEXT PRIMARY KEY, capacity REAL NOT NULL, level REAL NOT NULL, "
+            "updated REAL NOT NULL, empty_until REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+        now = time.time()
+        with self._transaction():
+            for name, per_minute in (("requests", requests_per_min), ("tokens", tokens_per_min), ("blocked", 0)):
+                # The first worker creates the rows; later ones keep what is left of the budget
+                self._db.execute(
+                    "INSERT INTO rate_budget VALUES (?, ?, ?, ?, 0) "
+                    "ON CONFLICT(name) DO UPDATE SET capacity = excluded.capacity",
+                    (name, per_minute, per_minute, now),
+                )
+
+    @contextmanager
+    def _transaction(self):
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._db.execute("ROLLBACK")
+            raise
+        self._db.execute("COMMIT")
+
+    def _load(self):
+        buckets = {}
+        for name, capacity, level, updated, empty_until in self._db.execute("SELECT * FROM rate_budget"):
+            bucket = _Bucket(capacity)
+            bucket.level, bucket.updated, bucket.empty_until = level, updated, empty_until
+            buckets[name] = bucket
+        return buckets
+
+    def _store(self, buckets):
+        self._db.executemany(
+            "UPDATE rate_budget SET capacity = ?, level = ?, updated = ?, empty_until = ? WHERE name = ?",
+            [(b.capacity, b.level, b.updated, b.empty_until, name) for name, b in buckets.items()],
+        )
+
+    def take(self, requests, tokens):
+        """Spend the budget for one call and return 0, or return the seconds to wait without spending"""
+        now = time.time()
+        with self._lock, self._transaction():
+            buckets = self._load()
+            buckets["requests"].refill(now)
+            buckets["tokens"].refill(now)
+            wait = max(
+                buckets["blocked"].empty_until - now,
+                buckets["requests"].wait_for(requests, now),
+                buckets["tokens"].wait_for(tokens, now),
+            )
+            if wait <= 0:
+                buckets["requests"].level -= requests
+                buckets["tokens"].level -= tokens
+                self._store(buckets)
+            return max(0.0, wait)
+
+    def observe(self, requests, tokens, token_limit=None, blocked_for=0.0):
+        """Lower the shared levels to what the provider reported; (remaining, reset) per bucket"""
+        now = time.time()
+        with self._lock, self._transaction():
+            buckets = self._load()
+            buckets["requests"].observe(*requests, now)
+            buckets["tokens"].observe(*tokens, now, token_limit)
+            if blocked_for > 0:
+                buckets["blocked"].empty_until = max(buckets["blocked"].empty_until, now + blocked_for)
+            self._store(buckets)
+
+    def credit(self, tokens):
+        """Return tokens reserved by take() that the call did not use"""
+        now = time.time()
+        with self._lock, self._transaction():
+            buckets = self._load()
+            buckets["tokens"].refill(now)
+            buckets["tokens"].level = min(buckets["tokens"].capacity, buckets["tokens"].level + tokens)
+            self._store(buckets)
+
+    def levels(self):
+        now = time.time()
+        with self._lock:
+            buckets = self._load()
+        for bucket in buckets.values():
+            bucket.refill(now)
+        return buckets
+
+
+class RateLimiter:
+    """Paces upstream calls under request/token budgets learned from x-ratelimit-* headers.
+
+    Concurrency adapts AIMD-style: +1/limit per success, halved on every 429. With a
+    SharedBudget the buckets (and 429 back-off) are shared by all worker processes;
+    concurrency stays per process.
+    """
+
+    def __init__(self, requests_per_min=30, tokens_per_min=6000, max_concurrency=4, max_wait=15.0, shared=None):
+        self.requests = _Bucket(requests_per_min)
+        self.tokens = _Bucket(tokens_per_min)
+        self.shared = shared
+        self.max_concurrency = max(1, max_concurrency)
+        self.concurrency = float(self.max_concurrency)
+        self.max_wait = max_wait
+        self._active = 0
+        self._blocked_until = 0.0
+        self._cond = threading.Condition()
+        self._consecutive_429 = 0
+        self.throttled = 0
+        self.rejected = 0
+        self.waited_s = 0.0
+
+    @contextmanager
+    def slot(self, estimated_tokens, max_wait=None, deadline=None):
+        """Wait for budget and a concurrency slot, then hold the slot for one upstream call.
+
+        A cancelled or expired deadline ends the wait with Cancelled/DeadlineExceeded.
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        started = time.monotonic()
+        with span("rate_limit"), (deadline.on_cancel(self._wake) if deadline else nullcontext()):
+            while True:
+                self._acquire(estimated_tokens, started, max_wait, deadline)
+                if self.shared is None:
+                    break
+                # The shared budget is a SQLite transaction that can wait on other
+                # processes, so it is asked outside the condition with the slot held
+                wait = self.shared.take(1, estimated_tokens)  # spent when 0
+                if wait <= 0:
+                    break
+                with self._cond:
+                    self._active -= 1
+                    self._cond.notify()
+                self._check_wait(time.monotonic() - started + wait, wait, max_wait)
+                if deadline is None:
+                    time.sleep(min(wait, 1.0))
+                else:
+                    deadline.wait(min(wait, 1.0))
+            with self._cond:
+                self.waited_s += time.monotonic() - started
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._active -= 1
+                self._cond.notify()
+
+    def _acquire(self, estimated_tokens, started, max_wait, deadline=None):
+        """Wait for a concurrency slot (and, without a shared budget, the local buckets) and take it"""
+        with self._cond:
+            while True:
+                if deadline is not None:
+                    deadline.check("rate_limit")
+                now = time.monotonic()
+                wait = self._blocked_until - now
+                if self.shared is None:
+                    self.requests.refill(now)
+                    self.tokens.refill(now)
+                    wait = max(wait, self.requests.wait_for(1, now), self.tokens.wait_for(estimated_tokens, now))
+                if wait <= 0 and self._active < int(self.concurrency):
+                    break
+                self._check_wait(now - started + max(wait, 0.0), wait, max_wait)
+                # A finishing call notifies; budget waits just sleep them out
+                self._cond.wait(timeout=min(wait, 1.0) if wait > 0 else 1.0)
+            if self.shared is None:
+                self.requests.level -= 1
+                self.tokens.level -= estimated_tokens
+            self._active += 1
+
+    def _wake(self):
+        """Wake the waiting calls so a cancelled one can give up its place"""
+        with self._cond:
+            self._cond.notify_all()
+
+    def _check_wait(self, total_wait, wait, max_wait):
+        """Raise RateLimited when waiting would take the call past max_wait"""
+        if total_wait > max_wait:
+            with self._cond:
+                self.rejected += 1
+            retry_after = max(wait, 1.0)
+            raise RateLimited(f"Upstream rate limit: next call possible in {retry_after:.1f}s", retry_after)
+
+    def observe(self, status_code, headers):
+        """Feed back one upstream response: rate-limit headers, 429s and successes"""
+        now = time.monotonic()
+        requests = (_header_int(headers, "x-ratelimit-remaining-requests"), parse_duration(headers.get("x-ratelimit-reset-requests")))
+        tokens = (_header_int(headers, "x-ratelimit-remaining-tokens"), parse_duration(headers.get("x-ratelimit-reset-tokens")))
+        token_limit = _header_int(headers, "x-ratelimit-limit-tokens")
+        with self._cond:
+            self.requests.observe(*requests, now)
+            self.tokens.observe(*tokens, now, token_limit)
+            delay = 0.0
+            if status_code == 429:
+                self.throttled += 1
+                self._consecutive_429 += 1
+                self.concurrency = max(1.0, self.concurrency / 2)
+                retry_after = parse_duration(headers.get("retry-after"))
+                delay = self.backoff(self._consecutive_429, retry_after)
+                self._blocked_until = max(self._blocked_until, now + delay)
+            elif 200 <= status_code < 300:
+                self._consecutive_429 = 0
+                self.concurrency = min(float(self.max_concurrency), self.concurrency + 1.0 / self.concurrency)
+            self._cond.notify_all()
+        if self.shared is not None:
+            self.shared.observe(requests, tokens, token_limit, delay)
+
+    def credit(self, tokens):
+        """Give back the part of a call's token reservation it did not use
+        (the estimate reserves max_tokens; usage says how many were generated)"""
+        if tokens <= 0:
+            return
+        if self.shared is not None:
+            self.shared.credit(tokens)
+            return
+        now = time.monotonic()
+        with self._cond:
+            self.tokens.refill(now)
+            self.tokens.level = min(self.tokens.capacity, self.tokens.level + tokens)
+            self._cond.notify_all()
+
+    @staticmethod
+    def backoff(attempt, retry_after=None):
+        """Jittered delay: retry-after plus up to 10% when the server gave one, else capped exponential"""
+        if retry_after:
+            return retry_after + random.uniform(0, retry_after * 0.1)
+        return random.uniform(0.5, 1.0) * min(8.0, 0.5 * 2 ** attempt)
+
+    def stats(self):
+        now = time.monotonic()
+        shared = self.shared.levels() if self.shared is not None else None
+        with self._cond:
+            self.requests.refill(now)
+            self.tokens.refill(now)
+            requests = shared["requests"] if shared else self.requests
+            tokens = shared["tokens"] if shared else self.tokens
+            return {
+                "shared": shared is not None,
+                "requests_available": round(requests.level, 1),
+                "requests_per_min": requests.capacity,
+                "tokens_available": round(tokens.level),
+                "tokens_per_min": tokens.capacity,
+                "concurrency_limit": int(self.concurrency),
+                "active": self._active,
+                "blocked_for_s": round(max(0.0, self._blocked_until - now), 1),
+                "throttled": self.throttled,
+                "rejected": self.rejected,
+                "waited_s": round(self.waited_s, 1),
+            }
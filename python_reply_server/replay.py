@@ -0,0 +1,168 @@
+"""Replay a /generate journal (JOURNAL_FILE) as a load test.
+
+    python3 replay.py journal.jsonl journal-20260101-000000.jsonl.gz
+    python3 replay.py journal.jsonl --speed 2 --concurrency 16
+    python3 replay.py journal.jsonl --url http://localhost:8765 --speed 0
+
+Without --url, starts mock_llm.py and python-server.py like benchmark.py does; the
+mock's median latency defaults to the median upstream time recorded in the journal.
+Calls are sent at their recorded pace (--speed 2 = twice as fast, 0 = back to back)
+and the replayed latencies are printed next to the recorded ones.
+"""
+
+import argparse
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from benchmark import free_port, parse_env, percentile, server_errors, start_server, wait_ready
+from journal import read_journal
+from mock_llm import LatencyModel, MockLLMServer
+
+ENDPOINTS = ("/generate", "/generate/stream", "/generate/batch")
+
+
+def load_calls(paths, include_failed=False):
+    """Journal entries worth replaying, oldest first"""
+    calls = []
+    for path in paths:
+        for entry in read_journal(path):
+            if entry.get("endpoint") not in ENDPOINTS or not entry.get("tweetText"):
+                continue
+            if entry.get("status") != 200 and not include_failed:
+                continue
+            calls.append(entry)
+    calls.sort(key=lambda entry: entry.get("ts", 0))
+    return calls
+
+
+def summarize(latencies):
+    latencies = sorted(latencies)
+    if not latencies:
+        return {}
+    return {
+        "p50_ms": round(percentile(latencies, 0.50), 1),
+        "p95_ms": round(percentile(latencies, 0.95), 1),
+        "p99_ms": round(percentile(latencies, 0.99), 1),
+    }
+
+
+def replay(calls, base_url, concurrency, speed, no_cache, timeout):
+    """Send calls at the recorded pace scaled by speed; returns (latencies, statuses, duration)"""
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    local = threading.local()
+
+    def send(entry):
+        session = getattr(local, "session", None)
+        if session is None:
+            session = local.session = requests.Session()
+        body = {
+            "tweetText": entry["tweetText"],
+            "images": entry.get("images") or [],
+            "tone": entry.get("tone") or "bullish",
+            "noCache": no_cache or bool(entry.get("noCache")),
+        }
+        started = time.perf_counter()
+        try:
+            # A batch item replays as the single /generate call it stood for
+            endpoint = "/generate" if entry["endpoint"] == "/generate/batch" else entry["endpoint"]
+            r = session.post(base_url + endpoint, json=body, timeout=timeout)
+            r.content
+            status = str(r.status_code)
+        except requests.RequestException:
+            status = "error"
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            if status == "200":
+                latencies.append(elapsed)
+
+    first_ts = calls[0].get("ts", 0)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for entry in calls:
+            if speed > 0:
+                due = (entry.get("ts", first_ts) - first_ts) / speed
+                wait = due - (time.perf_counter() - started)
+                if wait > 0:
+                    time.sleep(wait)
+            pool.submit(send, entry)
+    return latencies, statuses, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a /generate journal against the server")
+    parser.add_argument("journals", nargs="+", help="journal files (.jsonl or .jsonl.gz)")
+    parser.add_argument("--url", help="replay against an already running server instead of the mock")
+    parser.add_argument("--speed", type=float, default=1.0, help="pace multiplier; 0 sends back to back")
+    parser.add_argument("--concurrency", type=int, default=16, help="max requests in flight")
+    parser.add_argument("--limit", type=int, default=0, help="replay only the first N calls")
+    parser.add_argument("--no-cache", action="store_true", help="send noCache so every call reaches the upstream")
+    parser.add_argument("--include-failed", action="store_true", help="also replay calls that failed originally")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--latency-ms", type=float, help="mock median latency (default: recorded median)")
+    parser.add_argument("--dist", choices=("fixed", "uniform", "lognormal"), default="lognormal")
+    parser.add_argument("--sigma", type=float, default=0.5)
+    parser.add_argument("--p429", type=float, default=0.0, help="mock 429 probability")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="extra server environment, e.g. --env REPLY_CANDIDATES=1")
+    args = parser.parse_args()
+
+    calls = load_calls(args.journals, args.include_failed)
+    if args.limit > 0:
+        calls = calls[:args.limit]
+    if not calls:
+        raise SystemExit("nothing to replay: no /generate calls in the journal")
+
+    upstream_ms = sorted(c["fetch_ms"] for c in calls if c.get("fetch_ms") and not c.get("shared"))
+    latency_ms = args.latency_ms or (percentile(upstream_ms, 0.5) if upstream_ms else 300.0)
+    span = calls[-1].get("ts", 0) - calls[0].get("ts", 0)
+    print(f"{len(calls)} calls over {span:.0f}s recorded; replaying at "
+          f"{'full speed' if args.speed <= 0 else f'{args.speed:g}x'}")
+
+    server_env = {"RATE_LIMIT_RPM": "100000", "RATE_LIMIT_TPM": "100000000", "JOURNAL_FILE": ""}
+    server_env.update(parse_env(args.env))
+
+    mock = server = None
+    base_url = args.url.rstrip("/") if args.url else None
+    try:
+        if base_url is None:
+            mock = MockLLMServer(latency=LatencyModel(latency_ms, args.dist, args.sigma), p429=args.p429)
+            mock.start()
+            print(f"mock upstream: median {latency_ms:.0f} ms ({args.dist})")
+            port = free_port()
+            server = start_server(mock.url, port, server_env)
+            base_url = f"http://127.0.0.1:{port}"
+            try:
+                wait_ready(base_url)
+            except Exception:
+                server.kill()
+                sys.stderr.write(server_errors(server))
+                raise
+        latencies, statuses, duration = replay(
+            calls, base_url, max(1, args.concurrency), args.speed, args.no_cache, args.timeout
+        )
+    finally:
+        if server:
+            server.terminate()
+            server.wait(timeout=5)
+            server.log.close()
+        if mock:
+            mock.stop()
+
+    recorded = summarize([c["total_ms"] for c in calls if c.get("total_ms") is not None])
+    replayed = summarize(latencies)
+    print(f"\n{len(latencies)}/{len(calls)} ok in {duration:.1f}s "
+          f"({len(latencies) / duration if duration else 0:.1f} rps)  {statuses}")
+    for name, summary in (("recorded", recorded), ("replayed", replayed)):
+        if summary:
+            print(f"  {name:9} p50 {summary['p50_ms']:>8.1f}  p95 {summary['p95_ms']:>8.1f}  p99 {summary['p99_ms']:>8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
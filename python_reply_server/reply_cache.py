@@ -0,0 +1,242 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+def normalize_tweet(text):
+    """Collapse whitespace and case so trivially different copies share a key"""
+    return " ".join((text or "").split()).casefold()
+
+
+def tweet_id(tweet_text):
+    """Key for a tweet regardless of tone, model or config"""
+    return hashlib.sha1(normalize_tweet(tweet_text).encode("utf-8")).hexdigest()
+
+
+def cache_key(tweet_text, tone, image_count, model, config_version):
+    raw = "\x1f".join([
+        normalize_tweet(tweet_text),
+        (tone or "").strip().lower(),
+        str(image_count),
+        model or "",
+        str(config_version or ""),
+    ])
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+
+class ReplyCache:
+    """LRU cache of generated replies with a TTL and optional SQLite persistence.
+
+    shared=True is for several worker processes on one SQLite file: lookups read the
+    file (WAL, a point query) so a reply generated by any worker is seen by all, and
+    the file is trimmed to max_entries by age instead of by one worker's LRU order.
+    """
+
+    def __init__(self, max_entries=1000, ttl=3600.0, path=None, shared=False):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self.path = path
+        self.shared = bool(shared and path)
+        self._puts = 0
+        self._entries = OrderedDict()  # key -> (reply, expires_at, tweet id)
+        self._by_tweet = {}  # tweet id -> most recent key for that tweet
+        self._lock = threading.Lock()
+        self._db = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        if path:
+            self._open(path)
+
+    def _open(self, path):
+        self._db = sqlite3.connect(str(path), timeout=10, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS replies ("
+            "key TEXT PRIMARY KEY, reply TEXT NOT NULL, expires_at REAL NOT NULL, created_at REAL NOT NULL)"
+        )
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(replies)")}
+        if "tweet" not in columns:
+            self._db.execute("ALTER TABLE replies ADD COLUMN tweet TEXT")
+        if self.shared:
+            self._db.execute("CREATE INDEX IF NOT EXISTS replies_tweet ON replies (tweet, created_at)")
+        now = time.time()
+        self._db.execute("DELETE FROM replies WHERE expires_at <= ?", (now,))
+        rows = self._db.execute(
+            "SELECT key, reply, expires_at, tweet FROM replies ORDER BY created_at DESC LIMIT ?",
+            (self.max_entries,),
+        ).fetchall()
+        # Oldest first so the most recent rows end up most recently used
+        for key, reply, expires_at, tweet in reversed(rows):
+            self._entries[key] = (reply, expires_at, tweet)
+            if tweet:
+                self._by_tweet[tweet] = key
+
+    def _read(self, key):
+        """The row other workers may have written for key, or None"""
+        with self._lock:
+            return self._db.execute("SELECT reply, expires_at, tweet FROM replies WHERE key = ?", (key,)).fetchone()
+
+    def get(self, key):
+        now = time.time()
+        row = self._read(key) if self.shared else None
+        with self._lock:
+            if self.shared:
+                self._entries.pop(key, None)
+                if row is not None:
+                    self._entries[key] = row
+                    if row[2]:
+                        self._by_tweet[row[2]] = key
+                    self._trim_memory()
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            reply, expires_at, _ = entry
+            if expires_at <= now:
+                self._drop(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return reply
+
+    def contains(self, key):
+        """Membership check that does not touch LRU order or hit/miss stats"""
+        if self.shared:
+            row = self._read(key)
+            return row is not None and row[1] > time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and entry[1] > time.time()
+
+    def closest(self, tweet_text):
+        """Most recent reply for this tweet under any tone/model/config, even if expired.
+
+        Only meant as a degraded answer while every upstream is down.
+        """
+        with self._lock:
+            key = self._by_tweet.get(tweet_id(tweet_text))
+            entry = self._entries.get(key) if key else None
+            if entry is None and self.shared:
+                entry = self._db.execute(
+                    "SELECT reply FROM replies WHERE tweet = ? ORDER BY created_at DESC LIMIT 1", (tweet_id(tweet_text),)
+                ).fetchone()
+            return entry[0] if entry else None
+
+    def put(self, key, reply, tweet_text=None):
+        now = time.time()
+        expires_at = now + self.ttl
+        tweet = tweet_id(tweet_text) if tweet_text else None
+        with self._lock:
+            self._entries[key] = (reply, expires_at, tweet)
+            self._entries.move_to_end(key)
+            if tweet:
+                self._by_tweet[tweet] = key
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO replies (key, reply, expires_at, created_at, tweet) VALUES (?, ?, ?, ?, ?)",
+                    (key, reply, expires_at, now, tweet),
+                )
+            if self.shared:
+                self._trim_memory()
+                self._puts += 1
+                if self._puts % 100 == 0:
+                    self._trim_shared(now)
+                return
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _trim_memory(self):
+        """Shared mode: this worker's copy is only a cache of the file; caller holds the lock"""
+        while len(self._entries) > self.max_entries:
+            key, (_, _, tweet) = self._entries.popitem(last=False)
+            if tweet and self._by_tweet.get(tweet) == key:
+                del self._by_tweet[tweet]
+
+    def _trim_shared(self, now):
+        """Drop expired rows and all but the newest max_entries; caller holds the lock"""
+        deleted = self._db.execute(
+            "DELETE FROM replies WHERE expires_at <= ? OR key IN "
+            "(SELECT key FROM replies ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (now, self.max_entries),
+        ).rowcount
+        self.evictions += max(0, deleted)
+
+    def _drop(self, key):
+        """Remove one entry everywhere; caller holds the lock"""
+        _, _, tweet = self._entries.pop(key)
+        if tweet and self._by_tweet.get(tweet) == key:
+            del self._by_tweet[tweet]
+        if self._db is not None:
+            self._db.execute("DELETE FROM replies WHERE key = ?", (key,))
+
+    def stats(self):
+        with self._lock:
+            size = len(self._entries)
+        lookups = self.hits + self.misses
+        return {
+            "size": size,
+            "max_entries": self.max_entries,
+            "ttl": self.ttl,
+            "persistent": self._db is not None,
+            "shared": self.shared,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class CandidatePool:
+    """Spare replies per cache key, handed out one at a time by regenerate requests"""
+
+    def __init__(self, max_entries=1000, ttl=3600.0):
+        self.max_entries = max(1, max_entries)
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (replies best first, expires_at)
+        self._lock = threading.Lock()
+        self.served = 0
+        self.stored = 0
+
+    def put(self, key, replies):
+        if not replies:
+            return
+        with self._lock:
+            self._entries[key] = (list(replies), time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            self.stored += len(replies)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        """Next spare reply for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            replies, expires_at = entry
+            if expires_at <= time.time() or not replies:
+                del self._entries[key]
+                return None
+            reply = replies.pop(0)
+            if not replies:
+                del self._entries[key]
+            self.served += 1
+            return reply
+
+    def stats(self):
+        with self._lock:
+            return {
+                "keys": len(self._entries),
+                "spare": sum(len(replies) for replies, _ in self._entries.values()),
+                "stored": self.stored,
+                "served": self.served,
+            }
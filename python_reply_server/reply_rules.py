@@ -0,0 +1,149 @@
+import re
+from functools import lru_cache
+
+_EMOJI = re.compile(
+    "[\U0001F000-\U0001FAFF\U00002600-\U000027BF\U0001F1E6-\U0001F1FF\U00002B00-\U00002BFF️‍]"
+)
+_WORD_LIST = re.compile(
+    r"(?:avoid|don'?t use|do not use|never use|no|ban|banned)\s+(?:the\s+)?(?:words?|phrases?)"
+    r"\s*(?:like|such as|:)?\s*(.+)"
+    r"|(?:избегай|не используй|никаких).*?слов\w*\s*(?:по типу|типа|как|вроде|:)\s*(.+)"
+)
+_AVOID = re.compile(r"^\s*(?:avoid|don'?t use|do not use|never use|no|избегай|не используй)\s*:?\s*(.+)$")
+_LIMIT = re.compile(
+    r"(?:under|max(?:imum)?|at most|less than|no more than|up to|до|не больше|не более|максимум)\s*"
+    r"(\d+)\s*(chars?|characters?|symbols?|words?|симв\w*|знак\w*|слов\w*)"
+)
+# Punctuation named in words, English and Russian
+_NAMED_PUNCTUATION = {
+    "period": ".", "dots": ".", "full stop": ".", "точк": ".", "точек": ".",
+    "exclamation": "!", "восклиц": "!",
+    "question mark": "?",
+    "quote": "\"'«»“”", "кавыч": "\"'«»“”",
+    "parenthes": "()", "bracket": "()[]", "скобк": "()[]",
+    "dash": "-–—", "тире": "–—",
+    "hashtag": "#", "хештег": "#", "хэштег": "#",
+    "semicolon": ";", "colon": ":",
+    "comma": ",", "запят": ",",
+}
+_NO_EMOJI = re.compile(r"(?:no|avoid|don'?t use|do not use|never use|without|без|избегай|не используй)[^\n]*?(?:emoji|эмодзи|смайл)")
+_SHORT = re.compile(r"\b(?:short|brief|concise)\b|коротк|кратк")
+
+
+class ReplyRules:
+    """Checks compiled from the style rules in custom_prompt; score() ranks candidate replies.
+
+    Only rules that can be verified mechanically are picked up: banned words, banned
+    punctuation, emojis, length limits and a general preference for short replies.
+    """
+
+    def __init__(self, banned_words=(), banned_chars="", no_emoji=False, max_chars=None, max_words=None, short=False):
+        self.banned_words = tuple(sorted(set(banned_words)))
+        self.banned_chars = "".join(sorted(set(banned_chars)))
+        self.no_emoji = no_emoji
+        self.max_chars = max_chars
+        self.max_words = max_words
+        self.short = short
+        # Prefix match so "bet" also catches "betting"
+        self._words = (
+            re.compile(r"\b(?:" + "|".join(map(re.escape, self.banned_words)) + r")\w*", re.IGNORECASE)
+            if self.banned_words else None
+        )
+        self._chars = re.compile("[" + re.escape(self.banned_chars) + "]") if self.banned_chars else None
+
+    def violations(self, reply):
+        found = []
+        if self._words:
+            found += [f"word:{m.group(0).lower()}" for m in self._words.finditer(reply)]
+        if self._chars:
+            found += [f"char:{c}" for c in self._chars.findall(reply)]
+        if self.no_emoji and _EMOJI.search(reply):
+            found.append("emoji")
+        if self.max_chars and len(reply) > self.max_chars:
+            found.append("too_long")
+        if self.max_words and len(reply.split()) > self.max_words:
+            found.append("too_many_words")
+        return found
+
+    def score(self, reply):
+        """Higher is better; 0 for a short reply breaking no rule"""
+        if not reply:
+            return float("-inf")
+        score = 0.0
+        if self._words:
+            score -= 3 * len(self._words.findall(reply))
+        if self._chars:
+            score -= len(self._chars.findall(reply))
+        if self.no_emoji:
+            score -= 2 * len(_EMOJI.findall(reply))
+        if self.max_chars and len(reply) > self.max_chars:
+            score -= 1 + (len(reply) - self.max_chars) / 10
+        if self.max_words and len(reply.split()) > self.max_words:
+            score -= 1 + len(reply.split()) - self.max_words
+        if self.short:
+            score -= len(reply) / 100
+        return score
+
+    def rank(self, candidates):
+        """Candidates best first; ties keep the model's order"""
+        return sorted(candidates, key=self.score, reverse=True)
+
+
+@lru_cache(maxsize=16)
+def compile_rules(custom_prompt):
+    """Parse custom_prompt once per distinct text"""
+    banned_words = []
+    banned_chars = ""
+    max_chars = max_words = None
+    for line in (custom_prompt or "").lower().splitlines():
+        listed = _WORD_LIST.search(line)
+        if listed:
+            words = listed.group(1) or listed.group(2)
+            banned_words += [w for w in re.findall(r"[^\W\d_][\w']*", words) if w not in ("and", "or", "и", "или")]
+        else:
+            avoid = _AVOID.match(line)
+            if avoid:
+                rest = avoid.group(1).replace(" ", "")
+                symbols = [c for c in rest if not c.isalnum()]
+                # "avoid .–/|\!)" lists characters; "avoid hype" is not a punctuation rule
+                if symbols and len(symbols) >= len(rest) / 2:
+                    banned_chars += "".join(symbols)
+        for name, chars in _NAMED_PUNCTUATION.items():
+            if name in line and re.search(r"\b(?:no|avoid|don'?t|do not|never|without)\b|избегай|не используй|без", line):
+                banned_chars += chars
+        for number, unit in _LIMIT.findall(line):
+            if unit.startswith(("word", "слов")):
+                max_words = int(number)
+            else:
+                max_chars = int(number)
+    text = (custom_prompt or "").lower()
+    return ReplyRules(
+        banned_words,
+        banned_chars,
+        no_emoji=bool(_NO_EMOJI.search(text)),
+        max_chars=max_chars,
+        max_words=max_words,
+        short=bool(_SHORT.search(text)),
+    )
+
+
+_NUMBERING = re.compile(r"^\s*(?:\d{1,2}\s*[.):-]|[-*•])\s*")
+
+
+def split_candidates(text, clean):
+    """One reply per line (numbering and bullets stripped), cleaned and de-duplicated.
+
+    When any line is numbered or bulleted only those lines are replies, so a preamble
+    like "Here are 3 replies:" is dropped; otherwise lines ending in ':' are.
+    """
+    lines = [line for line in (text or "").splitlines() if line.strip()]
+    marked = [line for line in lines if _NUMBERING.match(line)]
+    lines = marked or [line for line in lines if not line.rstrip().endswith(":")]
+    seen = set()
+    candidates = []
+    for line in lines:
+        reply = clean(_NUMBERING.sub("", line))
+        if reply and reply.lower() not in seen:
+            seen.add(reply.lower())
+            candidates.append(reply)
+    return candidates
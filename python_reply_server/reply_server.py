@@ -1,7 +1,11 @@
 from http.server import HTTPServer, BaseHTTPRequestHandler
 import json
-import requests
 from urllib.parse import parse_qs
+from providers import Router, providers_from_env
+from upstream import UpstreamClient
+
+# Same provider layer as python-server.py: ANTHROPIC_API_KEY, GROQ_API_KEY or LOCAL_LLM_BASE_URL
+ROUTER = Router(providers_from_env(UpstreamClient()))
 
 class ReplyGeneratorHandler(BaseHTTPRequestHandler):
     
@@ -81,8 +85,10 @@ class ReplyGeneratorHandler(BaseHTTPRequestHandler):
             self.wfile.write(json.dumps({'status': 'ok'}).encode('utf-8'))
     
     def generate_reply(self, tweet_text, images, tone):
-        """Generate reply using Claude API"""
-        
+        """Generate reply using the fastest configured provider"""
+        if not ROUTER.providers:
+            raise Exception("No provider configured. Set ANTHROPIC_API_KEY (or GROQ_API_KEY / LOCAL_LLM_BASE_URL) and restart server.")
+
         prompt = f"""You are an expert at crafting viral X (Twitter) replies for crypto and Polymarket content.
 
 TWEET TO REPLY TO:
@@ -108,26 +114,9 @@ Generate ONE perfect reply. The reply must:
 
 Return ONLY the reply text, nothing else. No quotes, no preamble, just the reply."""
 
-        # Call Claude API
-        response = requests.post(
-            'https://api.anthropic.com/v1/messages',
-            headers={
-                'Content-Type': 'application/json',
-            },
-            json={
-                'model': 'claude-sonnet-4-20250514',
-                'max_tokens': 300,
-                'messages': [
-                    {
-                        'role': 'user',
-                        'content': prompt
-                    }
-                ]
-            }
-        )
-        
-        data = response.json()
-        reply = data['content'][0]['text'].strip()
+        # Call the provider router (timeouts and retries included)
+        completion = ROUTER.complete(prompt, max_tokens=300)
+        reply = completion.text.strip()
         
         return reply
     
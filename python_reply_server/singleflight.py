@@ -0,0 +1,73 @@
+import threading
+
+from deadline import Cancelled, Deadline, DeadlineExceeded, FlightDeadline
+from tracing import span
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.deadline = FlightDeadline()
+
+
+class SingleFlight:
+    """Collapses concurrent calls with the same key into one execution"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executed = 0
+        self.coalesced = 0
+
+    def do(self, key, fn, deadline=None):
+        """Run fn(flight_deadline) once per key at a time; returns (result, shared).
+
+        The shared call runs under a FlightDeadline joined by every caller's deadline,
+        so it is cancelled only when all of them have given up. A follower whose own
+        deadline passes stops waiting with DeadlineExceeded (or Cancelled).
+        """
+        deadline = deadline or Deadline()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self.executed += 1
+            else:
+                self.coalesced += 1
+            call.deadline.add(deadline)
+
+        if not leader:
+            with span("single_flight"):
+                while not call.done.wait(deadline.timeout(0.1)):
+                    if deadline.cancelled():
+                        raise Cancelled("single_flight", deadline.reason)
+                    if deadline.expired():
+                        call.deadline.leave()
+                        raise DeadlineExceeded("single_flight")
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn(call.deadline)
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self):
+        with self._lock:
+            in_flight = len(self._calls)
+        return {
+            "in_flight": in_flight,
+            "executed": self.executed,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,157 @@
+import re
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+
+# The trace of the request the current thread is working on (see activate/bind)
+_state = threading.local()
+
+TRACE_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+class Trace:
+    """Timed spans of one request: where its wall time went, stage by stage.
+
+    Spans nest (the upstream stage holds the rate limiter wait, each HTTP attempt
+    and the backoff between them); depth keeps that structure for the slow log.
+    """
+
+    def __init__(self, trace_id=None, label=""):
+        self.trace_id = trace_id if trace_id and TRACE_ID.match(trace_id) else uuid.uuid4().hex[:16]
+        self.label = label
+        self.started = time.perf_counter()
+        self.spans = []  # (name, start_ms, duration_ms, depth, attrs) in completion order
+        self._lock = threading.Lock()
+
+    def add(self, name, started, ended, depth=0, **attrs):
+        with self._lock:
+            self.spans.append((name, (started - self.started) * 1000, (ended - started) * 1000, depth, attrs))
+
+    def total_ms(self):
+        return (time.perf_counter() - self.started) * 1000
+
+    def ordered(self):
+        """Spans by start time, outer before inner"""
+        with self._lock:
+            return sorted(self.spans, key=lambda s: (s[1], s[3]))
+
+    def breakdown(self):
+        """{span name: total ms}; repeated spans (retries) add up"""
+        totals = {}
+        for name, _, duration, _, _ in self.ordered():
+            totals[name] = round(totals.get(name, 0.0) + duration, 1)
+        return totals
+
+    def server_timing(self):
+        """Server-Timing header value (shown in the browser's network panel)"""
+        return ", ".join(f"{name};dur={ms}" for name, ms in self.breakdown().items())
+
+    def describe(self):
+        """One line: top-level spans, nested ones in brackets after their parent"""
+        line = ""
+        depth = 0
+        for name, _, duration, span_depth, attrs in self.ordered():
+            if span_depth > depth:
+                line += " [" * (span_depth - depth)
+            elif span_depth < depth:
+                line += "]" * (depth - span_depth) + ", "
+            elif line:
+                line += ", "
+            depth = span_depth
+            note = ",".join(f"{k}={v}" for k, v in attrs.items())
+            line += f"{name} {duration:.1f}" + (f" ({note})" if note else "")
+        return line + "]" * depth
+
+    def to_dict(self):
+        return {
+            "trace_id": self.trace_id,
+            "label": self.label,
+            "total_ms": round(self.total_ms(), 1),
+            "spans": [
+                dict(name=name, start_ms=round(start, 1), duration_ms=round(duration, 1), depth=depth, **attrs)
+                for name, start, duration, depth, attrs in self.ordered()
+            ],
+        }
+
+
+def current_trace():
+    """The trace active in this thread, or None"""
+    return getattr(_state, "trace", None)
+
+
+@contextmanager
+def activate(trace, depth=0):
+    """Make trace the current one for spans recorded by this thread"""
+    previous = (current_trace(), getattr(_state, "depth", 0))
+    _state.trace, _state.depth = trace, depth
+    try:
+        yield trace
+    finally:
+        _state.trace, _state.depth = previous
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time the block as a span of the current trace; a no-op without one.
+
+    Yields the span's attrs, so the block can add what it learns (a status code).
+    """
+    trace = current_trace()
+    if trace is None:
+        yield attrs
+        return
+    depth = _state.depth
+    _state.depth = depth + 1
+    started = time.perf_counter()
+    try:
+        yield attrs
+    except BaseException as e:
+        attrs["error"] = type(e).__name__
+        raise
+    finally:
+        _state.depth = depth
+        trace.add(name, started, time.perf_counter(), depth, **attrs)
+
+
+def bind(fn):
+    """Wrap fn to run under the caller's trace when called from another thread (a pool)"""
+    trace = current_trace()
+    if trace is None:
+        return fn
+    depth = _state.depth
+
+    def traced(*args, **kwargs):
+        with activate(trace, depth):
+            return fn(*args, **kwargs)
+
+    return traced
+
+
+class SlowRequestLog:
+    """Logs requests slower than threshold_ms with their span breakdown and keeps the last few"""
+
+    def __init__(self, threshold_ms, keep=50):
+        self.threshold_ms = threshold_ms
+        self._recent = deque(maxlen=keep)
+        self._lock = threading.Lock()
+        self.slow = 0
+
+    def observe(self, trace):
+        if self.threshold_ms <= 0:
+            return
+        total = trace.total_ms()
+        if total < self.threshold_ms:
+            return
+        with self._lock:
+            self.slow += 1
+            self._recent.append(trace.to_dict())
+        print(f"🐢 Slow {trace.label} {total:.0f} ms [trace {trace.trace_id}]: {trace.describe()}")
+
+    def recent(self):
+        with self._lock:
+            return list(self._recent)
+
+    def stats(self):
+        return {"threshold_ms": self.threshold_ms, "slow": self.slow}
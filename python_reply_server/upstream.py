@@ -0,0 +1,131 @@
+import socket
+import threading
+from contextlib import contextmanager, nullcontext
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# Connections used by the calling thread inside UpstreamClient.cancellable()
+_tracking = threading.local()
+
+
+class _TrackedMixin:
+    def request(self, *args, **kwargs):
+        conns = getattr(_tracking, "conns", None)
+        if conns is not None:
+            conns.append(self)
+        return super().request(*args, **kwargs)
+
+
+class _TrackedHTTPConnection(_TrackedMixin, HTTPConnection):
+    pass
+
+
+class _TrackedHTTPSConnection(_TrackedMixin, HTTPSConnection):
+    pass
+
+
+class _TrackedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = _TrackedHTTPConnection
+
+
+class _TrackedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = _TrackedHTTPSConnection
+
+
+class UpstreamClient:
+    """Process-wide HTTP client with a shared keep-alive connection pool"""
+
+    def __init__(self, pool_size=10, connect_timeout=5.0, read_timeout=30.0):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        # One adapter (and so one urllib3 pool per host) shared by every thread;
+        # each thread gets its own Session because Session state is not thread-safe
+        self._adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=False)
+        self._adapter.poolmanager.pool_classes_by_scheme = {
+            "http": _TrackedHTTPConnectionPool,
+            "https": _TrackedHTTPSConnectionPool,
+        }
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.aborted = 0
+
+    def _session(self):
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = requests.Session()
+            session.mount("https://", self._adapter)
+            session.mount("http://", self._adapter)
+            self._local.session = session
+        return session
+
+    @contextmanager
+    def cancellable(self, cancel):
+        """Abort calls made in this block (and streamed responses read in it) when cancel fires.
+
+        cancel is a Deadline; its cancel() shuts down the sockets of the connections the
+        block used, so a thread blocked reading the upstream gets a ConnectionError right
+        away instead of waiting out the read timeout. The broken connection is dropped
+        from the pool by urllib3.
+        """
+        conns = []
+        previous = getattr(_tracking, "conns", None)
+        _tracking.conns = conns
+
+        def abort():
+            for conn in list(conns):
+                sock = getattr(conn, "sock", None)
+                if sock is None:
+                    continue
+                # Counted before the shutdown wakes the request thread
+                with self._lock:
+                    self.aborted += 1
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+        try:
+            with cancel.on_cancel(abort):
+                yield
+        finally:
+            _tracking.conns = previous
+            if previous is not None:
+                previous.extend(conns)
+
+    def post(self, url, timeout=None, cancel=None, **kwargs):
+        """POST through the shared pool; timeout defaults to (connect, read).
+
+        With cancel (a Deadline), cancelling it aborts the call; see cancellable().
+        """
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        with self.cancellable(cancel) if cancel is not None else nullcontext():
+            return self._session().post(url, timeout=timeout, **kwargs)
+
+    def get(self, url, timeout=None, **kwargs):
+        if timeout is None:
+            timeout = (self.connect_timeout, self.read_timeout)
+        return self._session().get(url, timeout=timeout, **kwargs)
+
+    def stats(self):
+        """Connection reuse counters summed over all host pools"""
+        pools = self._adapter.poolmanager.pools
+        opened = 0
+        sent = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            opened += pool.num_connections
+            sent += pool.num_requests
+        return {
+            "pool_size": self.pool_size,
+            "requests": sent,
+            "new_connections": opened,
+            "reused_connections": max(0, sent - opened),
+            "aborted": self.aborted,
+        }
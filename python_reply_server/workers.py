@@ -0,0 +1,129 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+
+
+class Supervisor:
+    """Runs `workers` copies of the server on one port (each binds it with SO_REUSEPORT).
+
+    Workers get WORKER_ID (their slot, 0..workers-1) in the environment. A worker that
+    dies is started again, with a growing delay if it keeps dying right away.
+    SIGHUP restarts the workers one at a time: the replacement starts first, then the
+    old worker gets SIGTERM and drains its in-flight requests before exiting. The two
+    overlap, so the replacement's WORKER_ID carries a generation ("0-1", "0-2", ...)
+    and it never shares a journal file or metrics row with the worker it replaces.
+    SIGTERM/SIGINT drain and stop all of them.
+    """
+
+    def __init__(self, command, workers, drain_timeout=30.0, start_grace=1.0):
+        self.command = command
+        self.workers = max(1, workers)
+        self.drain_timeout = drain_timeout
+        self.start_grace = start_grace
+        self._procs = {}  # slot -> Popen
+        self._started = {}  # slot -> start time
+        self._delays = {}  # slot -> restart delay after a quick crash
+        self._generations = {}  # slot -> rolling restarts so far
+        self._draining = []  # replaced workers finishing their requests
+        self._stopping = False
+        self._reload = False
+        self.restarts = 0
+
+    def _spawn(self, slot):
+        generation = self._generations.get(slot, 0)
+        worker_id = f"{slot}-{generation}" if generation else str(slot)
+        env = dict(os.environ, WORKER_ID=worker_id, WORKERS=str(self.workers))
+        proc = subprocess.Popen(self.command, env=env)
+        self._procs[slot] = proc
+        self._started[slot] = time.monotonic()
+        print(f"👷 Worker {worker_id} started (pid {proc.pid})")
+        return proc
+
+    def _on_stop(self, signum, frame):
+        self._stopping = True
+
+    def _on_reload(self, signum, frame):
+        self._reload = True
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        if hasattr(signal, "SIGHUP"):
+            signal.signal(signal.SIGHUP, self._on_reload)
+        for slot in range(self.workers):
+            self._spawn(slot)
+        while not self._stopping:
+            time.sleep(0.5)
+            self._reap_drained()
+            if self._reload:
+                self._reload = False
+                self._rolling_restart()
+                continue
+            for slot, proc in list(self._procs.items()):
+                if proc.poll() is not None and not self._stopping:
+                    self._respawn(slot, proc.returncode)
+        return self._shutdown()
+
+    def _respawn(self, slot, code):
+        uptime = time.monotonic() - self._started[slot]
+        # Crash loops back off up to 30s; a worker that ran for a while restarts at once
+        delay = min(30.0, self._delays.get(slot, 0.5) * 2) if uptime < 10 else 0.0
+        self._delays[slot] = delay or 0.5
+        print(f"⚠️  Worker {slot} exited with {code} after {uptime:.0f}s, restarting in {delay:.1f}s")
+        deadline = time.monotonic() + delay
+        while time.monotonic() < deadline and not self._stopping:
+            time.sleep(0.1)
+        if not self._stopping:
+            self.restarts += 1
+            self._spawn(slot)
+
+    def _rolling_restart(self):
+        print("🔄 Restarting workers one by one")
+        for slot in range(self.workers):
+            old = self._procs.get(slot)
+            self._generations[slot] = self._generations.get(slot, 0) + 1
+            new = self._spawn(slot)
+            time.sleep(self.start_grace)
+            if new.poll() is not None:
+                if old is None or old.poll() is not None:
+                    # Nothing to fall back to; the main loop respawns the slot
+                    print(f"⚠️  Replacement for worker {slot} exited with {new.returncode}")
+                    return
+                # Keep the old worker serving rather than leave the slot empty
+                print(f"⚠️  Replacement for worker {slot} exited with {new.returncode}, keeping pid {old.pid}")
+                self._procs[slot] = old
+                return
+            if old is not None and old.poll() is None:
+                old.send_signal(signal.SIGTERM)
+                self._draining.append((old, time.monotonic() + self.drain_timeout + 5))
+            self.restarts += 1
+
+    def _reap_drained(self):
+        still = []
+        for proc, deadline in self._draining:
+            if proc.poll() is None:
+                if time.monotonic() > deadline:
+                    proc.kill()
+                still.append((proc, deadline))
+        self._draining = still
+
+    def _shutdown(self):
+        print("🛑 Stopping workers, draining in-flight requests")
+        procs = list(self._procs.values()) + [proc for proc, _ in self._draining]
+        for proc in procs:
+            if proc.poll() is None:
+                proc.send_signal(signal.SIGTERM)
+        deadline = time.monotonic() + self.drain_timeout + 5
+        for proc in procs:
+            try:
+                proc.wait(timeout=max(0.1, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        return 0
+
+
+def run_supervisor(script, workers, drain_timeout):
+    """Supervise `workers` copies of script (this interpreter, same arguments)"""
+    return Supervisor([sys.executable, script] + sys.argv[1:], workers, drain_timeout).run()